@@ -0,0 +1,357 @@
+"""Admission control: a concurrency limit for API requests that adapts to MongoDB latency.
+
+When MongoDB slows down, requests pile up and every client waits longer. The
+limiter caps how many API requests run at once. Requests over the limit
+wait in a bounded queue, and a request that can't start within
+ADMISSION_QUEUE_TIMEOUT seconds, or finds the queue full, is answered at
+once with 503 and Retry-After.
+
+The limit follows MongoDB command latency (AIMD). Every WINDOW seconds the
+mean command time is compared with ADMISSION_LATENCY_TARGET_MS: above it
+(or on failed commands) the limit is multiplied by BACKOFF, below it the
+limit grows by one if requests had to wait. It stays between
+ADMISSION_MIN_LIMIT and ADMISSION_MAX_LIMIT, and starts at the maximum.
+
+Routes belong to one of three classes (see ROUTE_CLASSES in app.py):
+- READ: cheap lookups by id; first in the queue, may use the whole limit;
+- WRITE: single adds and deletes; may use 3/4 of the limit;
+- HEAVY: lists, searches, exports and bulk imports; may use half of it.
+A full queue makes room for a request by dropping the newest waiter of a
+lower class. Routes without a class (health checks, metrics, pages, static
+files) are never limited.
+
+ADMISSION_ROUTES overrides the class of single routes and can give a route
+its own share of the limit, on top of its class's, e.g.
+"export_csv:heavy:0.1,get_by_name:read" keeps CSV exports to a tenth of
+the limit and moves name searches up to the read class.
+"""
+import asyncio
+import bisect
+import itertools
+import threading
+import time
+
+from pymongo import monitoring
+
+import metrics
+
+READ, WRITE, HEAVY = 0, 1, 2
+CLASS_NAMES = {READ: "read", WRITE: "write", HEAVY: "heavy"}
+CLASS_IDS = {name: klass for klass, name in CLASS_NAMES.items()}
+
+# Share of the limit each class may hold at once
+SHARES = {READ: 1.0, WRITE: 0.75, HEAVY: 0.5}
+
+# Seconds of command timings per limit adjustment
+WINDOW = 0.25
+# Multiplicative decrease when MongoDB is slower than the target
+BACKOFF = 0.7
+
+# Commands that don't measure load: change stream and cursor waits, pings
+IGNORED_COMMANDS = {"getMore", "hello", "isMaster", "ismaster", "ping", "endSessions"}
+
+
+class Overloaded(Exception):
+    """A request was shed: the queue was full or it waited too long."""
+
+    def __init__(self, reason):
+        super().__init__(f"Server overloaded ({reason})")
+        self.reason = reason
+
+
+def parse_routes(text):
+    """Parse ADMISSION_ROUTES, "view:class[:share],...", into {view: (class, share or None)}."""
+    routes = {}
+    for item in filter(None, (part.strip() for part in text.split(","))):
+        view, _, rest = item.partition(":")
+        name, _, share = rest.partition(":")
+        if not view or name not in CLASS_IDS:
+            raise ValueError(f"Invalid ADMISSION_ROUTES entry {item!r}: expected view:read|write|heavy[:share]")
+        share = float(share) if share else None
+        if share is not None and not 0 < share <= 1:
+            raise ValueError(f"Invalid ADMISSION_ROUTES entry {item!r}: share must be in (0, 1]")
+        routes[view] = (CLASS_IDS[name], share)
+    return routes
+
+
+class Waiter:
+    __slots__ = ("klass", "route", "granted", "dropped", "event")
+
+    def __init__(self, klass, route, event):
+        self.klass = klass
+        self.route = route
+        self.granted = False
+        self.dropped = False
+        self.event = event
+
+
+class LatencyListener(monitoring.CommandListener):
+    """Feeds MongoDB command times to the limiter."""
+
+    def __init__(self, limiter):
+        self.limiter = limiter
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        if event.command_name not in IGNORED_COMMANDS:
+            self.limiter.observe(event.duration_micros / 1e6)
+
+    def failed(self, event):
+        if event.command_name not in IGNORED_COMMANDS:
+            self.limiter.observe(event.duration_micros / 1e6, failed=True)
+
+
+class AdmissionLimiter:
+    """Adaptive concurrency limit with a priority wait queue, shared by the threads of a process."""
+
+    def __init__(self, route_classes):
+        # View function name -> READ, WRITE or HEAVY
+        self.route_classes = dict(route_classes)
+        # View function name -> share of the limit, for routes given one in ADMISSION_ROUTES
+        self.route_shares = {}
+        self.enabled = True
+        self.min_limit = 4
+        self.max_limit = 256
+        self.target = 0.1
+        self.queue_size = 64
+        self.timeout = 0.5
+        self.limit = float(self.max_limit)
+        self.in_flight = {READ: 0, WRITE: 0, HEAVY: 0}
+        self.route_in_flight = {}
+        self._waiters = []
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+        self.reset_window()
+
+    def init_app(self, app, mongo):
+        config = app.config
+        self.enabled = config["ADMISSION_CONTROL"]
+        self.min_limit = config["ADMISSION_MIN_LIMIT"]
+        self.max_limit = max(config["ADMISSION_MAX_LIMIT"], self.min_limit)
+        self.target = config["ADMISSION_LATENCY_TARGET_MS"] / 1000
+        self.queue_size = config["ADMISSION_QUEUE_SIZE"]
+        self.timeout = config["ADMISSION_QUEUE_TIMEOUT"]
+        self.limit = float(self.max_limit)
+        for view, (klass, share) in parse_routes(config["ADMISSION_ROUTES"]).items():
+            self.route_classes[view] = klass
+            if share is not None:
+                self.route_shares[view] = share
+        metrics.ADMISSION_LIMIT.set(self.limit)
+        self.reset_window()
+        if self.enabled:
+            mongo.client_options.setdefault("event_listeners", []).append(LatencyListener(self))
+            self.register_hooks(app)
+
+    def route(self, endpoint):
+        """The view name of a limited endpoint, or None."""
+        if not self.enabled or endpoint is None:
+            return None
+        view = endpoint.rsplit(".", 1)[-1]
+        return view if view in self.route_classes else None
+
+    # Limit
+
+    def reset_window(self):
+        self.window_start = time.monotonic()
+        self.window_total = 0.0
+        self.window_count = 0
+        self.window_failed = False
+        self.window_waited = False
+
+    def observe(self, duration, failed=False):
+        """Record one MongoDB command; adjusts the limit once per WINDOW."""
+        with self._lock:
+            self.window_total += duration
+            self.window_count += 1
+            self.window_failed = self.window_failed or failed
+            if time.monotonic() - self.window_start >= WINDOW:
+                self.adjust()
+
+    def adjust(self):
+        if self.window_failed or self.window_total / self.window_count > self.target:
+            self.limit = max(self.min_limit, self.limit * BACKOFF)
+        elif self.window_waited:
+            self.limit = min(self.max_limit, self.limit + 1)
+            # A higher limit may let waiters in
+            self.grant_waiters()
+        metrics.ADMISSION_LIMIT.set(self.limit)
+        self.reset_window()
+
+    def fits(self, klass, route):
+        """Whether a request of `klass` to `route` may start now (call with the lock held)."""
+        total = sum(self.in_flight.values())
+        if total >= int(self.limit):
+            return False
+        share = self.route_shares.get(route)
+        if share is not None and self.route_in_flight.get(route, 0) >= max(1, int(self.limit * share)):
+            return False
+        if klass == READ:
+            return True
+        # Lower classes count what they and the classes below them hold
+        held = sum(count for other, count in self.in_flight.items() if other >= klass)
+        return held < max(1, int(self.limit * SHARES[klass]))
+
+    # Queue
+
+    def try_acquire(self, klass, route, event_factory):
+        """Start now (None), or return the Waiter to wait on. Raises Overloaded if the queue is full."""
+        with self._lock:
+            # Waiters of the same or a higher class go first
+            if (not self._waiters or self._waiters[0][0] > klass) and self.fits(klass, route):
+                self.take(klass, route)
+                return None
+            self.window_waited = True
+            if len(self._waiters) >= self.queue_size and not self.drop_lower(klass):
+                raise self.shed(klass, "queue full")
+            waiter = Waiter(klass, route, event_factory())
+            # Kept sorted by (class, arrival)
+            bisect.insort(self._waiters, (klass, next(self._sequence), waiter))
+            # It may fit where the waiters ahead of it don't (see SHARES and route shares)
+            self.grant_waiters()
+            return waiter
+
+    def drop_lower(self, klass):
+        """Shed the newest waiter of a class below `klass`; False if there is none."""
+        if not self._waiters or self._waiters[-1][0] <= klass:
+            return False
+        waiter = self._waiters.pop()[2]
+        waiter.dropped = True
+        self.wake(waiter)
+        return True
+
+    def grant_waiters(self):
+        """Start waiters in priority order while they fit (call with the lock held)."""
+        waiting = []
+        for entry in self._waiters:
+            if self.fits(entry[0], entry[2].route):
+                self.grant(entry[2])
+            else:
+                # A lower class may still fit where this one doesn't (see SHARES)
+                waiting.append(entry)
+        self._waiters = waiting
+
+    def take(self, klass, route):
+        self.in_flight[klass] += 1
+        self.route_in_flight[route] = self.route_in_flight.get(route, 0) + 1
+
+    def grant(self, waiter):
+        self.take(waiter.klass, waiter.route)
+        waiter.granted = True
+        self.wake(waiter)
+
+    def wake(self, waiter):
+        waiter.event.set()
+
+    def timed_out(self, waiter):
+        """The waiter's deadline passed: leave the queue, unless it was let in meanwhile."""
+        with self._lock:
+            if waiter.granted:
+                return
+            self.leave(waiter)
+            raise self.shed(waiter.klass, "queue timeout")
+
+    def leave(self, waiter):
+        self._waiters = [entry for entry in self._waiters if entry[2] is not waiter]
+
+    def checked(self, waiter):
+        """The waiter woke up: admitted, or dropped for a higher class."""
+        if waiter.dropped:
+            raise self.shed(waiter.klass, "dropped")
+
+    def shed(self, klass, reason):
+        metrics.ADMISSION_SHED.labels(CLASS_NAMES[klass], reason).inc()
+        return Overloaded(reason)
+
+    def release(self, klass, route):
+        with self._lock:
+            self.in_flight[klass] -= 1
+            self.route_in_flight[route] -= 1
+            self.grant_waiters()
+
+    # Flask hooks
+
+    def acquire(self, klass, route):
+        """Wait until a request of `klass` to `route` may start; raises Overloaded if it can't."""
+        waiter = self.try_acquire(klass, route, threading.Event)
+        if waiter is None:
+            return
+        if not waiter.event.wait(self.timeout):
+            self.timed_out(waiter)
+        self.checked(waiter)
+
+    def before_request(self, g, request):
+        route = self.route(request.endpoint)
+        if route is not None:
+            klass = self.route_classes[route]
+            self.acquire(klass, route)
+            g.admission = (klass, route)
+
+    def teardown_request(self, g):
+        # Runs for shed and failed requests too; only admitted ones hold a slot
+        admission = g.pop("admission", None)
+        if admission is not None:
+            self.release(*admission)
+
+    def register_hooks(self, app):
+        from flask import g, request
+
+        app.before_request(lambda: self.before_request(g, request))
+        app.teardown_request(lambda error=None: self.teardown_request(g))
+
+
+class AsyncAdmissionLimiter(AdmissionLimiter):
+    """AdmissionLimiter for the async app: waiters are futures on the event loop.
+
+    Slots are released on the loop, but MongoDB timings arrive from Motor's
+    threads, so a limit increase wakes waiters through call_soon_threadsafe.
+    """
+
+    def wake(self, waiter):
+        loop = waiter.event.get_loop()
+        loop.call_soon_threadsafe(self.resolve, waiter.event)
+
+    @staticmethod
+    def resolve(future):
+        if not future.done():
+            future.set_result(None)
+
+    async def acquire(self, klass, route):
+        waiter = self.try_acquire(klass, route, asyncio.get_running_loop().create_future)
+        if waiter is None:
+            return
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.event), self.timeout)
+        except asyncio.TimeoutError:
+            self.timed_out(waiter)
+        except asyncio.CancelledError:
+            # The client went away: give up the place in the queue, or the slot
+            self.abandon(waiter)
+            raise
+        self.checked(waiter)
+
+    def abandon(self, waiter):
+        with self._lock:
+            if not waiter.granted:
+                self.leave(waiter)
+                return
+        self.release(waiter.klass, waiter.route)
+
+    async def before_request(self, g, request):
+        route = self.route(request.endpoint)
+        if route is not None:
+            klass = self.route_classes[route]
+            await self.acquire(klass, route)
+            g.admission = (klass, route)
+
+    def register_hooks(self, app):
+        from quart import g, request
+
+        @app.before_request
+        async def admit():
+            await self.before_request(g, request)
+
+        @app.teardown_request
+        async def release(error=None):
+            self.teardown_request(g)
@@ -1,154 +1,624 @@
-from flask import Flask, jsonify, request, render_template
-from pymongo import MongoClient
-from pymongo.errors import ConnectionFailure, ServerSelectionTimeoutError
-import sys
-import os
-from datetime import datetime
-
-# Initialize Flask app
-app = Flask(__name__)
-
-# Connect to MongoDB with error handling
-try:
-    # Use Docker-compatible connection string with fallback options
-    # When running in Docker, use the service name defined in docker-compose
-    # or the special 'host.docker.internal' DNS to access host from container
-    mongo_host = "mongo" if "DOCKER_ENV" in os.environ else "host.docker.internal"
-    
-    # Try different connection options in sequence
-    try:
-        # First try the Docker service name
-        client = MongoClient(f"mongodb://{mongo_host}:27017", 
-                           serverSelectionTimeoutMS=2000)
-        client.server_info()  # This will raise an exception if connection fails
-    except Exception:
-        # If Docker service name fails, try host.docker.internal 
-        mongo_host = "host.docker.internal"
-        client = MongoClient(f"mongodb://{mongo_host}:27017", 
-                           serverSelectionTimeoutMS=2000)
-        client.server_info()
-        
-    print(f"Successfully connected to MongoDB at {mongo_host}:27017")
-    db = client["student_db"]
-    students_collection = db["students"]
-except (ConnectionFailure, ServerSelectionTimeoutError) as e:
-    print(f"Failed to connect to MongoDB: {e}")
-    print("Please ensure MongoDB is running and accessible")
-    sys.exit(1)
+from flask import Flask, Blueprint, current_app, jsonify, request, render_template, Response, stream_with_context
+from pymongo.errors import ConnectionFailure, PyMongoError
+import time
+import hashlib
+import functools
+import threading
+from datetime import datetime, timezone
+from student_fields import (
+    NATURAL_KEY, normalize_name, validate_student, build_student,
+    student_document, parse_fields, parse_filters, parse_sort, DEFAULT_SORT,
+    encode_cursor, cursor_query, parse_as_of, parse_age_range, parse_birthday_days,
+    age_query, birthday_ranges, next_birthday, AGE_SORT, BIRTHDAY_SORT
+)
+from student_stats import summarize
+from cache import LRUCache
+from insert_queue import InsertQueue, QueueFull
+from change_watcher import ChangeWatcher
+from admission import AdmissionLimiter, Overloaded, READ, WRITE, HEAVY
+from database import Mongo
+from repository import MongoRepository, create_repository
+from config import config_from_env
+from serializers import format_student
+import metrics
+import serializers
+import profiling
+import compression
+
+# MongoDB connection, configured by create_app() and opened on first use
+mongo = Mongo()
+
+# Where students are stored (STORAGE_BACKEND, see repository.py); set by create_app()
+repository = MongoRepository(mongo)
+
+# Routes, registered on the app by create_app()
+bp = Blueprint("students", __name__)
+
+# Page sizes for cursor pagination on GET /api/students
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+# Documents fetched per round trip when streaming the full collection
+STREAM_BATCH_SIZE = 1000
+
+# Default and maximum number of results returned by a name search
+SEARCH_LIMIT = 50
+MAX_SEARCH_LIMIT = 500
+
+# Documents sent per insert_many / bulk_write call by the bulk endpoint
+BULK_BATCH_SIZE = 1000
+
+def update_stats(students, delta):
+    """Add `delta` to the summary buckets of each student, one round trip in total."""
+    if students:
+        repository.update_stats(students, delta)
+        watcher.stats_changed()
+
+def rebuild_stats():
+    """Recompute the summary from the stored students."""
+    repository.rebuild_stats()
+    watcher.stats_changed()
+
+def get_stats():
+    """Read the materialized headcount summary (from memory while the change stream runs)."""
+    buckets = watcher.stats_buckets()
+    if buckets is None:
+        generation = watcher.generation
+        buckets = repository.stats_buckets()
+        watcher.store_buckets(buckets, generation)
+    return summarize(buckets)
+
+def ensure_stats():
+    """Build the summary once if it has never been built."""
+    if not repository.has_stats():
+        rebuild_stats()
+
+# Read-through cache for single student lookups, keyed by id; sized by create_app()
+student_cache = LRUCache()
+
+# Admission class of each API view (see admission.py); other views aren't limited
+ROUTE_CLASSES = {
+    "get_by_id": READ, "stats": READ, "cache_stats": READ,
+    "add": WRITE, "delete": WRITE,
+    "get_all": HEAVY, "get_by_name": HEAVY, "export_csv": HEAVY, "add_bulk": HEAVY,
+    "get_by_age": HEAVY, "birthdays": HEAVY,
+}
+limiter = AdmissionLimiter(ROUTE_CLASSES)
+
+# Applies every instance's writes to this process's cache, stats and version
+watcher = ChangeWatcher(mongo, student_cache)
 
 # Database functions
+def bump_version():
+    """Record that the students collection changed (drives ETag/Last-Modified)."""
+    state = repository.bump_version()
+    watcher.local_version(state)
+
+def get_version():
+    """Return (version, last modified time) of the students collection."""
+    if watcher.version is not None:
+        return watcher.version
+    state = repository.version_document()
+    if state is None:
+        return 0, None
+    return state["version"], state["modified"].replace(tzinfo=timezone.utc)
+
 def add_student(data):
-    student = {
-        "first_name": data["first_name"],
-        "last_name": data["last_name"],
-        "dob": data["dob"],
-        "class": data["class"],
-        "session": data["session"],
-        "created_date": datetime.now().strftime("%Y-%m-%d")
-    }
-    result = students_collection.insert_one(student)
-    student["_id"] = str(result.inserted_id)  # Convert ObjectId to string
+    student = build_student(data)
+    document = student_document(student)
+    if insert_queue.enabled:
+        # Written with other queued students by the flusher (write_queued)
+        insert_queue.insert(document)
+        student["_id"] = str(document["_id"])
+        return student
+    student["_id"] = str(repository.insert_one(document))  # Convert ObjectId to string
+    student_cache.set(student["_id"], format_student(document))
+    update_stats([document], 1)
+    bump_version()
     return student
 
-def get_students():
+def write_queued(documents):
+    """Store a batch from the insert queue; return an error message or None per document."""
+    metrics.INSERT_BATCH_SIZE.observe(len(documents))
+    results = insert_batch(list(enumerate(documents)))
+    for document, result in zip(documents, results):
+        if result["status"] == "inserted":
+            student_cache.set(result["id"], format_student(document))
+    if any(result["status"] == "inserted" for result in results):
+        bump_version()
+    return [result.get("error") for result in results]
+
+# Group commit for POST /api/students, configured by create_app()
+insert_queue = InsertQueue(write_queued)
+
+def insert_batch(batch):
+    """Insert (index, document) pairs in one round trip and return per-record results."""
+    failed = repository.insert_many([document for _, document in batch])
+
+    results = []
+    inserted = []
+    for position, (index, document) in enumerate(batch):
+        if position in failed:
+            results.append({"index": index, "status": "rejected", "error": failed[position]})
+        else:
+            results.append({"index": index, "status": "inserted", "id": str(document["_id"])})
+            inserted.append(document)
+    update_stats(inserted, 1)
+    return results
+
+def upsert_batch(batch):
+    """Insert or update (index, document) pairs matched on the natural key."""
+    upserted, failed = repository.upsert_many([document for _, document in batch], NATURAL_KEY)
+
+    results = []
+    inserted = []
+    for position, (index, document) in enumerate(batch):
+        if position in failed:
+            results.append({"index": index, "status": "rejected", "error": failed[position]})
+        elif position in upserted:
+            results.append({"index": index, "status": "inserted", "id": str(upserted[position])})
+            inserted.append(document)
+        else:
+            results.append({"index": index, "status": "updated"})
+    update_stats(inserted, 1)
+    return results
+
+def bulk_add_students(records, upsert=False, batch_size=BULK_BATCH_SIZE):
+    """Validate and store many students, `batch_size` documents per round trip.
+
+    `records` may contain ValueError instances for input that couldn't be
+    parsed; they are reported as rejections. Returns one result per record.
+    """
+    write_batch = upsert_batch if upsert else insert_batch
+    created_date = datetime.now().strftime("%Y-%m-%d")
+    results = []
+    batch = []
+    for index, data in enumerate(records):
+        error = str(data) if isinstance(data, ValueError) else validate_student(data)
+        if error:
+            results.append({"index": index, "status": "rejected", "error": error})
+            continue
+        batch.append((index, student_document(build_student(data, created_date))))
+        if len(batch) >= batch_size:
+            results.extend(write_batch(batch))
+            batch = []
+    if batch:
+        results.extend(write_batch(batch))
+    results.sort(key=lambda result: result["index"])
+    if any(result["status"] == "updated" for result in results):
+        # Updated students aren't known by id and may have changed class or
+        # session, so drop every cached entry and recount the summary
+        student_cache.clear()
+        rebuild_stats()
+    if any(result["status"] != "rejected" for result in results):
+        bump_version()
+    return results
+
+def read_ndjson(stream):
+    """Yield one parsed record per non-empty line, or a ValueError for bad JSON."""
+    for line in stream:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield serializers.loads(line)
+        except ValueError as e:
+            yield ValueError(f"Invalid JSON: {e}")
+
+def find_students(after=None, fields=None, query=None, sort=DEFAULT_SORT, limit=None, batch_size=None):
+    """Iterate over students matching `query` in `sort` order, starting after the `after` cursor."""
+    query = query or {}
+    if after:
+        query = {"$and": [query, cursor_query(after, sort)]} if query else cursor_query(after, sort)
+    projection = serializers.projection(fields)
+    # The sort field is needed for the next page's cursor, even if not returned
+    projection.update({field: 1 for field, _ in sort})
+    return repository.find(query, projection, sort, limit, batch_size)
+
+def get_students(limit=None, after=None, fields=None, query=None, sort=DEFAULT_SORT):
+    """Return students matching `query` (see parse_filters) in `sort` order.
+
+    `after` is the cursor of the last student already seen (keyset pagination),
+    `limit` caps the number of documents read and `fields` restricts the
+    returned fields; the filter, sort and projection are pushed down to the storage.
+    """
+    return [format_student(student, fields) for student in find_students(after, fields, query, sort, limit)]
+
+def get_page(limit, after=None, fields=None, query=None, sort=DEFAULT_SORT):
+    """Return (students, next page cursor or None) for one page of `limit` students."""
+    # Read one extra document to know whether another page exists
+    documents = list(find_students(after, fields, query, sort, limit + 1))
+    next_cursor = encode_cursor(documents[limit - 1], sort) if len(documents) > limit else None
+    return [format_student(student, fields) for student in documents[:limit]], next_cursor
+
+def iter_students(after=None, fields=None, query=None, sort=DEFAULT_SORT, batch_size=STREAM_BATCH_SIZE):
+    """Yield students one at a time, reading `batch_size` documents per round trip."""
+    for student in find_students(after, fields, query, sort, batch_size=batch_size):
+        yield format_student(student, fields)
+
+def search_students(name, limit=SEARCH_LIMIT):
+    """Search students by first or last name.
+
+    Single words match exact names first, then name prefixes, both served by
+    the normalized name indexes. Several words are matched as whole words
+    with the text index and ranked by relevance.
+    """
+    term = normalize_name(name)
+    if not term:
+        return []
+    students = repository.search_names(term, serializers.projection(), limit)
+    return [format_student(student) for student in students]
+
+def upcoming_birthdays(start, days, limit):
+    """Students with a birthday in the `days` days from `start`, soonest first.
+
+    One index range query per calendar month of the window; each student
+    gets the date of the birthday and the age turned.
+    """
+    projection = serializers.projection()
+    projection.update({"dob_date": 1, "birth_month": 1, "birth_day": 1})
     students = []
-    for student in students_collection.find():
-        students.append({
-            "id": str(student["_id"]),
-            # Replace name field with first_name and last_name
-            "first_name": student["first_name"],
-            "last_name": student["last_name"],
-            "dob": student["dob"],
-            "class": student["class"],
-            "session": student["session"],
-            "created_date": student.get("created_date", "")
-        })
+    for query in birthday_ranges(start, days):
+        if len(students) >= limit:
+            break
+        cursor = repository.find(query, projection, BIRTHDAY_SORT, limit - len(students))
+        for document in cursor:
+            birthday, turning = next_birthday(document, start)
+            students.append(dict(format_student(document), next_birthday=birthday.isoformat(), turning=turning))
     return students
 
 def get_student_by_id(student_id):
-    from bson.objectid import ObjectId
-    student = students_collection.find_one({"_id": ObjectId(student_id)})
+    cached = student_cache.get(student_id)
+    if cached is not None:
+        return cached
+    student = repository.find_by_id(student_id, serializers.projection())
     if student:
-        return {
-            "id": str(student["_id"]),
-            # Replace name field with first_name and last_name
-            "first_name": student["first_name"],
-            "last_name": student["last_name"],
-            "dob": student["dob"],
-            "class": student["class"],
-            "session": student["session"],
-            "created_date": student.get("created_date", "")
-        }
+        formatted = format_student(student)
+        student_cache.set(student_id, formatted)
+        return formatted
     return None
 
 def delete_student(student_id):
-    from bson.objectid import ObjectId
-    result = students_collection.delete_one({"_id": ObjectId(student_id)})
-    if result.deleted_count > 0:
-        return {"message": "Student deleted successfully"}
-    return {"error": "Student not found"}, 404
-@app.route('/')
+    student = repository.delete_by_id(student_id, {"class": 1, "session": 1, "created_date": 1})
+    student_cache.delete(student_id)
+    if student:
+        update_stats([student], -1)
+        bump_version()
+        return True
+    return False
+@bp.route('/')
 def home():
     return render_template('home.html')
 
-@app.route('/web/students')
+@bp.route('/web/students')
 def students_page():
     return render_template('students.html')
 
-@app.route('/web/add_student')
+@bp.route('/web/add_student')
 def add_student_page():
     return render_template('add_student.html')
 
+def wants_stream():
+    """True if the client asked for NDJSON via `?stream=1` or the Accept header."""
+    if request.args.get("stream", "").lower() in ("1", "true", "yes"):
+        return True
+    best = request.accept_mimetypes.best_match(["application/json", "application/x-ndjson"])
+    return best == "application/x-ndjson"
+
+def stream_students(after=None, fields=None, query=None, sort=DEFAULT_SORT):
+    """Stream students as newline delimited JSON, one document per line."""
+    def generate():
+        for student in iter_students(after, fields, query, sort):
+            yield current_app.json.dumps(student) + "\n"
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+def export_students(fields=None, query=None, sort=DEFAULT_SORT):
+    """Stream students as CSV, one batch of rows per chunk."""
+    def generate():
+        # The BOM makes spreadsheet programs read the file as UTF-8
+        yield "\ufeff" + serializers.csv_text([serializers.csv_header(fields)])
+        rows = []
+        for student in iter_students(fields=fields, query=query, sort=sort):
+            rows.append(serializers.csv_row(student, fields))
+            if len(rows) == STREAM_BATCH_SIZE:
+                yield serializers.csv_text(rows)
+                rows = []
+        if rows:
+            yield serializers.csv_text(rows)
+    response = Response(stream_with_context(generate()), mimetype="text/csv")
+    response.headers.set("Content-Disposition", "attachment",
+                         filename=f"students-{datetime.now().strftime('%Y%m%d')}.csv")
+    return response
+
+def conditional(view):
+    """Answer conditional GETs from the collection version without running the view.
+
+    The ETag combines the collection version with the request path, query
+    string and Accept header, so every distinct response gets its own tag.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        version, modified = get_version()
+        key = f"{request.full_path}|{request.headers.get('Accept', '')}"
+        etag = f"{version}-{hashlib.md5(key.encode()).hexdigest()[:16]}"
+
+        if request.if_none_match:
+            not_modified = request.if_none_match.contains_weak(etag)
+        else:
+            since = request.if_modified_since
+            not_modified = bool(since and modified and modified.replace(microsecond=0) <= since)
+
+        if not_modified:
+            response = current_app.response_class(status=304)
+        else:
+            response = current_app.make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+
+        response.set_etag(etag, weak=True)
+        if modified:
+            response.last_modified = modified
+        response.cache_control.no_cache = True
+        response.vary.add("Accept")
+        return response
+    return wrapper
+
 # API routes
-@app.route('/api/students', methods=['POST'])
+@bp.route('/api/students', methods=['POST'])
 def add():
     data = request.get_json()
-    if "first_name" not in data or "last_name" not in data or "dob" not in data or "class" not in data or "session" not in data:
+    if validate_student(data):
         return jsonify({"error": "Missing required fields"}), 400
     return jsonify(add_student(data)), 201
 
-@app.route('/api/students', methods=['GET'])
+@bp.route('/api/students/bulk', methods=['POST'])
+def add_bulk():
+    # Accept either a JSON array or newline delimited JSON
+    if request.mimetype == "application/x-ndjson":
+        records = read_ndjson(request.stream)
+    else:
+        records = request.get_json(silent=True)
+        if not isinstance(records, list):
+            return jsonify({"error": "Expected a JSON array of students"}), 400
+
+    upsert = request.args.get("upsert", "").lower() in ("1", "true", "yes")
+    results = bulk_add_students(records, upsert=upsert)
+    summary = {status: 0 for status in ("inserted", "updated", "rejected")}
+    for result in results:
+        summary[result["status"]] += 1
+    return jsonify(dict(summary, results=results)), 200
+
+@bp.route('/api/students', methods=['GET'])
+@conditional
 def get_all():
-    return jsonify(get_students()), 200
+    limit = request.args.get("limit")
+    after = request.args.get("after")
+    try:
+        fields = parse_fields(request.args.get("fields"))
+        query = parse_filters(request.args.lists())
+        sort = parse_sort(request.args.get("sort"))
+        if after:
+            cursor_query(after, sort)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    if wants_stream():
+        return stream_students(after, fields, query, sort)
+
+    if limit is None and after is None:
+        # No paging requested: keep returning the plain list
+        return jsonify(get_students(fields=fields, query=query, sort=sort)), 200
+
+    try:
+        limit = int(limit) if limit is not None else DEFAULT_PAGE_SIZE
+    except ValueError:
+        return jsonify({"error": "limit must be an integer"}), 400
+    if limit < 1:
+        return jsonify({"error": "limit must be positive"}), 400
+    limit = min(limit, MAX_PAGE_SIZE)
+
+    students, next_cursor = get_page(limit, after, fields, query, sort)
+
+    return jsonify({
+        "students": students,
+        "next_cursor": next_cursor,
+        "limit": limit
+    }), 200
+
+@bp.route('/api/students/export.csv', methods=['GET'])
+@conditional
+def export_csv():
+    try:
+        fields = parse_fields(request.args.get("fields"))
+        query = parse_filters(request.args.lists())
+        sort = parse_sort(request.args.get("sort"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return export_students(fields, query, sort)
+
+@bp.route('/api/students/stats', methods=['GET'])
+@conditional
+def stats():
+    if request.args.get("rebuild", "").lower() in ("1", "true", "yes"):
+        rebuild_stats()
+    return jsonify(get_stats()), 200
+
+# Not @conditional: the results change with the date, not only with writes
+@bp.route('/api/students/age', methods=['GET'])
+def get_by_age():
+    try:
+        fields = parse_fields(request.args.get("fields"))
+        min_age, max_age = parse_age_range(request.args)
+        query = age_query(min_age, max_age, parse_as_of(request.args.get("as_of")))
+        after = request.args.get("after")
+        if after:
+            cursor_query(after, AGE_SORT)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        limit = int(request.args.get("limit") or DEFAULT_PAGE_SIZE)
+    except ValueError:
+        return jsonify({"error": "limit must be an integer"}), 400
+    if limit < 1:
+        return jsonify({"error": "limit must be positive"}), 400
+    limit = min(limit, MAX_PAGE_SIZE)
+
+    students, next_cursor = get_page(limit, after, fields, query, AGE_SORT)
+    return jsonify({
+        "students": students,
+        "next_cursor": next_cursor,
+        "limit": limit
+    }), 200
+
+@bp.route('/api/students/birthdays', methods=['GET'])
+def birthdays():
+    try:
+        start = parse_as_of(request.args.get("as_of"))
+        days = parse_birthday_days(request.args.get("days"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        limit = int(request.args.get("limit") or DEFAULT_PAGE_SIZE)
+    except ValueError:
+        return jsonify({"error": "limit must be an integer"}), 400
+    if limit < 1:
+        return jsonify({"error": "limit must be positive"}), 400
+    limit = min(limit, MAX_PAGE_SIZE)
+
+    return jsonify({
+        "from": start.isoformat(),
+        "days": days,
+        "students": upcoming_birthdays(start, days, limit)
+    }), 200
 
-@app.route('/api/students/<string:student_id>', methods=['GET'])
+@bp.route('/api/students/<string:student_id>', methods=['GET'])
+@conditional
 def get_by_id(student_id):
     student = get_student_by_id(student_id)
     if student:
         return jsonify(student), 200
     return jsonify({"error": "Student not found"}), 404
 
-@app.route('/api/students/<string:student_id>', methods=['DELETE'])
+@bp.route('/api/students/<string:student_id>', methods=['DELETE'])
 def delete(student_id):
-    return jsonify(delete_student(student_id)), 200
+    if delete_student(student_id):
+        return jsonify({"message": "Student deleted successfully"}), 200
+    return jsonify({"error": "Student not found"}), 404
 
-@app.route('/api/students/name/<string:name>', methods=['GET'])
+@bp.route('/api/cache/stats', methods=['GET'])
+def cache_stats():
+    return jsonify(dict(student_cache.stats(), change_stream=watcher.stats())), 200
+
+@bp.route('/api/students/name/<string:name>', methods=['GET'])
+@conditional
 def get_by_name(name):
-    # Update to search in both first_name and last_name fields
-    students = list(students_collection.find({
-        "$or": [
-            {"first_name": {"$regex": name, "$options": "i"}},
-            {"last_name": {"$regex": name, "$options": "i"}}
-        ]
-    }))
-    
+    # Search in both first_name and last_name fields
+    try:
+        limit = min(int(request.args.get("limit", SEARCH_LIMIT)), MAX_SEARCH_LIMIT)
+    except ValueError:
+        return jsonify({"error": "limit must be an integer"}), 400
+    if limit < 1:
+        return jsonify({"error": "limit must be positive"}), 400
+
+    students = search_students(name, limit)
     if not students:
         return jsonify({"error": "No students found with the given name"}), 404
-    
-    # Format the response
-    formatted_students = []
-    for student in students:
-        formatted_students.append({
-            "id": str(student["_id"]),
-            "first_name": student["first_name"],
-            "last_name": student["last_name"],
-            "dob": student["dob"],
-            "class": student["class"],
-            "session": student["session"],
-            "created_date": student.get("created_date", "")
-        })
-    
-    return jsonify(formatted_students)
+
+    return jsonify(students)
+
+@bp.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    body, content_type = metrics.render()
+    return Response(body, content_type=content_type)
+
+@bp.route('/healthz', methods=['GET'])
+def healthz():
+    # The process is up; doesn't touch the database
+    return jsonify({"status": "ok"}), 200
+
+@bp.route('/readyz', methods=['GET'])
+def readyz():
+    if not repository.bootstrapped.is_set():
+        return jsonify({"status": "starting", "error": repository.last_error}), 503
+    if not repository.ping():
+        return jsonify({"status": "unavailable", "error": repository.last_error}), 503
+    return jsonify({"status": "ready"}), 200
+
+def database_unavailable(error):
+    response = jsonify({"error": "Database unavailable"})
+    response.status_code = 503
+    response.headers["Retry-After"] = "5"
+    return response
+
+def insert_queue_full(error):
+    response = jsonify({"error": "Too many students being added, try again shortly"})
+    response.status_code = 503
+    response.headers["Retry-After"] = "1"
+    return response
+
+def overloaded(error):
+    response = jsonify({"error": "Server overloaded, retry later"})
+    response.status_code = 503
+    response.headers["Retry-After"] = "1"
+    return response
+
+def bootstrap(max_delay=30):
+    """Wait for the storage, then prepare it (indexes, saved data) and the stats summary.
+
+    Runs in a background thread so the app can start serving (and report
+    not ready on /readyz) while the database is still coming up.
+    """
+    delay = 1
+    while True:
+        try:
+            if repository.ping():
+                print(f"Successfully connected to {repository.name}")
+                repository.prepare()
+                ensure_stats()
+                repository.bootstrapped.set()
+                watcher.start()
+                return
+            error = repository.last_error
+        except PyMongoError as e:
+            error = e
+        print(f"{repository.name} not ready: {error}; retrying in {delay}s")
+        time.sleep(delay)
+        delay = min(delay * 2, max_delay)
+
+def create_app(config=None):
+    """Build the Flask app. Doesn't wait for MongoDB."""
+    global repository
+    app = Flask(__name__)
+    app.config.update(config_from_env())
+    app.config.update(config or {})
+
+    serializers.init_app(app)
+    mongo.init_app(app)
+    repository = create_repository(app.config, mongo)
+    # Command timings and pool stats for /metrics
+    mongo.client_options["event_listeners"] = metrics.mongo_listeners()
+    metrics.init_app(app)
+    profiling.init_app(app, mongo)
+    compression.init_app(app)
+    student_cache.maxsize = app.config["STUDENT_CACHE_SIZE"]
+    student_cache.ttl = app.config["STUDENT_CACHE_TTL"]
+    student_cache.clear()
+    insert_queue.init_app(app)
+    watcher.init_app(app)
+    # After the metrics hooks, so shed requests are counted too
+    limiter.init_app(app, mongo)
+
+    app.register_blueprint(bp)
+    # ServerSelectionTimeoutError and network errors are ConnectionFailures
+    app.register_error_handler(ConnectionFailure, database_unavailable)
+    app.register_error_handler(QueueFull, insert_queue_full)
+    app.register_error_handler(Overloaded, overloaded)
+
+    if app.config["MONGO_BOOTSTRAP"]:
+        threading.Thread(target=bootstrap, name="mongo-bootstrap", daemon=True).start()
+    return app
+
+app = create_app()
 
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0', port=5000)
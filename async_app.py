@@ -0,0 +1,639 @@
+"""Asyncio version of the student API (Quart + Motor).
+
+Same routes and JSON responses as app.py, but a request waiting on MongoDB
+doesn't hold a thread: one event loop per process serves every request and
+shares the Motor connection pool, so slow queries don't exhaust a worker
+thread pool.
+
+Usage:
+    hypercorn async_app:app --bind 0.0.0.0:8000 --workers 4
+
+Configured with the same environment variables as app.py.
+"""
+from quart import Quart, Blueprint, current_app, jsonify, request, render_template, Response
+from pymongo.errors import ConnectionFailure, PyMongoError
+import asyncio
+import hashlib
+import functools
+from datetime import datetime, timezone
+from student_fields import (
+    NATURAL_KEY, normalize_name, validate_student, build_student,
+    student_document, parse_fields, parse_filters, parse_sort, DEFAULT_SORT,
+    encode_cursor, cursor_query, parse_as_of, parse_age_range, parse_birthday_days,
+    age_query, birthday_ranges, next_birthday, AGE_SORT, BIRTHDAY_SORT
+)
+from student_stats import summarize
+from cache import LRUCache
+from insert_queue import AsyncInsertQueue, QueueFull
+from change_watcher import AsyncChangeWatcher
+from admission import AsyncAdmissionLimiter, Overloaded, READ, WRITE, HEAVY
+from database import AsyncMongo
+from repository import AsyncMongoRepository, create_repository
+from config import config_from_env
+from serializers import format_student
+import metrics
+import serializers
+import compression
+
+# MongoDB connection (Motor), configured by create_app() and opened on first use
+mongo = AsyncMongo()
+
+# Where students are stored (STORAGE_BACKEND, see repository.py); set by create_app()
+repository = AsyncMongoRepository(mongo)
+
+# Routes, registered on the app by create_app()
+bp = Blueprint("students", __name__)
+
+# Page sizes for cursor pagination on GET /api/students
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+# Documents fetched per round trip when streaming the full collection
+STREAM_BATCH_SIZE = 1000
+
+# Default and maximum number of results returned by a name search
+SEARCH_LIMIT = 50
+MAX_SEARCH_LIMIT = 500
+
+# Documents sent per insert_many / bulk_write call by the bulk endpoint
+BULK_BATCH_SIZE = 1000
+
+async def update_stats(students, delta):
+    """Add `delta` to the summary buckets of each student, one round trip in total."""
+    if students:
+        await repository.update_stats(students, delta)
+        watcher.stats_changed()
+
+async def rebuild_stats():
+    """Recompute the summary from the stored students."""
+    await repository.rebuild_stats()
+    watcher.stats_changed()
+
+async def get_stats():
+    """Read the materialized headcount summary (from memory while the change stream runs)."""
+    buckets = watcher.stats_buckets()
+    if buckets is None:
+        generation = watcher.generation
+        buckets = await repository.stats_buckets()
+        watcher.store_buckets(buckets, generation)
+    return summarize(buckets)
+
+async def ensure_stats():
+    """Build the summary once if it has never been built."""
+    if not await repository.has_stats():
+        await rebuild_stats()
+
+# Read-through cache for single student lookups, keyed by id; sized by create_app()
+student_cache = LRUCache()
+
+# Admission class of each API view (see admission.py); other views aren't limited
+ROUTE_CLASSES = {
+    "get_by_id": READ, "stats": READ, "cache_stats": READ,
+    "add": WRITE, "delete": WRITE,
+    "get_all": HEAVY, "get_by_name": HEAVY, "export_csv": HEAVY, "add_bulk": HEAVY,
+    "get_by_age": HEAVY, "birthdays": HEAVY,
+}
+limiter = AsyncAdmissionLimiter(ROUTE_CLASSES)
+
+# Applies every instance's writes to this process's cache, stats and version
+watcher = AsyncChangeWatcher(mongo, student_cache)
+
+# Database functions
+async def bump_version():
+    """Record that the students collection changed (drives ETag/Last-Modified)."""
+    state = await repository.bump_version()
+    watcher.local_version(state)
+
+async def get_version():
+    """Return (version, last modified time) of the students collection."""
+    if watcher.version is not None:
+        return watcher.version
+    state = await repository.version_document()
+    if state is None:
+        return 0, None
+    return state["version"], state["modified"].replace(tzinfo=timezone.utc)
+
+async def add_student(data):
+    student = build_student(data)
+    document = student_document(student)
+    if insert_queue.enabled:
+        # Written with other queued students by the flusher (write_queued)
+        await insert_queue.insert(document)
+        student["_id"] = str(document["_id"])
+        return student
+    student["_id"] = str(await repository.insert_one(document))  # Convert ObjectId to string
+    student_cache.set(student["_id"], format_student(document))
+    await update_stats([document], 1)
+    await bump_version()
+    return student
+
+async def write_queued(documents):
+    """Store a batch from the insert queue; see app.write_queued."""
+    metrics.INSERT_BATCH_SIZE.observe(len(documents))
+    results = await insert_batch(list(enumerate(documents)))
+    for document, result in zip(documents, results):
+        if result["status"] == "inserted":
+            student_cache.set(result["id"], format_student(document))
+    if any(result["status"] == "inserted" for result in results):
+        await bump_version()
+    return [result.get("error") for result in results]
+
+# Group commit for POST /api/students, configured by create_app()
+insert_queue = AsyncInsertQueue(write_queued)
+
+async def insert_batch(batch):
+    """Insert (index, document) pairs in one round trip and return per-record results."""
+    failed = await repository.insert_many([document for _, document in batch])
+
+    results = []
+    inserted = []
+    for position, (index, document) in enumerate(batch):
+        if position in failed:
+            results.append({"index": index, "status": "rejected", "error": failed[position]})
+        else:
+            results.append({"index": index, "status": "inserted", "id": str(document["_id"])})
+            inserted.append(document)
+    await update_stats(inserted, 1)
+    return results
+
+async def upsert_batch(batch):
+    """Insert or update (index, document) pairs matched on the natural key."""
+    upserted, failed = await repository.upsert_many([document for _, document in batch], NATURAL_KEY)
+
+    results = []
+    inserted = []
+    for position, (index, document) in enumerate(batch):
+        if position in failed:
+            results.append({"index": index, "status": "rejected", "error": failed[position]})
+        elif position in upserted:
+            results.append({"index": index, "status": "inserted", "id": str(upserted[position])})
+            inserted.append(document)
+        else:
+            results.append({"index": index, "status": "updated"})
+    await update_stats(inserted, 1)
+    return results
+
+async def bulk_add_students(records, upsert=False, batch_size=BULK_BATCH_SIZE):
+    """Validate and store many students; see app.bulk_add_students.
+
+    `records` is an async iterable of parsed records or ValueErrors.
+    """
+    write_batch = upsert_batch if upsert else insert_batch
+    created_date = datetime.now().strftime("%Y-%m-%d")
+    results = []
+    batch = []
+    index = 0
+    async for data in records:
+        error = str(data) if isinstance(data, ValueError) else validate_student(data)
+        if error:
+            results.append({"index": index, "status": "rejected", "error": error})
+        else:
+            batch.append((index, student_document(build_student(data, created_date))))
+        index += 1
+        if len(batch) >= batch_size:
+            results.extend(await write_batch(batch))
+            batch = []
+    if batch:
+        results.extend(await write_batch(batch))
+    results.sort(key=lambda result: result["index"])
+    if any(result["status"] == "updated" for result in results):
+        # Updated students aren't known by id and may have changed class or
+        # session, so drop every cached entry and recount the summary
+        student_cache.clear()
+        await rebuild_stats()
+    if any(result["status"] != "rejected" for result in results):
+        await bump_version()
+    return results
+
+async def read_ndjson(body):
+    """Yield one parsed record per non-empty line of a streamed request body."""
+    buffer = b""
+    async for chunk in body:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            if line.strip():
+                yield parse_line(line)
+    if buffer.strip():
+        yield parse_line(buffer)
+
+def parse_line(line):
+    try:
+        return serializers.loads(line)
+    except ValueError as e:
+        return ValueError(f"Invalid JSON: {e}")
+
+async def iterate(items):
+    for item in items:
+        yield item
+
+def find_students(after=None, fields=None, query=None, sort=DEFAULT_SORT, limit=None, batch_size=None):
+    """Async iterable over students matching `query` in `sort` order, starting after the `after` cursor."""
+    query = query or {}
+    if after:
+        query = {"$and": [query, cursor_query(after, sort)]} if query else cursor_query(after, sort)
+    projection = serializers.projection(fields)
+    # The sort field is needed for the next page's cursor, even if not returned
+    projection.update({field: 1 for field, _ in sort})
+    return repository.find(query, projection, sort, limit, batch_size)
+
+async def get_students(limit=None, after=None, fields=None, query=None, sort=DEFAULT_SORT):
+    """Return students matching `query` in `sort` order; see app.get_students."""
+    return [format_student(student, fields) async for student in find_students(after, fields, query, sort, limit)]
+
+async def get_page(limit, after=None, fields=None, query=None, sort=DEFAULT_SORT):
+    """Return (students, next page cursor or None) for one page of `limit` students."""
+    # Read one extra document to know whether another page exists
+    documents = [document async for document in find_students(after, fields, query, sort, limit + 1)]
+    next_cursor = encode_cursor(documents[limit - 1], sort) if len(documents) > limit else None
+    return [format_student(student, fields) for student in documents[:limit]], next_cursor
+
+async def iter_students(after=None, fields=None, query=None, sort=DEFAULT_SORT, batch_size=STREAM_BATCH_SIZE):
+    """Yield students one at a time, reading `batch_size` documents per round trip."""
+    async for student in find_students(after, fields, query, sort, batch_size=batch_size):
+        yield format_student(student, fields)
+
+async def search_students(name, limit=SEARCH_LIMIT):
+    """Search students by first or last name; see app.search_students."""
+    term = normalize_name(name)
+    if not term:
+        return []
+    students = await repository.search_names(term, serializers.projection(), limit)
+    return [format_student(student) for student in students]
+
+async def upcoming_birthdays(start, days, limit):
+    """Students with a birthday in the `days` days from `start`, soonest first.
+
+    One index range query per calendar month of the window; each student
+    gets the date of the birthday and the age turned.
+    """
+    projection = serializers.projection()
+    projection.update({"dob_date": 1, "birth_month": 1, "birth_day": 1})
+    students = []
+    for query in birthday_ranges(start, days):
+        if len(students) >= limit:
+            break
+        cursor = repository.find(query, projection, BIRTHDAY_SORT, limit - len(students))
+        async for document in cursor:
+            birthday, turning = next_birthday(document, start)
+            students.append(dict(format_student(document), next_birthday=birthday.isoformat(), turning=turning))
+    return students
+
+async def get_student_by_id(student_id):
+    cached = student_cache.get(student_id)
+    if cached is not None:
+        return cached
+    student = await repository.find_by_id(student_id, serializers.projection())
+    if student:
+        formatted = format_student(student)
+        student_cache.set(student_id, formatted)
+        return formatted
+    return None
+
+async def delete_student(student_id):
+    student = await repository.delete_by_id(student_id, {"class": 1, "session": 1, "created_date": 1})
+    student_cache.delete(student_id)
+    if student:
+        await update_stats([student], -1)
+        await bump_version()
+        return True
+    return False
+
+@bp.route('/')
+async def home():
+    return await render_template('home.html')
+
+@bp.route('/web/students')
+async def students_page():
+    return await render_template('students.html')
+
+@bp.route('/web/add_student')
+async def add_student_page():
+    return await render_template('add_student.html')
+
+def wants_stream():
+    """True if the client asked for NDJSON via `?stream=1` or the Accept header."""
+    if request.args.get("stream", "").lower() in ("1", "true", "yes"):
+        return True
+    best = request.accept_mimetypes.best_match(["application/json", "application/x-ndjson"])
+    return best == "application/x-ndjson"
+
+def stream_students(after=None, fields=None, query=None, sort=DEFAULT_SORT):
+    """Stream students as newline delimited JSON, one document per line."""
+    dumps = current_app.json.dumps
+
+    async def generate():
+        async for student in iter_students(after, fields, query, sort):
+            yield dumps(student) + "\n"
+    return Response(generate(), mimetype="application/x-ndjson")
+
+def export_students(fields=None, query=None, sort=DEFAULT_SORT):
+    """Stream students as CSV; see app.export_students."""
+    async def generate():
+        yield "\ufeff" + serializers.csv_text([serializers.csv_header(fields)])
+        rows = []
+        async for student in iter_students(fields=fields, query=query, sort=sort):
+            rows.append(serializers.csv_row(student, fields))
+            if len(rows) == STREAM_BATCH_SIZE:
+                yield serializers.csv_text(rows)
+                rows = []
+        if rows:
+            yield serializers.csv_text(rows)
+    response = Response(generate(), mimetype="text/csv")
+    response.headers.set("Content-Disposition", "attachment",
+                         filename=f"students-{datetime.now().strftime('%Y%m%d')}.csv")
+    return response
+
+def conditional(view):
+    """Answer conditional GETs from the collection version; see app.conditional."""
+    @functools.wraps(view)
+    async def wrapper(*args, **kwargs):
+        version, modified = await get_version()
+        key = f"{request.full_path}|{request.headers.get('Accept', '')}"
+        etag = f"{version}-{hashlib.md5(key.encode()).hexdigest()[:16]}"
+
+        if request.if_none_match:
+            not_modified = request.if_none_match.contains_weak(etag)
+        else:
+            since = request.if_modified_since
+            not_modified = bool(since and modified and modified.replace(microsecond=0) <= since)
+
+        if not_modified:
+            response = current_app.response_class("", status=304)
+        else:
+            response = await current_app.make_response(await view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+
+        response.set_etag(etag, weak=True)
+        if modified:
+            response.last_modified = modified
+        response.cache_control.no_cache = True
+        response.vary.add("Accept")
+        return response
+    return wrapper
+
+# API routes
+@bp.route('/api/students', methods=['POST'])
+async def add():
+    data = await request.get_json()
+    if validate_student(data):
+        return jsonify({"error": "Missing required fields"}), 400
+    return jsonify(await add_student(data)), 201
+
+@bp.route('/api/students/bulk', methods=['POST'])
+async def add_bulk():
+    # Accept either a JSON array or newline delimited JSON
+    if request.mimetype == "application/x-ndjson":
+        records = read_ndjson(request.body)
+    else:
+        records = await request.get_json(silent=True)
+        if not isinstance(records, list):
+            return jsonify({"error": "Expected a JSON array of students"}), 400
+        records = iterate(records)
+
+    upsert = request.args.get("upsert", "").lower() in ("1", "true", "yes")
+    results = await bulk_add_students(records, upsert=upsert)
+    summary = {status: 0 for status in ("inserted", "updated", "rejected")}
+    for result in results:
+        summary[result["status"]] += 1
+    return jsonify(dict(summary, results=results)), 200
+
+@bp.route('/api/students', methods=['GET'])
+@conditional
+async def get_all():
+    limit = request.args.get("limit")
+    after = request.args.get("after")
+    try:
+        fields = parse_fields(request.args.get("fields"))
+        query = parse_filters(request.args.lists())
+        sort = parse_sort(request.args.get("sort"))
+        if after:
+            cursor_query(after, sort)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    if wants_stream():
+        return stream_students(after, fields, query, sort)
+
+    if limit is None and after is None:
+        # No paging requested: keep returning the plain list
+        return jsonify(await get_students(fields=fields, query=query, sort=sort)), 200
+
+    try:
+        limit = int(limit) if limit is not None else DEFAULT_PAGE_SIZE
+    except ValueError:
+        return jsonify({"error": "limit must be an integer"}), 400
+    if limit < 1:
+        return jsonify({"error": "limit must be positive"}), 400
+    limit = min(limit, MAX_PAGE_SIZE)
+
+    students, next_cursor = await get_page(limit, after, fields, query, sort)
+
+    return jsonify({
+        "students": students,
+        "next_cursor": next_cursor,
+        "limit": limit
+    }), 200
+
+@bp.route('/api/students/export.csv', methods=['GET'])
+@conditional
+async def export_csv():
+    try:
+        fields = parse_fields(request.args.get("fields"))
+        query = parse_filters(request.args.lists())
+        sort = parse_sort(request.args.get("sort"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return export_students(fields, query, sort)
+
+@bp.route('/api/students/stats', methods=['GET'])
+@conditional
+async def stats():
+    if request.args.get("rebuild", "").lower() in ("1", "true", "yes"):
+        await rebuild_stats()
+    return jsonify(await get_stats()), 200
+
+# Not @conditional: the results change with the date, not only with writes
+@bp.route('/api/students/age', methods=['GET'])
+async def get_by_age():
+    try:
+        fields = parse_fields(request.args.get("fields"))
+        min_age, max_age = parse_age_range(request.args)
+        query = age_query(min_age, max_age, parse_as_of(request.args.get("as_of")))
+        after = request.args.get("after")
+        if after:
+            cursor_query(after, AGE_SORT)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        limit = int(request.args.get("limit") or DEFAULT_PAGE_SIZE)
+    except ValueError:
+        return jsonify({"error": "limit must be an integer"}), 400
+    if limit < 1:
+        return jsonify({"error": "limit must be positive"}), 400
+    limit = min(limit, MAX_PAGE_SIZE)
+
+    students, next_cursor = await get_page(limit, after, fields, query, AGE_SORT)
+    return jsonify({
+        "students": students,
+        "next_cursor": next_cursor,
+        "limit": limit
+    }), 200
+
+@bp.route('/api/students/birthdays', methods=['GET'])
+async def birthdays():
+    try:
+        start = parse_as_of(request.args.get("as_of"))
+        days = parse_birthday_days(request.args.get("days"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        limit = int(request.args.get("limit") or DEFAULT_PAGE_SIZE)
+    except ValueError:
+        return jsonify({"error": "limit must be an integer"}), 400
+    if limit < 1:
+        return jsonify({"error": "limit must be positive"}), 400
+    limit = min(limit, MAX_PAGE_SIZE)
+
+    return jsonify({
+        "from": start.isoformat(),
+        "days": days,
+        "students": await upcoming_birthdays(start, days, limit)
+    }), 200
+
+@bp.route('/api/students/<string:student_id>', methods=['GET'])
+@conditional
+async def get_by_id(student_id):
+    student = await get_student_by_id(student_id)
+    if student:
+        return jsonify(student), 200
+    return jsonify({"error": "Student not found"}), 404
+
+@bp.route('/api/students/<string:student_id>', methods=['DELETE'])
+async def delete(student_id):
+    if await delete_student(student_id):
+        return jsonify({"message": "Student deleted successfully"}), 200
+    return jsonify({"error": "Student not found"}), 404
+
+@bp.route('/api/cache/stats', methods=['GET'])
+async def cache_stats():
+    return jsonify(dict(student_cache.stats(), change_stream=watcher.stats())), 200
+
+@bp.route('/api/students/name/<string:name>', methods=['GET'])
+@conditional
+async def get_by_name(name):
+    # Search in both first_name and last_name fields
+    try:
+        limit = min(int(request.args.get("limit", SEARCH_LIMIT)), MAX_SEARCH_LIMIT)
+    except ValueError:
+        return jsonify({"error": "limit must be an integer"}), 400
+    if limit < 1:
+        return jsonify({"error": "limit must be positive"}), 400
+
+    students = await search_students(name, limit)
+    if not students:
+        return jsonify({"error": "No students found with the given name"}), 404
+
+    return jsonify(students)
+
+@bp.route('/metrics', methods=['GET'])
+async def metrics_endpoint():
+    body, content_type = metrics.render()
+    return Response(body, content_type=content_type)
+
+@bp.route('/healthz', methods=['GET'])
+async def healthz():
+    # The process is up; doesn't touch the database
+    return jsonify({"status": "ok"}), 200
+
+@bp.route('/readyz', methods=['GET'])
+async def readyz():
+    if not repository.bootstrapped.is_set():
+        return jsonify({"status": "starting", "error": repository.last_error}), 503
+    if not await repository.ping():
+        return jsonify({"status": "unavailable", "error": repository.last_error}), 503
+    return jsonify({"status": "ready"}), 200
+
+async def database_unavailable(error):
+    response = jsonify({"error": "Database unavailable"})
+    response.status_code = 503
+    response.headers["Retry-After"] = "5"
+    return response
+
+async def insert_queue_full(error):
+    response = jsonify({"error": "Too many students being added, try again shortly"})
+    response.status_code = 503
+    response.headers["Retry-After"] = "1"
+    return response
+
+async def overloaded(error):
+    response = jsonify({"error": "Server overloaded, retry later"})
+    response.status_code = 503
+    response.headers["Retry-After"] = "1"
+    return response
+
+async def bootstrap(max_delay=30):
+    """Wait for the storage, then prepare it (indexes, saved data) and the stats summary.
+
+    Runs as a background task so the app serves (and reports not ready on
+    /readyz) while the database is still coming up.
+    """
+    delay = 1
+    while True:
+        try:
+            if await repository.ping():
+                print(f"Successfully connected to {repository.name}")
+                await repository.prepare()
+                await ensure_stats()
+                repository.bootstrapped.set()
+                watcher.start()
+                return
+            error = repository.last_error
+        except PyMongoError as e:
+            error = e
+        print(f"{repository.name} not ready: {error}; retrying in {delay}s")
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, max_delay)
+
+def create_app(config=None):
+    """Build the Quart app. Doesn't wait for MongoDB."""
+    global repository
+    app = Quart(__name__)
+    app.config.update(config_from_env())
+    app.config.update(config or {})
+    # Same as Flask: no request size limit (bulk imports can be large)
+    app.config["MAX_CONTENT_LENGTH"] = None
+
+    serializers.init_async_app(app)
+    mongo.init_app(app)
+    repository = create_repository(app.config, mongo, asynchronous=True)
+    # Command timings and pool stats for /metrics
+    mongo.client_options["event_listeners"] = metrics.mongo_listeners()
+    metrics.init_async_app(app)
+    compression.init_async_app(app)
+    student_cache.maxsize = app.config["STUDENT_CACHE_SIZE"]
+    student_cache.ttl = app.config["STUDENT_CACHE_TTL"]
+    student_cache.clear()
+    insert_queue.init_app(app)
+    watcher.init_app(app)
+    # After the metrics hooks, so shed requests are counted too
+    limiter.init_app(app, mongo)
+
+    app.register_blueprint(bp)
+    # ServerSelectionTimeoutError and network errors are ConnectionFailures
+    app.register_error_handler(ConnectionFailure, database_unavailable)
+    app.register_error_handler(QueueFull, insert_queue_full)
+    app.register_error_handler(Overloaded, overloaded)
+
+    if app.config["MONGO_BOOTSTRAP"]:
+        @app.before_serving
+        async def start_bootstrap():
+            # Keep a reference so the task isn't garbage collected
+            app.bootstrap_task = asyncio.get_running_loop().create_task(bootstrap())
+    return app
+
+app = create_app()
+
+if __name__ == '__main__':
+    app.run(debug=True, host='0.0.0.0', port=8000)
@@ -0,0 +1,390 @@
+"""Load and latency benchmark for the student API.
+
+Seeds N students, then drives every API route at a fixed concurrency and
+reports throughput and p50/p95/p99 latency per route.
+
+Usage:
+    # In-process through the Flask test client, against MongoDB at MONGO_URI
+    MONGO_URI=mongodb://localhost:27017 python benchmark.py --students 10000
+
+    # In-process with an in-memory MongoDB stand-in (pip install mongomock)
+    python benchmark.py --in-memory --students 10000
+
+    # MongoDB's overhead: the same run on the in-memory storage backend
+    MONGO_URI=mongodb://localhost:27017 python benchmark.py --output mongo.json
+    python benchmark.py --backend memory --compare mongo.json
+
+    # Against a running server (e.g. python run_server.py 5001)
+    python benchmark.py --url http://127.0.0.1:5001 --students 100000
+
+    # Save results and compare them with an earlier run
+    python benchmark.py --in-memory --output after.json --compare before.json
+
+    # CPU per record of decoding, formatting and encoding students (no database)
+    python benchmark.py --serializers --students 10000
+
+    # Flask (threads) vs async app at high concurrency, same data and requests
+    python benchmark.py --url http://127.0.0.1:5001 --concurrency 256 --output sync.json
+    python benchmark.py --url http://127.0.0.1:8000 --concurrency 256 --no-seed --compare sync.json
+
+Seeding writes to the configured database, so point MONGO_URI at a scratch
+database rather than production.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import seed_data
+
+# Students sent per request while seeding
+SEED_BATCH_SIZE = 1000
+
+
+def generate_students(count, rng):
+    """Yield `count` random students accepted by POST /api/students."""
+    as_of = datetime.strptime(seed_data.DEFAULT_AS_OF, "%Y-%m-%d")
+    for _ in range(count):
+        yield seed_data.make_student(rng, as_of)
+
+
+class InProcessClient:
+    """Issue requests through the Flask test client, one client per thread."""
+
+    def __init__(self, in_memory=False, backend=None):
+        if backend:
+            # Read by the app's config when it is imported below
+            os.environ["STORAGE_BACKEND"] = backend
+        if in_memory:
+            try:
+                import mongomock
+            except ImportError:
+                sys.exit("--in-memory needs mongomock: pip install mongomock")
+            import pymongo
+            pymongo.MongoClient = mongomock.MongoClient
+        import app as app_module
+        self.app = app_module.app
+        # Wait for the background index bootstrap before measuring
+        repository = app_module.repository
+        if not repository.bootstrapped.wait(30):
+            sys.exit(f"{repository.name} is not reachable: {repository.last_error}")
+        self.local = threading.local()
+        self.target = "in-memory" if in_memory else "in-process"
+        if app_module.app.config["STORAGE_BACKEND"] != "mongo":
+            self.target += f" ({app_module.app.config['STORAGE_BACKEND']} backend)"
+
+    def request(self, method, path, body=None):
+        client = getattr(self.local, "client", None)
+        if client is None:
+            client = self.local.client = self.app.test_client()
+        response = client.open(path, method=method, json=body)
+        # Read the body so streamed responses are fully produced
+        data = response.get_data()
+        return response.status_code, data
+
+
+class HttpClient:
+    """Issue requests to a running server, one keep-alive session per thread."""
+
+    def __init__(self, url):
+        import requests
+        self.requests = requests
+        self.url = url.rstrip("/")
+        self.local = threading.local()
+        self.target = self.url
+
+    def request(self, method, path, body=None):
+        session = getattr(self.local, "session", None)
+        if session is None:
+            session = self.local.session = self.requests.Session()
+        response = session.request(method, self.url + path, json=body)
+        return response.status_code, response.content
+
+
+def seed(client, count, rng):
+    """Insert `count` students through the bulk endpoint."""
+    batch = []
+    for student in generate_students(count, rng):
+        batch.append(student)
+        if len(batch) >= SEED_BATCH_SIZE:
+            client.request("POST", "/api/students/bulk", batch)
+            batch = []
+    if batch:
+        client.request("POST", "/api/students/bulk", batch)
+
+
+def sample_students(client, count=1000):
+    """Return up to `count` existing students to build request paths from."""
+    status, data = client.request("GET", f"/api/students?limit={count}&fields=first_name,last_name")
+    if status != 200:
+        sys.exit(f"Could not list students (HTTP {status}); is the database reachable?")
+    return json.loads(data)["students"]
+
+
+def build_routes(students, rng):
+    """Return {route name: function returning (method, path, body)} for every API route."""
+    ids = [student["id"] for student in students]
+    names = [student["last_name"] for student in students] or seed_data.last_names
+    new_students = generate_students(sys.maxsize, rng)
+    created = []
+    lock = threading.Lock()
+
+    def new_student():
+        # Generators can't be advanced from several threads at once
+        with lock:
+            return next(new_students)
+
+    def delete_request():
+        with lock:
+            student_id = created.pop() if created else "507f1f77bcf86cd799439011"
+        return "DELETE", f"/api/students/{student_id}", None
+
+    def age_request():
+        # Seeded students are born 2000-2010, so every range matches some of them
+        oldest = int(seed_data.DEFAULT_AS_OF[:4]) - 2000
+        age = rng.randint(oldest - 11, oldest - 1)
+        return "GET", f"/api/students/age?min={age}&max={age + 1}&as_of={seed_data.DEFAULT_AS_OF}&limit=100", None
+
+    routes = {
+        "home_page": lambda: ("GET", "/", None),
+        "students_page": lambda: ("GET", "/web/students", None),
+        "add_student_page": lambda: ("GET", "/web/add_student", None),
+        "list_page": lambda: ("GET", "/api/students?limit=100", None),
+        "list_all": lambda: ("GET", "/api/students", None),
+        "list_stream": lambda: ("GET", "/api/students?stream=1", None),
+        "list_filtered": lambda: ("GET", f"/api/students?class={rng.choice(seed_data.classes)}"
+                                         f"&sort=-created_date&limit=100", None),
+        "export_csv": lambda: ("GET", f"/api/students/export.csv?class={rng.choice(seed_data.classes)}", None),
+        "by_age": age_request,
+        "birthdays": lambda: ("GET", f"/api/students/birthdays?as_of={seed_data.DEFAULT_AS_OF}&days=30", None),
+        "get_by_id": lambda: ("GET", f"/api/students/{rng.choice(ids)}", None),
+        "search_by_name": lambda: ("GET", f"/api/students/name/{rng.choice(names)[:3]}", None),
+        "stats": lambda: ("GET", "/api/students/stats", None),
+        "cache_stats": lambda: ("GET", "/api/cache/stats", None),
+        "add": lambda: ("POST", "/api/students", new_student()),
+        "bulk_add": lambda: ("POST", "/api/students/bulk", [new_student() for _ in range(100)]),
+        "delete": delete_request,
+        "metrics": lambda: ("GET", "/metrics", None),
+        "healthz": lambda: ("GET", "/healthz", None),
+        "readyz": lambda: ("GET", "/readyz", None),
+    }
+    return routes, created
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def run_route(client, make_request, total, concurrency):
+    """Send `total` requests with `concurrency` workers and summarize the latencies."""
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+
+    def worker(count):
+        nonlocal errors
+        local_latencies = []
+        local_errors = 0
+        for _ in range(count):
+            method, path, body = make_request()
+            start = time.perf_counter()
+            try:
+                status, _ = client.request(method, path, body)
+                failed = status >= 500
+            except Exception:
+                failed = True
+            local_latencies.append(time.perf_counter() - start)
+            local_errors += failed
+        with lock:
+            latencies.extend(local_latencies)
+            errors += local_errors
+
+    shares = [total // concurrency + (1 if i < total % concurrency else 0) for i in range(concurrency)]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(worker, shares))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    to_ms = lambda seconds: round(seconds * 1000, 3) if seconds is not None else None
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "seconds": round(elapsed, 3),
+        "throughput": round(len(latencies) / elapsed, 1) if elapsed else None,
+        "mean_ms": to_ms(sum(latencies) / len(latencies)) if latencies else None,
+        "p50_ms": to_ms(percentile(latencies, 0.50)),
+        "p95_ms": to_ms(percentile(latencies, 0.95)),
+        "p99_ms": to_ms(percentile(latencies, 0.99)),
+        "max_ms": to_ms(latencies[-1]) if latencies else None,
+    }
+
+
+def time_per_record(function, count, repeat=5):
+    """Best of `repeat` runs of function(), in microseconds per record."""
+    best = min(timed(function) for _ in range(repeat))
+    return best / count * 1e6
+
+
+def timed(function):
+    start = time.perf_counter()
+    function()
+    return time.perf_counter() - start
+
+
+def benchmark_serializers(count, rng):
+    """Measure the CPU cost per student of the list response path, old vs new.
+
+    Old: whole stored documents decoded, formatted, encoded with the stdlib
+    json module (Flask's default provider). New: projected documents, the
+    shared format_student() and orjson.
+    """
+    import bson
+    from flask import Flask
+    from flask.json.provider import DefaultJSONProvider
+
+    import serializers
+    from student_fields import student_document
+
+    documents = [dict(student_document(student), _id=bson.ObjectId())
+                 for student in generate_students(count, rng)]
+    projection = serializers.projection()
+    full = b"".join(bson.encode(document) for document in documents)
+    projected = b"".join(bson.encode({field: document[field] for field in ["_id", *projection]})
+                         for document in documents)
+    app = Flask(__name__)
+    formatted = [serializers.format_student(document) for document in documents]
+    stdlib = DefaultJSONProvider(app)
+    serializers.init_app(app)
+
+    steps = [
+        ("decode full document", lambda: bson.decode_all(full)),
+        ("decode projected", lambda: bson.decode_all(projected)),
+        ("format_student", lambda: [serializers.format_student(document) for document in documents]),
+        ("encode stdlib json", lambda: stdlib.dumps(formatted)),
+    ]
+    if serializers.orjson:
+        steps.append(("encode orjson", lambda: app.json.dumps(formatted)))
+    results = {name: round(time_per_record(function, count), 3) for name, function in steps}
+
+    print(f"\n{'Step (per student)':<24} {'us':>8}")
+    print("=" * 33)
+    for name, value in results.items():
+        print(f"{name:<24} {value:>8}")
+    old = results["decode full document"] + results["format_student"] + results["encode stdlib json"]
+    new = (results["decode projected"] + results["format_student"]
+           + results.get("encode orjson", results["encode stdlib json"]))
+    print(f"\nOld path {old:.2f} us, new path {new:.2f} us per student ({old / new:.1f}x)")
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"],
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_report(report, baseline=None):
+    print(f"\n{'Route':<18} {'req/s':>10} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10} {'errors':>7}"
+          + (f" {'p95 vs base':>12}" if baseline else ""))
+    print("=" * (70 + (13 if baseline else 0)))
+    for name, result in report["routes"].items():
+        line = (f"{name:<18} {result['throughput'] or 0:>10} {result['p50_ms'] or 0:>10} "
+                f"{result['p95_ms'] or 0:>10} {result['p99_ms'] or 0:>10} {result['errors']:>7}")
+        base = (baseline or {}).get("routes", {}).get(name)
+        if base and base.get("p95_ms") and result.get("p95_ms"):
+            line += f" {result['p95_ms'] / base['p95_ms']:>11.2f}x"
+        print(line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the student API routes")
+    parser.add_argument("--url", help="Benchmark a running server instead of the in-process app")
+    parser.add_argument("--in-memory", action="store_true", help="Use mongomock instead of MongoDB (in-process only)")
+    parser.add_argument("--backend", choices=["mongo", "memory"],
+                        help="STORAGE_BACKEND of the in-process app (default: the environment's)")
+    parser.add_argument("--students", type=int, default=10000, help="Students to seed before measuring")
+    parser.add_argument("--no-seed", action="store_true", help="Use the students already in the database")
+    parser.add_argument("--requests", type=int, default=1000, help="Requests per route")
+    parser.add_argument("--concurrency", type=int, default=8, help="Concurrent clients per route")
+    parser.add_argument("--routes", help="Comma separated routes to run (default: all)")
+    parser.add_argument("--seed", type=int, default=42, help="Random seed for generated data and requests")
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    parser.add_argument("--compare", help="Earlier JSON report to compare p95 latencies against")
+    parser.add_argument("--serializers", action="store_true",
+                        help="Only measure the per-student serialization cost, without a database")
+    args = parser.parse_args(argv)
+
+    if args.serializers:
+        return benchmark_serializers(args.students, random.Random(args.seed))
+
+    if args.url and (args.in_memory or args.backend):
+        parser.error("--in-memory and --backend only apply to in-process runs")
+
+    rng = random.Random(args.seed)
+    client = HttpClient(args.url) if args.url else InProcessClient(args.in_memory, args.backend)
+
+    if not args.no_seed:
+        print(f"Seeding {args.students} students...")
+        start = time.perf_counter()
+        seed(client, args.students, rng)
+        print(f"Seeded in {time.perf_counter() - start:.1f}s")
+
+    routes, created = build_routes(sample_students(client), rng)
+    selected = args.routes.split(",") if args.routes else list(routes)
+    unknown = [name for name in selected if name not in routes]
+    if unknown:
+        parser.error(f"Unknown routes: {', '.join(unknown)} (choose from {', '.join(routes)})")
+
+    if "delete" in selected:
+        # Create the students the delete route removes, outside the measurement
+        _, data = client.request("POST", "/api/students/bulk",
+                                 list(generate_students(args.requests, rng)))
+        created.extend(result["id"] for result in json.loads(data)["results"] if "id" in result)
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "commit": git_commit(),
+            "target": client.target,
+            "students": args.students,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "seed": args.seed,
+            "python": platform.python_version(),
+        },
+        "routes": {},
+    }
+    for name in selected:
+        print(f"Running {name}...")
+        report["routes"][name] = run_route(client, routes[name], args.requests, args.concurrency)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+    print_report(report, baseline)
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+        print(f"\nReport written to {args.output}")
+    return report
+
+
+if __name__ == "__main__":
+    main()
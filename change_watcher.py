@@ -0,0 +1,231 @@
+"""Keeps each app instance's caches in step with writes made by any instance.
+
+A background thread follows a MongoDB change stream on the database and
+applies every change to this process:
+- students: inserted students are put in the student cache, deleted and
+  updated ones are dropped from it (the next lookup reads them again);
+- student_stats: the headcount buckets are mirrored in memory, so
+  GET /api/students/stats doesn't read the collection;
+- meta: the collection version is mirrored in memory, so conditional GETs
+  are answered without a round trip.
+
+After a dropped connection the stream resumes from the last resume token,
+so no change is missed. If it can't resume (the oplog has moved on), the
+caches are cleared and the mirrors reloaded. While the stream is down,
+reads fall back to the database.
+
+Change streams need a replica set (a single-node one is enough, see the
+README). Against a standalone server the watcher logs that once and stops,
+and the app works as before.
+"""
+import asyncio
+import threading
+import time
+from datetime import timezone
+
+from pymongo.errors import OperationFailure, PyMongoError
+
+from serializers import format_student
+
+# Collections whose changes the watcher applies
+WATCHED = ["students", "student_stats", "meta"]
+
+# The $changeStream stage is only supported on replica sets
+NOT_REPLICA_SET = 40573
+# The resume token is no longer in the oplog, or the stream can't continue
+RESUME_FAILED = {260, 280, 286}
+
+
+class ChangeWatcher:
+    """Applies changes from a change stream to the student cache and the in-memory mirrors."""
+
+    def __init__(self, mongo, cache):
+        self.mongo = mongo
+        self.cache = cache
+        self.enabled = True
+        self.resume_token = None
+        # (version, modified) of the students collection, None while not watching
+        self.version = None
+        # Stats bucket documents by id, None while not watching or not loaded
+        self.buckets = None
+        # Bumped on every stats change, so a stale read isn't stored (see store_buckets)
+        self.generation = 0
+        self.changes = 0
+        self.reconnects = 0
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def init_app(self, app):
+        # Only MongoDB has other instances' writes to follow
+        self.enabled = app.config["CHANGE_STREAMS"] and app.config["STORAGE_BACKEND"] == "mongo"
+        self.resume_token = None
+        self.stopped()
+
+    def pipeline(self):
+        return [{"$match": {"ns.coll": {"$in": WATCHED}}}]
+
+    def start(self):
+        """Start watching on a daemon thread (call once the database is reachable)."""
+        if self.enabled and (self._thread is None or not self._thread.is_alive()):
+            self._thread = threading.Thread(target=self.run, name="change-watcher", daemon=True)
+            self._thread.start()
+
+    def run(self, max_delay=30):
+        delay = 1
+        while True:
+            try:
+                with self.mongo.db.watch(self.pipeline(), full_document="updateLookup",
+                                         resume_after=self.resume_token) as stream:
+                    self.started(self.load_version(), self.mongo.stats.find())
+                    delay = 1
+                    while stream.alive:
+                        change = stream.try_next()
+                        if change is not None and not self.apply(change):
+                            break
+                        # Advances even without changes, so a resume skips nothing
+                        self.resume_token = stream.resume_token
+            except OperationFailure as e:
+                if not self.failed(e):
+                    return
+            except PyMongoError as e:
+                self.failed(e)
+            time.sleep(delay)
+            delay = min(delay * 2, max_delay)
+
+    def load_version(self):
+        return self.mongo.meta.find_one({"_id": "students"})
+
+    def started(self, meta, buckets):
+        """The stream is open: load the mirrors (later changes are applied on top)."""
+        with self._lock:
+            self.version = None
+            self.observe_version(meta)
+            self.buckets = {bucket["_id"]: bucket for bucket in buckets}
+            self.generation += 1
+        print("Watching changes " + ("from the last resume token" if self.resume_token else "from now"))
+
+    def failed(self, error):
+        """The stream broke; return False if watching can't work at all."""
+        self.stopped()
+        if isinstance(error, OperationFailure) and error.code == NOT_REPLICA_SET:
+            print("Change streams need a replica set; caches won't follow other instances' writes")
+            return False
+        if isinstance(error, OperationFailure) and error.code in RESUME_FAILED:
+            # Changes may have been missed: start over from an empty cache
+            self.resume_token = None
+            self.cache.clear()
+        self.reconnects += 1
+        print(f"Change stream interrupted: {error}; reconnecting")
+        return True
+
+    def stopped(self):
+        # Not watching: reads go to the database until the stream is back
+        with self._lock:
+            self.version = None
+            self.buckets = None
+            self.generation += 1
+
+    def apply(self, change):
+        """Apply one change; return False if the stream has to start over."""
+        self.changes += 1
+        collection = change.get("ns", {}).get("coll")
+        operation = change["operationType"]
+        if operation in ("drop", "rename", "dropDatabase", "invalidate"):
+            # A whole collection went away: clear everything and reload the mirrors
+            self.cache.clear()
+            self.stopped()
+            self.resume_token = None
+            return False
+        document = change.get("fullDocument")
+        key = change["documentKey"]["_id"]
+        if collection == "students":
+            if operation == "insert" and document is not None:
+                self.cache.set(str(key), format_student(document))
+            else:
+                # Deleted or updated: the next lookup reads the current document
+                self.cache.delete(str(key))
+        elif collection == "student_stats":
+            with self._lock:
+                self.generation += 1
+                if self.buckets is not None:
+                    if document is None:
+                        self.buckets.pop(key, None)
+                    else:
+                        self.buckets[key] = document
+        elif collection == "meta" and key == "students" and document is not None:
+            with self._lock:
+                self.observe_version(document)
+        return True
+
+    def observe_version(self, meta):
+        """Record a meta document; versions only move forward."""
+        if meta is None:
+            version = (0, None)
+        else:
+            version = (meta["version"], meta["modified"].replace(tzinfo=timezone.utc))
+        if self.version is None or version[0] > self.version[0]:
+            self.version = version
+
+    def local_version(self, meta):
+        """This instance bumped the version: use it now rather than when the change arrives."""
+        with self._lock:
+            if self.version is not None:
+                self.observe_version(meta)
+
+    def stats_buckets(self):
+        """The mirrored buckets with a count, or None to read the collection."""
+        with self._lock:
+            if self.buckets is None:
+                return None
+            return [bucket for bucket in self.buckets.values() if bucket["count"] > 0]
+
+    def stats_changed(self):
+        """This instance wrote to student_stats: read it again until the mirror is reloaded."""
+        with self._lock:
+            self.buckets = None
+            self.generation += 1
+
+    def store_buckets(self, buckets, generation):
+        """Mirror buckets read at `generation`, unless a change arrived since."""
+        with self._lock:
+            if self.version is not None and self.generation == generation:
+                self.buckets = {bucket["_id"]: bucket for bucket in buckets}
+
+    def stats(self):
+        return {
+            "enabled": self.enabled,
+            "watching": self.version is not None,
+            "changes": self.changes,
+            "reconnects": self.reconnects,
+        }
+
+
+class AsyncChangeWatcher(ChangeWatcher):
+    """ChangeWatcher for the async app: a Motor change stream read by a task."""
+
+    def start(self):
+        if self.enabled and (self._thread is None or self._thread.done()):
+            # Keep a reference so the task isn't garbage collected
+            self._thread = asyncio.get_running_loop().create_task(self.run())
+
+    async def run(self, max_delay=30):
+        delay = 1
+        while True:
+            try:
+                async with self.mongo.db.watch(self.pipeline(), full_document="updateLookup",
+                                               resume_after=self.resume_token) as stream:
+                    meta = await self.mongo.meta.find_one({"_id": "students"})
+                    self.started(meta, await self.mongo.stats.find().to_list(None))
+                    delay = 1
+                    while stream.alive:
+                        change = await stream.try_next()
+                        if change is not None and not self.apply(change):
+                            break
+                        self.resume_token = stream.resume_token
+            except OperationFailure as e:
+                if not self.failed(e):
+                    return
+            except PyMongoError as e:
+                self.failed(e)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, max_delay)
@@ -0,0 +1,304 @@
+"""Response compression for the student API.
+
+JSON, NDJSON and text responses are compressed with brotli (if the brotli
+package is installed) or gzip, whichever the client prefers in its
+Accept-Encoding header. Whole responses are only compressed above
+COMPRESS_MIN_SIZE bytes; streamed responses are always compressed, chunk
+by chunk, and flushed every STREAM_FLUSH_SIZE bytes so clients keep
+receiving data while the stream is produced.
+
+Static files are served from precompressed .br/.gz copies next to the
+originals. They are (re)built at startup when missing or stale, or ahead of
+time with `python compression.py`. URLs from url_for('static', ...) carry a
+content hash (`?v=...`), so those responses can be cached for STATIC_MAX_AGE.
+"""
+import hashlib
+import mimetypes
+import os
+import sys
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Media types worth compressing; images and fonts are compressed already
+COMPRESSIBLE = {
+    "application/json", "application/x-ndjson", "application/javascript",
+    "text/html", "text/css", "text/csv", "text/plain", "text/javascript", "image/svg+xml",
+}
+
+# Uncompressed bytes of a stream to buffer before flushing compressed output
+STREAM_FLUSH_SIZE = 8192
+
+# Suffixes of the precompressed copies of static files
+STATIC_ENCODINGS = {".br": "br", ".gz": "gzip"}
+
+# Content hashes of static files for ?v=, by path: (mtime, hash)
+static_versions = {}
+
+
+def encodings():
+    """Encodings the server supports, in order of preference."""
+    return ["br", "gzip"] if brotli else ["gzip"]
+
+
+class Compressor:
+    """Incremental brotli or gzip compressor."""
+
+    def __init__(self, encoding, config):
+        self.encoding = encoding
+        if encoding == "br":
+            self.compressor = brotli.Compressor(quality=config["COMPRESS_BROTLI_LEVEL"])
+        else:
+            # wbits=31: zlib compression with a gzip header and trailer
+            self.compressor = zlib.compressobj(config["COMPRESS_LEVEL"], zlib.DEFLATED, 31)
+
+    def compress(self, data):
+        if self.encoding == "br":
+            return self.compressor.process(data)
+        return self.compressor.compress(data)
+
+    def flush(self):
+        """Compressed output for everything passed in so far."""
+        if self.encoding == "br":
+            return self.compressor.flush()
+        return self.compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        if self.encoding == "br":
+            return self.compressor.finish()
+        return self.compressor.flush()
+
+
+def compress(data, encoding, config):
+    compressor = Compressor(encoding, config)
+    return compressor.compress(data) + compressor.finish()
+
+
+def compress_stream(chunks, compressor):
+    """Compress an iterable of byte strings, flushing every STREAM_FLUSH_SIZE bytes."""
+    pending = 0
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode()
+            output = compressor.compress(chunk)
+            pending += len(chunk)
+            if pending >= STREAM_FLUSH_SIZE:
+                output += compressor.flush()
+                pending = 0
+            if output:
+                yield output
+        yield compressor.finish()
+    finally:
+        # Let the wrapped generator clean up (e.g. close its MongoDB cursor)
+        if hasattr(chunks, "close"):
+            chunks.close()
+
+
+async def compress_async_stream(body, compressor):
+    """compress_stream() for a Quart response body."""
+    pending = 0
+    async with body as chunks:
+        async for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode()
+            output = compressor.compress(chunk)
+            pending += len(chunk)
+            if pending >= STREAM_FLUSH_SIZE:
+                output += compressor.flush()
+                pending = 0
+            if output:
+                yield output
+    yield compressor.finish()
+
+
+def choose_encoding(request, response, config):
+    """The encoding to compress `response` with, or None to send it as is."""
+    if (request.method == "HEAD" or response.status_code < 200 or response.status_code in (204, 206, 304)
+            or "Content-Encoding" in response.headers or response.mimetype not in COMPRESSIBLE
+            or config["COMPRESS_MIN_SIZE"] < 0):
+        return None
+    # Caches must keep compressed and uncompressed copies apart
+    response.vary.add("Accept-Encoding")
+    return request.accept_encodings.best_match(encodings())
+
+
+def mark_compressed(response, encoding):
+    response.headers["Content-Encoding"] = encoding
+    response.headers.pop("Content-Length", None)
+
+
+def compress_response(request, response, config):
+    """after_request hook compressing a Flask response."""
+    if response.direct_passthrough:
+        # Files (the static view serves its own precompressed copies)
+        return response
+    encoding = choose_encoding(request, response, config)
+    if encoding is None:
+        return response
+    if response.is_streamed:
+        mark_compressed(response, encoding)
+        response.response = compress_stream(response.response, Compressor(encoding, config))
+        return response
+    data = response.get_data()
+    if len(data) >= config["COMPRESS_MIN_SIZE"]:
+        response.set_data(compress(data, encoding, config))
+        response.headers["Content-Encoding"] = encoding
+    return response
+
+
+async def compress_async_response(request, response, config):
+    """after_request hook compressing a Quart response."""
+    # Quart's own error responses (404, 405, aborts) are werkzeug Responses
+    # without body classes; they are small and left as they are
+    data_body_class = getattr(response, "data_body_class", None)
+    iterable_body_class = getattr(response, "iterable_body_class", None)
+    if data_body_class is None or not isinstance(response.response, (data_body_class, iterable_body_class)):
+        return response
+    encoding = choose_encoding(request, response, config)
+    if encoding is None:
+        return response
+    if isinstance(response.response, iterable_body_class):
+        mark_compressed(response, encoding)
+        stream = compress_async_stream(response.response, Compressor(encoding, config))
+        response.response = iterable_body_class(stream)
+        return response
+    data = await response.get_data(as_text=False)
+    if len(data) >= config["COMPRESS_MIN_SIZE"]:
+        response.set_data(compress(data, encoding, config))
+        response.headers["Content-Encoding"] = encoding
+    return response
+
+
+def precompressed(folder, filename, request):
+    """(file name to send, encoding) for a static file, preferring a fresh .br/.gz copy."""
+    path = os.path.join(folder, filename)
+    for suffix, encoding in STATIC_ENCODINGS.items():
+        if encoding in encodings() and request.accept_encodings[encoding]:
+            try:
+                if os.path.getmtime(path + suffix) >= os.path.getmtime(path):
+                    return filename + suffix, encoding
+            except OSError:
+                continue
+    return filename, None
+
+
+def static_headers(response, encoding, request, config):
+    if encoding and response.status_code in (200, 206):
+        response.headers["Content-Encoding"] = encoding
+    response.vary.add("Accept-Encoding")
+    if request.args.get("v"):
+        # Versioned URLs change whenever the file does
+        response.cache_control.no_cache = None
+        response.cache_control.public = True
+        response.cache_control.max_age = config["STATIC_MAX_AGE"]
+        response.cache_control.immutable = True
+    return response
+
+
+def static_version(folder, filename):
+    """Short content hash of a static file, recomputed when it changes."""
+    path = os.path.join(folder, filename)
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return None
+    cached = static_versions.get(path)
+    if cached is None or cached[0] != mtime:
+        with open(path, "rb") as file:
+            cached = static_versions[path] = (mtime, hashlib.md5(file.read()).hexdigest()[:10])
+    return cached[1]
+
+
+def precompress_static(folder):
+    """Write .br/.gz copies of compressible static files that are missing or stale."""
+    written = 0
+    for directory, _, names in os.walk(folder):
+        for name in names:
+            path = os.path.join(directory, name)
+            if os.path.splitext(name)[1] in STATIC_ENCODINGS or mimetypes.guess_type(name)[0] not in COMPRESSIBLE:
+                continue
+            for suffix, encoding in STATIC_ENCODINGS.items():
+                if encoding == "br" and not brotli:
+                    continue
+                target = path + suffix
+                if os.path.exists(target) and os.path.getmtime(target) >= os.path.getmtime(path):
+                    continue
+                with open(path, "rb") as file:
+                    data = file.read()
+                # Built once, so use the slowest, smallest settings
+                data = brotli.compress(data, quality=11) if encoding == "br" else compress_gzip(data)
+                # Workers may start together; write a temporary file and rename it into place
+                temporary = f"{target}.{os.getpid()}.tmp"
+                with open(temporary, "wb") as file:
+                    file.write(data)
+                os.replace(temporary, target)
+                written += 1
+    return written
+
+
+def compress_gzip(data):
+    compressor = zlib.compressobj(9, zlib.DEFLATED, 31)
+    return compressor.compress(data) + compressor.flush()
+
+
+def prepare_static(app):
+    if app.static_folder and os.path.isdir(app.static_folder):
+        try:
+            precompress_static(app.static_folder)
+        except OSError as e:
+            # e.g. a read-only filesystem: serve the uncompressed files
+            print(f"Could not precompress static files: {e}")
+
+
+def add_static_version(app, endpoint, values):
+    if endpoint == "static" and "filename" in values and "v" not in values:
+        version = static_version(app.static_folder, values["filename"])
+        if version:
+            values["v"] = version
+
+
+def init_app(app):
+    """Compress a Flask app's responses and serve precompressed static files."""
+    from flask import request, send_from_directory
+
+    prepare_static(app)
+    app.after_request(lambda response: compress_response(request, response, app.config))
+    app.url_defaults(lambda endpoint, values: add_static_version(app, endpoint, values))
+
+    def static(filename):
+        name, encoding = precompressed(app.static_folder, filename, request)
+        response = send_from_directory(app.static_folder, name, mimetype=mimetypes.guess_type(filename)[0])
+        return static_headers(response, encoding, request, app.config)
+
+    app.view_functions["static"] = static
+
+
+def init_async_app(app):
+    """Compress a Quart app's responses and serve precompressed static files."""
+    from quart import request, send_from_directory
+
+    prepare_static(app)
+
+    # Quart runs plain functions in a thread pool, so the hook is a coroutine
+    @app.after_request
+    async def compress(response):
+        return await compress_async_response(request, response, app.config)
+
+    app.url_defaults(lambda endpoint, values: add_static_version(app, endpoint, values))
+
+    async def static(filename):
+        name, encoding = precompressed(app.static_folder, filename, request)
+        response = await send_from_directory(app.static_folder, name, mimetype=mimetypes.guess_type(filename)[0])
+        return static_headers(response, encoding, request, app.config)
+
+    app.view_functions["static"] = static
+
+
+if __name__ == "__main__":
+    # Build step: python compression.py [static folder]
+    folder = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+    print(f"Precompressed {precompress_static(folder)} static files in {folder}")
@@ -0,0 +1,56 @@
+"""App configuration shared by the Flask and async apps."""
+import os
+
+
+def config_from_env():
+    """Default configuration, overridable with environment variables."""
+    env = os.environ.get
+    return {
+        # MONGO_URI overrides the Docker defaults, e.g. for a local mongod
+        "MONGO_URI": env("MONGO_URI"),
+        "MONGO_DB": env("MONGO_DB", "student_db"),
+        "MONGO_MAX_POOL_SIZE": int(env("MONGO_MAX_POOL_SIZE", 100)),
+        "MONGO_MIN_POOL_SIZE": int(env("MONGO_MIN_POOL_SIZE", 0)),
+        "MONGO_SERVER_SELECTION_TIMEOUT_MS": int(env("MONGO_SERVER_SELECTION_TIMEOUT_MS", 2000)),
+        "MONGO_CONNECT_TIMEOUT_MS": int(env("MONGO_CONNECT_TIMEOUT_MS", 2000)),
+        "MONGO_SOCKET_TIMEOUT_MS": int(env("MONGO_SOCKET_TIMEOUT_MS", 10000)),
+        # Where students are stored: mongo, or memory (one process only, see memory_store.py)
+        "STORAGE_BACKEND": env("STORAGE_BACKEND", "mongo"),
+        # File the memory backend loads at startup and saves to (unset: no persistence)
+        "MEMORY_SNAPSHOT": env("MEMORY_SNAPSHOT"),
+        "MEMORY_SNAPSHOT_INTERVAL": float(env("MEMORY_SNAPSHOT_INTERVAL", 60)),
+        # Set to 0 to skip the startup connection check and index bootstrap
+        "MONGO_BOOTSTRAP": env("MONGO_BOOTSTRAP", "1") not in ("0", "false", "no"),
+        "STUDENT_CACHE_SIZE": int(env("STUDENT_CACHE_SIZE", 10000)),
+        "STUDENT_CACHE_TTL": float(env("STUDENT_CACHE_TTL", 60)),
+        # Profile every request, or only those sending X-Profile: <PROFILE_TOKEN>
+        "PROFILE_REQUESTS": env("PROFILE_REQUESTS", "0") not in ("0", "false", "no"),
+        "PROFILE_TOKEN": env("PROFILE_TOKEN"),
+        "PROFILE_DIR": env("PROFILE_DIR", "profiles"),
+        # Log MongoDB commands slower than this with their plan; -1 turns the log off
+        "SLOW_QUERY_MS": float(env("SLOW_QUERY_MS", 100)),
+        "SLOW_QUERY_LOG": env("SLOW_QUERY_LOG", "slow_queries.jsonl"),
+        # Compress responses of at least this many bytes; -1 turns compression off
+        "COMPRESS_MIN_SIZE": int(env("COMPRESS_MIN_SIZE", 1024)),
+        "COMPRESS_LEVEL": int(env("COMPRESS_LEVEL", 6)),
+        "COMPRESS_BROTLI_LEVEL": int(env("COMPRESS_BROTLI_LEVEL", 4)),
+        # Follow other instances' writes through a change stream (needs a replica set)
+        "CHANGE_STREAMS": env("CHANGE_STREAMS", "1") not in ("0", "false", "no"),
+        # Group commit for POST /api/students (see insert_queue.py)
+        "INSERT_BATCHING": env("INSERT_BATCHING", "0") not in ("0", "false", "no"),
+        "INSERT_BATCH_SIZE": int(env("INSERT_BATCH_SIZE", 500)),
+        "INSERT_BATCH_WINDOW_MS": float(env("INSERT_BATCH_WINDOW_MS", 5)),
+        "INSERT_QUEUE_SIZE": int(env("INSERT_QUEUE_SIZE", 10000)),
+        "INSERT_QUEUE_TIMEOUT": float(env("INSERT_QUEUE_TIMEOUT", 1)),
+        # Adaptive concurrency limit for API requests (see admission.py)
+        "ADMISSION_CONTROL": env("ADMISSION_CONTROL", "1") not in ("0", "false", "no"),
+        "ADMISSION_MIN_LIMIT": int(env("ADMISSION_MIN_LIMIT", 4)),
+        "ADMISSION_MAX_LIMIT": int(env("ADMISSION_MAX_LIMIT", 256)),
+        "ADMISSION_LATENCY_TARGET_MS": float(env("ADMISSION_LATENCY_TARGET_MS", 100)),
+        "ADMISSION_QUEUE_SIZE": int(env("ADMISSION_QUEUE_SIZE", 64)),
+        "ADMISSION_QUEUE_TIMEOUT": float(env("ADMISSION_QUEUE_TIMEOUT", 0.5)),
+        # Per-route overrides, "view:class[:share],..." (see admission.py)
+        "ADMISSION_ROUTES": env("ADMISSION_ROUTES", ""),
+        # Cache lifetime of versioned static file URLs, in seconds
+        "STATIC_MAX_AGE": int(env("STATIC_MAX_AGE", 31536000)),
+    }
@@ -0,0 +1,184 @@
+"""Lazily created, fork-safe MongoDB connection."""
+import os
+import threading
+
+from pymongo import ASCENDING, TEXT, MongoClient
+from pymongo.errors import ConnectionFailure, ServerSelectionTimeoutError
+
+from student_fields import AGE_SORT, NATURAL_KEY, SORT_FIELDS
+
+# Indexes on the students collection the API queries rely on, as (keys, options)
+STUDENT_INDEXES = [
+    # Exact and prefix matches on the normalized names
+    ([("first_name_lower", ASCENDING)], {}),
+    ([("last_name_lower", ASCENDING)], {}),
+    # Whole word matches for multi word searches such as "jane doe"
+    ([("first_name", TEXT), ("last_name", TEXT)], {"name": "name_text", "default_language": "none"}),
+    # Natural key lookups for idempotent bulk imports
+    ([(field, ASCENDING) for field in NATURAL_KEY], {}),
+    # Age ranges, read in AGE_SORT order
+    ([(field, ASCENDING) for field, _ in AGE_SORT], {}),
+    # Upcoming birthdays, one (month, day) range per month of the window
+    ([("birth_month", ASCENDING), ("birth_day", ASCENDING), ("_id", ASCENDING)], {}),
+]
+
+
+def filter_indexes():
+    """Compound indexes backing the filters and sorts of GET /api/students.
+
+    Equality fields come first, then the sort field, then _id (the tie
+    breaker). A class filter, a session filter, or both, is read in sort
+    order straight from the index, so keyset pages never need an in-memory
+    sort. dob and created_date ranges use the index that leads with that
+    field (or follows the class or session). Every supported combination is
+    answered by an index scan.
+    """
+    indexes = []
+    for sort in SORT_FIELDS + ["_id"]:
+        tail = [(sort, ASCENDING)] + ([("_id", ASCENDING)] if sort != "_id" else [])
+        indexes.append(([("class", ASCENDING), ("session", ASCENDING)] + tail, {}))
+        indexes.append(([("class", ASCENDING)] + tail, {}))
+        indexes.append(([("session", ASCENDING)] + tail, {}))
+        if sort != "_id":
+            indexes.append((tail, {}))
+    return indexes
+
+
+STUDENT_INDEXES += filter_indexes()
+
+
+def default_mongo_uris():
+    """Candidate URIs when MONGO_URI isn't set, in the order they are tried.
+
+    When running in Docker, use the service name defined in docker-compose,
+    otherwise the special 'host.docker.internal' DNS to access the host.
+    """
+    uris = []
+    if "DOCKER_ENV" in os.environ:
+        uris.append("mongodb://mongo:27017")
+    uris.append("mongodb://host.docker.internal:27017")
+    return uris
+
+
+class Mongo:
+    """Holds the MongoClient for the current process.
+
+    Nothing connects until a collection is first used, so importing the app
+    never blocks on the database. A process forked after the client was
+    created (e.g. a pre-forking server) gets a client of its own on first
+    use instead of sharing sockets with its parent.
+    """
+
+    def __init__(self):
+        self.uris = default_mongo_uris()
+        self.db_name = "student_db"
+        self.client_options = {}
+        self._uri_index = 0
+        self._client = None
+        self._pid = None
+        self._lock = threading.Lock()
+        # Set once the startup checks and index bootstrap have finished
+        self.bootstrapped = threading.Event()
+        self.last_error = None
+
+    def init_app(self, app):
+        config = app.config
+        self.uris = [config["MONGO_URI"]] if config.get("MONGO_URI") else default_mongo_uris()
+        self.db_name = config["MONGO_DB"]
+        self.client_options = {
+            "maxPoolSize": config["MONGO_MAX_POOL_SIZE"],
+            "minPoolSize": config["MONGO_MIN_POOL_SIZE"],
+            "serverSelectionTimeoutMS": config["MONGO_SERVER_SELECTION_TIMEOUT_MS"],
+            "connectTimeoutMS": config["MONGO_CONNECT_TIMEOUT_MS"],
+            "socketTimeoutMS": config["MONGO_SOCKET_TIMEOUT_MS"],
+        }
+        self._uri_index = 0
+        self.bootstrapped.clear()
+        self.reset()
+        app.extensions["mongo"] = self
+
+    @property
+    def uri(self):
+        return self.uris[self._uri_index]
+
+    @property
+    def client(self):
+        pid = os.getpid()
+        if self._client is None or self._pid != pid:
+            with self._lock:
+                if self._client is None or self._pid != pid:
+                    self._client = self.create_client()
+                    self._pid = pid
+        return self._client
+
+    def create_client(self):
+        # connect=False defers the connection (and its background threads)
+        # until the first operation in this process
+        return MongoClient(self.uri, connect=False, **self.client_options)
+
+    @property
+    def db(self):
+        return self.client[self.db_name]
+
+    @property
+    def students(self):
+        return self.db["students"]
+
+    @property
+    def meta(self):
+        return self.db["meta"]
+
+    @property
+    def stats(self):
+        return self.db["student_stats"]
+
+    def reset(self):
+        """Drop the current client; the next use creates a new one."""
+        with self._lock:
+            if self._client is not None and self._pid == os.getpid():
+                self._client.close()
+            self._client = None
+
+    def ping(self):
+        """Return True if the database answers.
+
+        Until the bootstrap has succeeded, a failed ping moves on to the next
+        candidate URI, so the app finds whichever default host is reachable.
+        """
+        try:
+            self.client.admin.command("ping")
+            self.last_error = None
+            return True
+        except (ConnectionFailure, ServerSelectionTimeoutError) as e:
+            self.last_error = str(e)
+            if len(self.uris) > 1 and not self.bootstrapped.is_set():
+                self._uri_index = (self._uri_index + 1) % len(self.uris)
+                self.reset()
+            return False
+
+
+class AsyncMongo(Mongo):
+    """Holds the Motor (asyncio) client for the current process.
+
+    Same configuration and lazy, per-process creation as Mongo. Collections
+    return Motor collections whose methods are awaited; the client's
+    connection pool is shared by every request handled by the event loop.
+    """
+
+    def create_client(self):
+        from motor.motor_asyncio import AsyncIOMotorClient
+        # Motor doesn't connect until the first operation either
+        return AsyncIOMotorClient(self.uri, **self.client_options)
+
+    async def ping(self):
+        """Return True if the database answers; see Mongo.ping."""
+        try:
+            await self.client.admin.command("ping")
+            self.last_error = None
+            return True
+        except (ConnectionFailure, ServerSelectionTimeoutError) as e:
+            self.last_error = str(e)
+            if len(self.uris) > 1 and not self.bootstrapped.is_set():
+                self._uri_index = (self._uri_index + 1) % len(self.uris)
+                self.reset()
+            return False
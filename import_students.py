@@ -0,0 +1,378 @@
+"""Import students from a JSON array or NDJSON file into MongoDB.
+
+Usage:
+    python import_students.py student_data.json
+    python import_students.py students.ndjson --workers 8 --batch-size 5000
+    python import_students.py students.ndjson --mode append
+
+The file is parsed as a stream and inserted in fixed-size batches by a pool
+of worker threads, so memory use doesn't depend on the file size.
+
+Modes:
+    swap    (default) Load into a staging collection, then rename it over
+            the students collection in one step. Readers see either the old
+            or the new data set, never a partial one.
+    append  Insert into the students collection alongside existing data.
+
+Progress is checkpointed next to the input file. If an import is
+interrupted, running the same command again resumes where it stopped;
+pass --restart to start over instead.
+"""
+import argparse
+import json
+import os
+import random
+import re
+import struct
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from bson.objectid import ObjectId
+from pymongo import MongoClient, TEXT
+from pymongo.errors import BulkWriteError
+
+from student_fields import REQUIRED_FIELDS, derived_fields
+from student_stats import REBUILD_PIPELINE, rebuilt_buckets, replace_operations
+
+# Characters read from the input per chunk
+READ_SIZE = 1 << 16
+# MongoDB error code for duplicate keys, expected when a batch is re-sent on resume
+DUPLICATE_KEY = 11000
+# A record cut off inside a literal, number or escape (tru, 1e, \u00) fails this close to the end
+TRUNCATION_SLACK = 8
+
+
+def truncated(error, buffer):
+    """Whether a decode error may only mean the record continues past the end of the buffer."""
+    return error.msg.startswith("Unterminated string") or error.pos >= len(buffer) - TRUNCATION_SLACK
+
+
+def iter_json_array(file):
+    """Yield the elements of a JSON array one at a time without loading the whole file."""
+    decoder = json.JSONDecoder()
+    buffer = ""
+    position = 0
+    offset = 0                 # Characters of the file dropped from the buffer
+    number = 0
+    eof = False
+    started = False
+
+    while True:
+        # Skip separators, refilling the buffer when it runs out
+        while True:
+            while position < len(buffer) and buffer[position] in " \t\r\n,":
+                position += 1
+            if position < len(buffer) or eof:
+                break
+            offset += position
+            buffer = buffer[position:] + file.read(READ_SIZE)
+            position = 0
+            eof = len(buffer) == 0
+
+        if position >= len(buffer):
+            raise ValueError("Unexpected end of file: JSON array is not closed")
+        if not started:
+            if buffer[position] != "[":
+                raise ValueError("Expected a JSON array")
+            started = True
+            position += 1
+            continue
+        if buffer[position] == "]":
+            return
+
+        try:
+            record, end = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError as e:
+            # A record split across reads fails at the end of the buffer: read more and retry.
+            # Anything else is malformed, and reading on would pull the rest of the file in
+            chunk = file.read(READ_SIZE) if truncated(e, buffer) else ""
+            if not chunk:
+                raise ValueError(f"Invalid JSON in record {number + 1} at character {offset + e.pos}: {e.msg}")
+            offset += position
+            buffer = buffer[position:] + chunk
+            position = 0
+            continue
+        number += 1
+        yield record
+        position = end
+
+
+def iter_ndjson(file):
+    """Yield one record per non-empty line."""
+    for number, line in enumerate(file, 1):
+        line = line.strip()
+        if line:
+            try:
+                yield json.loads(line)
+            except ValueError as e:
+                raise ValueError(f"Invalid JSON on line {number}: {e}")
+
+
+def iter_records(file):
+    """Detect the input format from its first character and yield records."""
+    first = file.read(1)
+    while first and first.isspace():
+        first = file.read(1)
+    file.seek(0)
+    return iter_json_array(file) if first == "[" else iter_ndjson(file)
+
+
+def record_id(run, index):
+    """Deterministic ObjectId for the `index`-th record of an import run.
+
+    Made of the run's start time, a random tag for the run and the record
+    index, so re-sending a batch after a resume fails with duplicate key
+    errors instead of inserting the same students twice, and ids still sort
+    in file order.
+    """
+    return ObjectId(struct.pack(">III", run["started"], run["tag"], index))
+
+
+def prepare(record, index, run):
+    """Return the document to insert for a record, or None if it isn't a valid student."""
+    if not isinstance(record, dict) or any(field not in record for field in REQUIRED_FIELDS):
+        return None
+    document = dict(record)
+    document.pop("_id", None)
+    document.setdefault("created_date", datetime.now().strftime("%Y-%m-%d"))
+    document.update(derived_fields(document))
+    document["_id"] = record_id(run, index)
+    return document
+
+
+def insert_batch(collection, documents):
+    """Insert a batch, ignoring documents already stored by an earlier run."""
+    if not documents:
+        return 0
+    try:
+        collection.insert_many(documents, ordered=False)
+        return len(documents)
+    except BulkWriteError as e:
+        errors = e.details["writeErrors"]
+        other = [error for error in errors if error["code"] != DUPLICATE_KEY]
+        if other:
+            raise
+        return len(documents) - len(errors)
+
+
+def copy_indexes(source, target):
+    """Create the indexes of `source` (except _id) on `target`."""
+    for index in source.list_indexes():
+        if index["name"] == "_id_":
+            continue
+        options = {key: value for key, value in index.items() if key not in ("v", "key", "ns")}
+        if "_fts" in index["key"]:
+            # Text indexes are described by their weights, not their key
+            keys = [(field, TEXT) for field in index["weights"]]
+        else:
+            keys = list(index["key"].items())
+        target.create_index(keys, **options)
+
+
+def check_staging(db, staging_name, state):
+    """Refuse to swap in a staging collection that doesn't hold the whole import."""
+    if staging_name not in db.list_collection_names():
+        raise ValueError(f"Staging collection {staging_name} is missing; nothing to swap in")
+    expected = state["records_done"] - state["rejected"]
+    count = db[staging_name].count_documents({})
+    if count == 0 or count != expected:
+        raise ValueError(f"Staging collection {staging_name} holds {count} students, "
+                         f"expected {expected}; rerun with --restart")
+
+
+def bump_version(db):
+    """Let the API know the students changed (drives its ETag / Last-Modified headers)."""
+    db["meta"].update_one(
+        {"_id": "students"},
+        {"$inc": {"version": 1}, "$set": {"modified": datetime.now(timezone.utc)}},
+        upsert=True
+    )
+
+
+def rebuild_stats(db, collection):
+    """Recount the API's headcount summary (student_stats) from `collection`."""
+    buckets = rebuilt_buckets(next(collection.aggregate(REBUILD_PIPELINE)))
+    db["student_stats"].bulk_write(replace_operations(buckets), ordered=False)
+    db["student_stats"].delete_many({"_id": {"$nin": list(buckets)}})
+
+
+class Checkpoint:
+    """Progress of an import run, saved atomically to a JSON file."""
+
+    def __init__(self, path, input_path, uri, database, collection):
+        self.path = path
+        stat = os.stat(input_path)
+        self.source = {"input": os.path.abspath(input_path), "size": stat.st_size, "mtime": stat.st_mtime}
+        # Where the records went; credentials are left out of the file
+        self.destination = {"uri": re.sub(r"//[^@/]*@", "//", uri or ""), "db": database, "collection": collection}
+        self.state = None
+
+    def load(self, mode):
+        """Return saved progress for the same input file, destination and mode, or None."""
+        if not os.path.exists(self.path):
+            return None
+        with open(self.path) as file:
+            state = json.load(file)
+        if (state.get("source") != self.source or state.get("destination") != self.destination
+                or state.get("mode") != mode):
+            print(f"Ignoring checkpoint {self.path}: it was written for a different input, database or mode")
+            return None
+        self.state = state
+        return state
+
+    def start(self, mode, target):
+        self.state = {
+            "source": self.source,
+            "destination": self.destination,
+            "mode": mode,
+            "target": target,
+            "run": {"started": int(time.time()), "tag": random.getrandbits(32)},
+            "records_done": 0,
+            "rejected": 0,
+        }
+        self.save()
+        return self.state
+
+    def save(self):
+        temporary = self.path + ".tmp"
+        with open(temporary, "w") as file:
+            json.dump(self.state, file)
+        os.replace(temporary, self.path)
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def run_import(path, db, collection_name="students", mode="swap", batch_size=1000,
+               workers=4, restart=False, checkpoint_path=None, uri=None):
+    """Import `path` into `db[collection_name]`; returns (inserted, rejected) counts.
+
+    `uri` is the server `db` is on; a checkpoint is only resumed on the same one.
+    """
+    checkpoint = Checkpoint(checkpoint_path or path + ".checkpoint", path, uri, db.name, collection_name)
+    state = None if restart else checkpoint.load(mode)
+    staging_name = f"{collection_name}_import"
+    target_name = staging_name if mode == "swap" else collection_name
+
+    if state:
+        print(f"Resuming after {state['records_done']} records")
+    else:
+        state = checkpoint.start(mode, target_name)
+        if mode == "swap":
+            db.drop_collection(staging_name)
+    target = db[target_name]
+    skip = state["records_done"]
+    run = state["run"]
+
+    lock = threading.Lock()
+    finished = set()           # Batches completed out of order
+    next_batch = [skip // batch_size]
+    inserted = [0]
+    state.setdefault("rejected", 0)
+
+    def on_done(batch_number, end_record, count, batch_rejected):
+        # Only move the checkpoint past batches with no earlier batch still pending
+        with lock:
+            inserted[0] += count
+            finished.add((batch_number, end_record, batch_rejected))
+            advanced = False
+            while finished and min(finished)[0] == next_batch[0]:
+                _, records_done, done_rejected = min(finished)
+                finished.discard(min(finished))
+                state["records_done"] = records_done
+                state["rejected"] += done_rejected
+                next_batch[0] += 1
+                advanced = True
+            if advanced:
+                checkpoint.save()
+
+    def worker(batch_number, end_record, documents, batch_rejected):
+        on_done(batch_number, end_record, insert_batch(target, documents), batch_rejected)
+
+    rejected = 0
+    with open(path) as file, ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = []
+        batch = []
+        batch_rejected = 0
+        batch_number = skip // batch_size
+        index = -1
+        for index, record in enumerate(iter_records(file)):
+            if index < skip:
+                continue
+            document = prepare(record, index, run)
+            if document is None:
+                rejected += 1
+                batch_rejected += 1
+            else:
+                batch.append(document)
+            if (index + 1) % batch_size == 0:
+                pending.append(pool.submit(worker, batch_number, index + 1, batch, batch_rejected))
+                batch = []
+                batch_rejected = 0
+                batch_number += 1
+                # Bound the batches held in memory
+                if len(pending) >= workers * 2:
+                    pending.pop(0).result()
+        if index + 1 > skip and (index + 1) % batch_size:
+            pending.append(pool.submit(worker, batch_number, index + 1, batch, batch_rejected))
+        for future in pending:
+            future.result()
+
+    if mode == "swap":
+        # A checkpoint marked "swapped" with no staging collection left means the
+        # rename already happened before an interruption; renaming again would
+        # replace the students with an empty collection
+        if not state.get("swapped") or staging_name in db.list_collection_names():
+            check_staging(db, staging_name, state)
+            # Record the swap before making it, so a resume can tell it happened
+            state["swapped"] = True
+            checkpoint.save()
+            live = db[collection_name]
+            if collection_name in db.list_collection_names():
+                copy_indexes(live, target)
+            target.rename(collection_name, dropTarget=True)
+
+    # Recount the API's headcount summary, which the new data set invalidates
+    rebuild_stats(db, db[collection_name])
+
+    bump_version(db)
+    checkpoint.remove()
+    return inserted[0], rejected
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import students from a JSON array or NDJSON file")
+    parser.add_argument("input", nargs="?", default="student_data.json")
+    parser.add_argument("--uri", default=os.environ.get("MONGO_URI", "mongodb://localhost:27017"))
+    parser.add_argument("--db", default="student_db")
+    parser.add_argument("--collection", default="students")
+    parser.add_argument("--mode", choices=["swap", "append"], default="swap")
+    parser.add_argument("--batch-size", type=int, default=1000, help="Documents per insert_many")
+    parser.add_argument("--workers", type=int, default=4, help="Concurrent insert threads")
+    parser.add_argument("--checkpoint", help="Checkpoint file (default: <input>.checkpoint)")
+    parser.add_argument("--restart", action="store_true", help="Ignore any saved checkpoint")
+    args = parser.parse_args(argv)
+
+    client = MongoClient(args.uri)
+    start = time.perf_counter()
+    try:
+        inserted, rejected = run_import(
+            args.input, client[args.db], args.collection, mode=args.mode,
+            batch_size=args.batch_size, workers=args.workers,
+            restart=args.restart, checkpoint_path=args.checkpoint, uri=args.uri
+        )
+    except (OSError, ValueError) as e:
+        sys.exit(f"Import failed: {e}")
+    finally:
+        client.close()
+
+    print(f"{inserted} documents were inserted into {args.db}.{args.collection} "
+          f"in {time.perf_counter() - start:.1f}s ({rejected} invalid records skipped)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+"""Group commit for single student inserts (POST /api/students).
+
+With INSERT_BATCHING=1, requests don't insert their student themselves.
+They put it on a bounded queue and wait, and a background flusher writes
+everything queued so far with one insert_many, one stats update and one
+version bump. A batch is written when it reaches INSERT_BATCH_SIZE
+students, or INSERT_BATCH_WINDOW_MS after its first student arrived.
+
+Every request still gets its own id and a 201 only once its student is
+stored, so the API doesn't change. When the queue stays full for
+INSERT_QUEUE_TIMEOUT seconds, insert() raises QueueFull and the request is
+answered with 503 and Retry-After.
+"""
+import asyncio
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from pymongo.errors import WriteError
+
+
+class QueueFull(Exception):
+    """The insert queue stayed full for the whole submit timeout."""
+
+
+class InsertQueue:
+    """Coalesces documents into batches written by `write` on a flusher thread.
+
+    `write(documents)` stores a batch and returns one error message (or
+    None) per document. If it raises, every request in the batch gets the
+    exception.
+    """
+
+    def __init__(self, write):
+        self.write = write
+        self.enabled = False
+        self.batch_size = 500
+        self.window = 0.005
+        self.maxsize = 10000
+        self.timeout = 1.0
+        self._queue = None
+        self._pid = None
+        self._worker = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        config = app.config
+        self.enabled = config["INSERT_BATCHING"]
+        self.batch_size = config["INSERT_BATCH_SIZE"]
+        self.window = config["INSERT_BATCH_WINDOW_MS"] / 1000
+        self.maxsize = config["INSERT_QUEUE_SIZE"]
+        self.timeout = config["INSERT_QUEUE_TIMEOUT"]
+        self._queue = None
+
+    @property
+    def queue(self):
+        # A forked worker gets its own queue and flusher, like Mongo.client
+        pid = os.getpid()
+        if self._queue is None or self._pid != pid:
+            with self._lock:
+                if self._queue is None or self._pid != pid:
+                    self._queue = self.create_queue()
+                    self._worker = None
+                    self._pid = pid
+        return self._queue
+
+    def create_queue(self):
+        return queue.Queue(self.maxsize)
+
+    def insert(self, document):
+        """Queue `document` and wait until it is stored."""
+        future = Future()
+        try:
+            self.queue.put((document, future), timeout=self.timeout)
+        except queue.Full:
+            raise QueueFull(f"{self.maxsize} inserts already waiting")
+        self.start_worker()
+        future.result()
+
+    def start_worker(self):
+        if self._worker is None or not self._worker.is_alive():
+            with self._lock:
+                if self._worker is None or not self._worker.is_alive():
+                    self._worker = threading.Thread(target=self.run, name="insert-flusher", daemon=True)
+                    self._worker.start()
+
+    def run(self):
+        pending = self.queue
+        while True:
+            batch = [pending.get()]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.batch_size:
+                try:
+                    # Past the deadline, still take what is already queued
+                    batch.append(pending.get(timeout=max(deadline - time.monotonic(), 0)))
+                except queue.Empty:
+                    break
+            self.flush(batch)
+
+    def flush(self, batch):
+        try:
+            errors = self.write([document for document, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        for (_, future), error in zip(batch, errors):
+            if error:
+                future.set_exception(WriteError(error))
+            else:
+                future.set_result(None)
+
+
+class AsyncInsertQueue(InsertQueue):
+    """InsertQueue for the async app: an asyncio queue flushed by a task.
+
+    `write` is a coroutine function; everything runs on the event loop.
+    """
+
+    def create_queue(self):
+        return asyncio.Queue(self.maxsize)
+
+    async def insert(self, document):
+        """Queue `document` and wait until it is stored."""
+        future = asyncio.get_running_loop().create_future()
+        try:
+            await asyncio.wait_for(self.queue.put((document, future)), self.timeout)
+        except asyncio.TimeoutError:
+            raise QueueFull(f"{self.maxsize} inserts already waiting")
+        self.start_worker()
+        await future
+
+    def start_worker(self):
+        if self._worker is None or self._worker.done():
+            # Keep a reference so the task isn't garbage collected
+            self._worker = asyncio.get_running_loop().create_task(self.run())
+
+    async def run(self):
+        pending = self.queue
+        while True:
+            batch = [await pending.get()]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    if remaining > 0:
+                        batch.append(await asyncio.wait_for(pending.get(), remaining))
+                    else:
+                        batch.append(pending.get_nowait())
+                except (asyncio.TimeoutError, asyncio.QueueEmpty):
+                    break
+            await self.flush(batch)
+
+    async def flush(self, batch):
+        try:
+            errors = await self.write([document for document, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), error in zip(batch, errors):
+            # A request that timed out or was cancelled no longer waits
+            if future.done():
+                continue
+            if error:
+                future.set_exception(WriteError(error))
+            else:
+                future.set_result(None)
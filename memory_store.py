@@ -0,0 +1,681 @@
+"""In-memory student storage (STORAGE_BACKEND=memory).
+
+Students are kept as compact StudentRecord objects (__slots__, no per
+record dict) in this process:
+- a hash index on _id serves lookups and deletes;
+- a list of ids in _id order serves the default sort and its cursors;
+- sorted indexes of (value, _id) on class, session, the normalized names,
+  dob, created_date, dob_date and birth_month serve equality, $in and range
+  conditions, name prefixes, and sorted pages without sorting;
+- a hash index of name words serves multi-word name searches.
+
+A query is answered from the most selective index among its conditions
+(or by walking the sort field's index in order when that reads less), and
+the remaining conditions are checked record by record. Values are compared
+across types in MongoDB's order (null, numbers, strings, ..., dates), so
+both backends return the same results.
+
+With MEMORY_SNAPSHOT set, the students and the version are written to that
+file as BSON every MEMORY_SNAPSHOT_INTERVAL seconds when they changed, and
+at exit, and loaded at startup. The data lives in one process: run a
+single server process (no --workers) with this backend.
+"""
+import atexit
+import bisect
+import os
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timezone
+
+import bson
+from bson.objectid import ObjectId
+from pymongo.errors import DuplicateKeyError
+
+from repository import StudentRepository, object_id
+from student_fields import DEFAULT_SORT, NATURAL_KEY
+from student_stats import stats_buckets
+
+# Stored fields and the record attribute holding each ("class" is a keyword)
+FIELDS = {
+    "_id": "id", "first_name": "first_name", "last_name": "last_name", "dob": "dob",
+    "class": "class_", "session": "session", "created_date": "created_date",
+    "first_name_lower": "first_name_lower", "last_name_lower": "last_name_lower",
+    "dob_date": "dob_date", "birth_month": "birth_month", "birth_day": "birth_day",
+}
+
+# Fields with a sorted index
+INDEXED_FIELDS = ["class", "session", "first_name_lower", "last_name_lower",
+                  "dob", "created_date", "dob_date", "birth_month"]
+
+RANGE_OPERATORS = {"$gt", "$gte", "$lt", "$lte"}
+
+# Batches of at least this many records are merged into an index in one pass
+MERGE_BATCH = 32
+
+# Sorts after every _id's bytes, to find the end of a value's entries
+MAX_ID = b"\xff" * 13
+
+
+class StudentRecord:
+    """One stored student. Replaced, never changed, once stored."""
+
+    __slots__ = tuple(FIELDS.values())
+
+    def __init__(self, document):
+        for field, attribute in FIELDS.items():
+            setattr(self, attribute, document.get(field))
+
+    def get(self, field, default=None):
+        attribute = FIELDS.get(field)
+        value = getattr(self, attribute) if attribute else None
+        return default if value is None and default is not None else value
+
+    def document(self, projection=None):
+        """The record as a document with the `projection` fields and _id."""
+        fields = FIELDS if projection is None else ["_id", *projection]
+        return {field: self.get(field) for field in fields if field in FIELDS}
+
+
+def sort_key(value):
+    """Order values like MongoDB: null < numbers < strings < ObjectIds < booleans < dates."""
+    if value is None:
+        return (0,)
+    if isinstance(value, bool):
+        return (8, value)
+    if isinstance(value, (int, float)):
+        return (1, value)
+    if isinstance(value, str):
+        return (2, value)
+    if isinstance(value, ObjectId):
+        return (7, value)
+    if isinstance(value, datetime):
+        return (9, value)
+    return (3, repr(value))
+
+
+def compare(value, operator, operand):
+    """A range condition; like MongoDB, only values of the operand's type match."""
+    value, operand = sort_key(value), sort_key(operand)
+    if value[0] != operand[0]:
+        return False
+    if operator == "$gt":
+        return value > operand
+    if operator == "$gte":
+        return value >= operand
+    if operator == "$lt":
+        return value < operand
+    return value <= operand
+
+
+def is_operators(condition):
+    return isinstance(condition, dict) and bool(condition) and all(key.startswith("$") for key in condition)
+
+
+def matches_condition(value, condition):
+    if not is_operators(condition):
+        if type(value) is type(condition):
+            return value == condition
+        return sort_key(value) == sort_key(condition)
+    for operator, operand in condition.items():
+        if operator == "$eq":
+            matched = sort_key(value) == sort_key(operand)
+        elif operator == "$ne":
+            matched = sort_key(value) != sort_key(operand)
+        elif operator == "$in":
+            matched = sort_key(value) in {sort_key(item) for item in operand}
+        elif operator == "$nin":
+            matched = sort_key(value) not in {sort_key(item) for item in operand}
+        elif operator in RANGE_OPERATORS:
+            matched = compare(value, operator, operand)
+        else:
+            raise ValueError(f"The memory store doesn't support {operator}")
+        if not matched:
+            return False
+    return True
+
+
+def matches(record, query):
+    """Whether a record matches a MongoDB style query."""
+    for field, condition in query.items():
+        if field == "$and":
+            if not all(matches(record, part) for part in condition):
+                return False
+        elif field == "$or":
+            if not any(matches(record, part) for part in condition):
+                return False
+        elif not matches_condition(record.get(field), condition):
+            return False
+    return True
+
+
+def conjuncts(query):
+    """(field, condition) pairs every match must satisfy, for index selection."""
+    for field, condition in query.items():
+        if field == "$and":
+            for part in condition:
+                yield from conjuncts(part)
+        elif not field.startswith("$"):
+            yield field, condition
+
+
+class SortedIndex:
+    """(value, _id bytes, _id) entries of one field, kept sorted.
+
+    Entries are ordered by the _id's bytes (the same order as the ObjectIds),
+    which compare much faster than ObjectIds.
+    """
+
+    def __init__(self, field):
+        self.field = field
+        self.keys = []
+
+    def entry(self, record):
+        return (sort_key(record.get(self.field)), record.id.binary, record.id)
+
+    def add(self, records):
+        entries = sorted(map(self.entry, records))
+        if len(entries) < MERGE_BATCH:
+            for entry in entries:
+                bisect.insort(self.keys, entry)
+            return
+        # Merge: copy the runs of existing entries between the new ones
+        merged = []
+        previous = 0
+        for entry in entries:
+            position = bisect.bisect_left(self.keys, entry, previous)
+            merged.extend(self.keys[previous:position])
+            merged.append(entry)
+            previous = position
+        merged.extend(self.keys[previous:])
+        self.keys = merged
+
+    def remove(self, record):
+        entry = self.entry(record)
+        position = bisect.bisect_left(self.keys, entry)
+        if position < len(self.keys) and self.keys[position] == entry:
+            del self.keys[position]
+
+    def bounds(self, condition):
+        """(start, end) positions of the entries matching a condition, or None if it can't be served."""
+        if not is_operators(condition):
+            condition = {"$eq": condition}
+        if set(condition) - RANGE_OPERATORS - {"$eq"}:
+            return None
+        start, end = 0, len(self.keys)
+        for operator, operand in condition.items():
+            key = sort_key(operand)
+            # Entries of the operand's type only (see compare)
+            if operator in ("$eq", "$gte"):
+                start = max(start, bisect.bisect_left(self.keys, (key,)))
+            if operator == "$gt":
+                start = max(start, bisect.bisect_left(self.keys, (key, MAX_ID)))
+            if operator in ("$eq", "$lte"):
+                end = min(end, bisect.bisect_left(self.keys, (key, MAX_ID)))
+            if operator == "$lt":
+                end = min(end, bisect.bisect_left(self.keys, (key,)))
+            if operator in ("$gt", "$gte"):
+                end = min(end, bisect.bisect_left(self.keys, ((key[0] + 1,),)))
+            if operator in ("$lt", "$lte"):
+                start = max(start, bisect.bisect_left(self.keys, ((key[0],),)))
+        return start, max(start, end)
+
+    def prefix(self, text):
+        """Ids of the string values starting with `text`, in value order."""
+        position = bisect.bisect_left(self.keys, ((2, text),))
+        while position < len(self.keys):
+            key, _, student_id = self.keys[position]
+            if key[0] != 2 or not key[1].startswith(text):
+                return
+            yield student_id
+            position += 1
+
+
+def words(*names):
+    return {word for name in names for word in re.findall(r"\w+", str(name or "").lower())}
+
+
+class MemoryStore:
+    """The indexed students of this process; every method is thread safe."""
+
+    def __init__(self):
+        self.records = {}
+        self.ids = []
+        self.indexes = {field: SortedIndex(field) for field in INDEXED_FIELDS}
+        self.name_words = defaultdict(set)
+        self.natural_keys = defaultdict(set)
+        self.lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.records)
+
+    # Writes
+
+    def add(self, record, key_fields):
+        failed = self.add_many([record], key_fields)
+        if failed:
+            raise DuplicateKeyError(failed[0])
+
+    def add_many(self, records, key_fields):
+        """Store records; returns {position: error message} for those whose _id is taken."""
+        added = []
+        failed = {}
+        for position, record in enumerate(records):
+            if record.id in self.records:
+                failed[position] = f"E11000 duplicate key error dup key: {{ _id: {record.id} }}"
+                continue
+            self.records[record.id] = record
+            added.append(record)
+            for word in words(record.first_name, record.last_name):
+                self.name_words[word].add(record.id)
+            self.natural_keys[self.natural_key(record, key_fields)].add(record.id)
+        if not added:
+            return failed
+        # New ObjectIds sort last, so this is usually an append
+        sorted_ids = not self.ids or self.ids[-1] < added[0].id
+        self.ids.extend(record.id for record in added)
+        if not sorted_ids or any(a.id > b.id for a, b in zip(added, added[1:])):
+            self.ids.sort()
+        for index in self.indexes.values():
+            index.add(added)
+        return failed
+
+    def remove(self, record, key_fields):
+        del self.records[record.id]
+        del self.ids[bisect.bisect_left(self.ids, record.id)]
+        for index in self.indexes.values():
+            index.remove(record)
+        for word in words(record.first_name, record.last_name):
+            self.name_words[word].discard(record.id)
+            if not self.name_words[word]:
+                del self.name_words[word]
+        key = self.natural_key(record, key_fields)
+        self.natural_keys[key].discard(record.id)
+        if not self.natural_keys[key]:
+            del self.natural_keys[key]
+
+    def natural_key(self, record, key_fields):
+        return tuple(sort_key(record.get(field)) for field in key_fields)
+
+    # Reads
+
+    def id_bounds(self, condition):
+        """(start, end) positions in the id list of the ids matching a condition, or None if it can't be served."""
+        if not is_operators(condition):
+            condition = {"$eq": condition}
+        if set(condition) - RANGE_OPERATORS - {"$eq"}:
+            return None
+        start, end = 0, len(self.ids)
+        for operator, operand in condition.items():
+            if not isinstance(operand, ObjectId):
+                return 0, 0
+            if operator in ("$eq", "$gte"):
+                start = max(start, bisect.bisect_left(self.ids, operand))
+            if operator == "$gt":
+                start = max(start, bisect.bisect_right(self.ids, operand))
+            if operator in ("$eq", "$lte"):
+                end = min(end, bisect.bisect_right(self.ids, operand))
+            if operator == "$lt":
+                end = min(end, bisect.bisect_left(self.ids, operand))
+        return start, max(start, end)
+
+    def field_bounds(self, field, condition):
+        if field == "_id":
+            return self.id_bounds(condition)
+        return self.indexes[field].bounds(condition)
+
+    def field_ranges(self, field, condition):
+        """Position ranges in `field`'s order holding the matches of a condition, or None if it can't be served."""
+        if is_operators(condition) and set(condition) == {"$in"}:
+            items = {sort_key(item): item for item in condition["$in"]}.values()
+            return [self.field_bounds(field, {"$eq": item}) for item in items]
+        bounds = self.field_bounds(field, condition)
+        return None if bounds is None else [bounds]
+
+    def ids_at(self, field, positions):
+        """The ids at `positions` of `field`'s order."""
+        if field == "_id":
+            return (self.ids[position] for position in positions)
+        keys = self.indexes[field].keys
+        return (keys[position][2] for position in positions)
+
+    def candidates(self, query):
+        """(field, position ranges, size) of the most selective indexed condition of `query`, or None."""
+        best = None
+        for field, condition in conjuncts(query):
+            if field != "_id" and field not in self.indexes:
+                continue
+            ranges = self.field_ranges(field, condition)
+            if ranges is None:
+                continue
+            size = sum(end - start for start, end in ranges)
+            if best is None or size < best[2]:
+                best = (field, ranges, size)
+        return best
+
+    def query_bounds(self, query, field):
+        """(start, end) positions in `field`'s order holding every match of `query`.
+
+        Takes conditions on `field`, also inside $and and $or, so that
+        cursor queries ({"$or": [{dob: {"$gt": ...}}, {dob: ..., _id: ...}]})
+        start where the previous page ended.
+        """
+        start, end = 0, len(self.ids)
+        for key, condition in query.items():
+            if key in ("$and", "$or"):
+                parts = [self.query_bounds(part, field) for part in condition]
+                if key == "$or":
+                    # The span from the first to the last part holding matches
+                    parts = [part for part in parts if part[0] < part[1]] or [(0, 0)]
+                    parts = [(min(part[0] for part in parts), max(part[1] for part in parts))]
+            elif key == field:
+                parts = [self.field_bounds(field, condition) or (0, len(self.ids))]
+            else:
+                continue
+            for part_start, part_end in parts:
+                start, end = max(start, part_start), min(end, part_end)
+        return start, max(start, end)
+
+    def ordered_scan(self, query, sort):
+        """(field, positions) to read in `sort` order, if an index holds that order, else None."""
+        field, direction = sort[0]
+        if len(sort) > 2 or (len(sort) == 2 and sort[1] != ("_id", direction)):
+            return None
+        if field != "_id" and field not in self.indexes:
+            return None
+        start, end = self.query_bounds(query, field)
+        return field, range(start, end) if direction == 1 else range(end - 1, start - 1, -1)
+
+    def find(self, query, sort, limit=None):
+        """Records matching `query` in `sort` order, at most `limit` of them."""
+        with self.lock:
+            best = self.candidates(query)
+            scan = self.ordered_scan(query, sort)
+            if scan is not None:
+                # Reading in sort order stops after `limit` matches, which are
+                # expected every len(positions) / size records
+                reads = len(scan[1])
+                if limit and best is not None and best[2]:
+                    reads = min(reads, limit * reads / best[2])
+                if best is None or reads <= best[2]:
+                    return self.scan(query, *scan, limit)
+            if best is None:
+                ids = self.ids
+            else:
+                field, ranges, _ = best
+                ids = [student_id for start, end in ranges for student_id in self.ids_at(field, range(start, end))]
+            found = [self.records[student_id] for student_id in ids if matches(self.records[student_id], query)]
+        # Stable sorts, last key first
+        for field, direction in reversed(sort):
+            found.sort(key=lambda record: sort_key(record.get(field)), reverse=direction == -1)
+        return found[:limit] if limit else found
+
+    def scan(self, query, field, positions, limit):
+        found = []
+        for student_id in self.ids_at(field, positions):
+            record = self.records[student_id]
+            if matches(record, query):
+                found.append(record)
+                if limit and len(found) >= limit:
+                    break
+        return found
+
+    def search_names(self, term, limit):
+        with self.lock:
+            if " " in term:
+                # Whole words, ranked by the number of matching words
+                scores = Counter()
+                for word in set(re.findall(r"\w+", term)):
+                    for student_id in self.name_words.get(word, ()):
+                        scores[student_id] += 1
+                ranked = sorted(scores, key=lambda student_id: (-scores[student_id], student_id))
+                return [self.records[student_id] for student_id in ranked[:limit]]
+            exact = set()
+            for field in ("first_name_lower", "last_name_lower"):
+                start, end = self.indexes[field].bounds(term)
+                exact.update(student_id for _, _, student_id in self.indexes[field].keys[start:end])
+            found = sorted(exact)[:limit]
+            seen = set(found)
+            for field in ("first_name_lower", "last_name_lower"):
+                for student_id in self.indexes[field].prefix(term):
+                    if len(found) >= limit:
+                        break
+                    if student_id not in seen:
+                        seen.add(student_id)
+                        found.append(student_id)
+            return [self.records[student_id] for student_id in found]
+
+
+class MemoryRepository(StudentRepository):
+    """Students in a MemoryStore, optionally snapshotted to `snapshot_path`."""
+
+    # upsert_many() finds students by these fields in a hash index
+    key_fields = tuple(NATURAL_KEY)
+
+    def __init__(self, snapshot_path=None, snapshot_interval=60):
+        self.store = MemoryStore()
+        self.snapshot_path = snapshot_path
+        self.snapshot_interval = snapshot_interval
+        self.bootstrapped = threading.Event()
+        self.buckets = Counter()
+        self.stats_built = False
+        self.version = None
+        self.changes = 0
+        self._saved_changes = 0
+        self._snapshot_lock = threading.Lock()
+
+    @property
+    def name(self):
+        if self.snapshot_path:
+            return f"memory store (snapshot {self.snapshot_path})"
+        return "memory store"
+
+    def ping(self):
+        return True
+
+    def prepare(self):
+        if self.snapshot_path:
+            if os.path.exists(self.snapshot_path):
+                self.load_snapshot()
+            atexit.register(self.save_snapshot)
+            threading.Thread(target=self.save_periodically, name="memory-snapshot", daemon=True).start()
+
+    # Writes
+
+    def changed(self):
+        self.changes += 1
+
+    def insert_one(self, document):
+        document.setdefault("_id", ObjectId())
+        with self.store.lock:
+            self.store.add(StudentRecord(document), self.key_fields)
+            self.changed()
+        return document["_id"]
+
+    def insert_many(self, documents):
+        for document in documents:
+            document.setdefault("_id", ObjectId())
+        records = [StudentRecord(document) for document in documents]
+        with self.store.lock:
+            failed = self.store.add_many(records, self.key_fields)
+            self.changed()
+        return failed
+
+    def upsert_many(self, documents, key):
+        upserted = {}
+        with self.store.lock:
+            for position, document in enumerate(documents):
+                student_id = self.matching(document, key)
+                if student_id is None:
+                    document = dict(document, _id=document.get("_id") or ObjectId())
+                    self.store.add(StudentRecord(document), self.key_fields)
+                    upserted[position] = document["_id"]
+                    continue
+                # Replace the record (like UpdateOne, only the first match); created_date is only set on insert
+                previous = self.store.records[student_id]
+                updated = dict(document, _id=student_id, created_date=previous.created_date)
+                self.store.remove(previous, self.key_fields)
+                self.store.add(StudentRecord(updated), self.key_fields)
+            self.changed()
+        return upserted, {}
+
+    def matching(self, document, key):
+        """Id of the first stored student with the document's `key` fields, or None."""
+        if tuple(key) == self.key_fields:
+            ids = self.store.natural_keys.get(self.store.natural_key(document, key), ())
+            return min(ids, default=None)
+        found = self.store.find({field: document.get(field) for field in key}, DEFAULT_SORT, 1)
+        return found[0].id if found else None
+
+    def delete_by_id(self, student_id, projection=None):
+        with self.store.lock:
+            record = self.store.records.get(object_id(student_id))
+            if record is None:
+                return None
+            self.store.remove(record, self.key_fields)
+            self.changed()
+        return record.document(projection)
+
+    # Reads
+
+    def find(self, query=None, projection=None, sort=DEFAULT_SORT, limit=None, batch_size=None):
+        records = self.store.find(query or {}, sort, limit)
+        # Records are never changed in place, so they can be read outside the lock
+        return (record.document(projection) for record in records)
+
+    def find_by_id(self, student_id, projection=None):
+        record = self.store.records.get(object_id(student_id))
+        return record.document(projection) if record is not None else None
+
+    def search_names(self, term, projection=None, limit=50):
+        return [record.document(projection) for record in self.store.search_names(term, limit)]
+
+    # Summary and version
+
+    def update_stats(self, students, delta):
+        with self.store.lock:
+            for student in students:
+                for bucket in stats_buckets(student):
+                    self.buckets[bucket] += delta
+
+    def rebuild_stats(self):
+        with self.store.lock:
+            buckets = Counter()
+            for record in self.store.records.values():
+                buckets.update(stats_buckets(record))
+            self.buckets = buckets
+            self.stats_built = True
+
+    def has_stats(self):
+        return self.stats_built
+
+    def stats_buckets(self):
+        with self.store.lock:
+            return [
+                {"_id": f"{dimension}:{value}", "dimension": dimension, "value": value, "count": count}
+                for (dimension, value), count in self.buckets.items() if count > 0
+            ]
+
+    def bump_version(self):
+        with self.store.lock:
+            version = self.version["version"] + 1 if self.version else 1
+            self.version = {"_id": "students", "version": version, "modified": datetime.now(timezone.utc)}
+            return dict(self.version)
+
+    def version_document(self):
+        return dict(self.version) if self.version else None
+
+    # Snapshots
+
+    def save_snapshot(self):
+        """Write the students and the version to the snapshot file, if they changed."""
+        with self._snapshot_lock:
+            with self.store.lock:
+                changes = self.changes
+                if changes == self._saved_changes:
+                    return False
+                records = list(self.store.records.values())
+                version = self.version
+            # Written aside and renamed into place, so a crash never leaves half a file
+            temporary = f"{self.snapshot_path}.{os.getpid()}.tmp"
+            with open(temporary, "wb") as file:
+                file.write(bson.encode({"snapshot": 1, "version": version}))
+                for record in records:
+                    file.write(bson.encode(record.document()))
+            os.replace(temporary, self.snapshot_path)
+            self._saved_changes = changes
+            return True
+
+    def load_snapshot(self):
+        with open(self.snapshot_path, "rb") as file:
+            documents = bson.decode_file_iter(file)
+            header = next(documents, None)
+            records = [StudentRecord(document) for document in documents]
+            with self.store.lock:
+                self.store.add_many(records, self.key_fields)
+                if header and header.get("version"):
+                    self.version = dict(header["version"], modified=header["version"]["modified"].replace(tzinfo=timezone.utc))
+        print(f"Loaded {len(self.store)} students from {self.snapshot_path}")
+
+    def save_periodically(self):
+        while True:
+            time.sleep(self.snapshot_interval)
+            try:
+                self.save_snapshot()
+            except OSError as e:
+                print(f"Could not save the memory snapshot: {e}")
+
+
+class AsyncMemoryRepository(MemoryRepository):
+    """MemoryRepository for the async app.
+
+    Every operation is a quick in-memory step, so the coroutines run it
+    directly on the event loop.
+    """
+
+    async def ping(self):
+        return True
+
+    async def prepare(self):
+        MemoryRepository.prepare(self)
+
+    async def insert_one(self, document):
+        return MemoryRepository.insert_one(self, document)
+
+    async def insert_many(self, documents):
+        return MemoryRepository.insert_many(self, documents)
+
+    async def upsert_many(self, documents, key):
+        return MemoryRepository.upsert_many(self, documents, key)
+
+    async def delete_by_id(self, student_id, projection=None):
+        return MemoryRepository.delete_by_id(self, student_id, projection)
+
+    async def find(self, query=None, projection=None, sort=DEFAULT_SORT, limit=None, batch_size=None):
+        for document in MemoryRepository.find(self, query, projection, sort, limit):
+            yield document
+
+    async def find_by_id(self, student_id, projection=None):
+        return MemoryRepository.find_by_id(self, student_id, projection)
+
+    async def search_names(self, term, projection=None, limit=50):
+        return MemoryRepository.search_names(self, term, projection, limit)
+
+    async def update_stats(self, students, delta):
+        MemoryRepository.update_stats(self, students, delta)
+
+    async def rebuild_stats(self):
+        MemoryRepository.rebuild_stats(self)
+
+    async def has_stats(self):
+        return MemoryRepository.has_stats(self)
+
+    async def stats_buckets(self):
+        return MemoryRepository.stats_buckets(self)
+
+    async def bump_version(self):
+        return MemoryRepository.bump_version(self)
+
+    async def version_document(self):
+        return MemoryRepository.version_document(self)
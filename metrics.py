@@ -0,0 +1,185 @@
+"""Prometheus metrics for the student API.
+
+Request counts, latencies and in-flight requests are recorded by
+before/after request hooks (Flask, or Quart for async_app.py), labelled
+by route pattern (so /api/students/<id> is one series, not one per id).
+MongoDB command latencies and connection pool stats come from pymongo's
+monitoring listeners. Recording a request or a command is a few
+dictionary lookups and counter increments, cheap enough to leave on under
+full load.
+
+With several worker processes (run_server.py --workers), set
+PROMETHEUS_MULTIPROC_DIR to an empty directory so /metrics reports the sum
+over all workers instead of whichever worker answered the scrape.
+"""
+import os
+import threading
+import time
+
+from prometheus_client import (
+    CollectorRegistry, Counter, Gauge, Histogram, CONTENT_TYPE_LATEST, REGISTRY, generate_latest
+)
+from prometheus_client import multiprocess
+from pymongo import monitoring
+
+# Latency buckets in seconds, from cache hits to slow scans
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+REQUESTS = Counter("http_requests_total", "HTTP requests handled", ["method", "route", "status"])
+REQUEST_LATENCY = Histogram("http_request_duration_seconds", "Time to produce a response",
+                            ["method", "route"], buckets=BUCKETS)
+IN_FLIGHT = Gauge("http_requests_in_flight", "Requests being handled", ["route"],
+                  multiprocess_mode="livesum")
+
+MONGO_COMMANDS = Histogram("mongodb_command_duration_seconds", "MongoDB command round trip time",
+                           ["command"], buckets=BUCKETS)
+MONGO_FAILURES = Counter("mongodb_command_failures_total", "MongoDB commands that failed", ["command"])
+POOL_CONNECTIONS = Gauge("mongodb_pool_connections", "Open connections in the pool",
+                         ["address"], multiprocess_mode="livesum")
+POOL_CHECKED_OUT = Gauge("mongodb_pool_checked_out_connections", "Connections in use by operations",
+                         ["address"], multiprocess_mode="livesum")
+POOL_WAIT = Histogram("mongodb_pool_checkout_duration_seconds", "Time spent waiting for a connection",
+                      ["address"], buckets=BUCKETS)
+INSERT_BATCH_SIZE = Histogram("student_insert_batch_size", "Students written per group commit (INSERT_BATCHING)",
+                              buckets=(1, 2, 5, 10, 25, 50, 100, 250, 500, 1000))
+ADMISSION_LIMIT = Gauge("admission_concurrency_limit", "Current adaptive limit on concurrent API requests",
+                        multiprocess_mode="livesum")
+ADMISSION_SHED = Counter("admission_shed_requests_total", "API requests answered 503 by admission control",
+                         ["route_class", "reason"])
+POOL_CHECKOUT_FAILURES = Counter("mongodb_pool_checkout_failures_total",
+                                 "Connection checkouts that failed", ["address", "reason"])
+
+
+def start_request(g, request):
+    rule = request.url_rule
+    g.metrics_route = rule.rule if rule is not None else "unmatched"
+    g.metrics_start = time.perf_counter()
+    IN_FLIGHT.labels(g.metrics_route).inc()
+
+
+def finish_request(g, request, response):
+    # Streamed responses are timed until the first byte is ready
+    start = g.pop("metrics_start", None)
+    if start is not None:
+        route = g.metrics_route
+        REQUEST_LATENCY.labels(request.method, route).observe(time.perf_counter() - start)
+        REQUESTS.labels(request.method, route, str(response.status_code)).inc()
+    return response
+
+
+def end_request(g):
+    # Runs even when the view raised, so the gauge can't drift upwards
+    route = g.pop("metrics_route", None)
+    if route is not None:
+        IN_FLIGHT.labels(route).dec()
+
+
+class CommandListener(monitoring.CommandListener):
+    """Times every MongoDB command by name (find, insert, aggregate, ...)."""
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        MONGO_COMMANDS.labels(event.command_name).observe(event.duration_micros / 1e6)
+
+    def failed(self, event):
+        MONGO_COMMANDS.labels(event.command_name).observe(event.duration_micros / 1e6)
+        MONGO_FAILURES.labels(event.command_name).inc()
+
+
+class PoolListener(monitoring.ConnectionPoolListener):
+    """Tracks open and checked out connections and checkout wait times per server."""
+
+    def __init__(self):
+        # Checkout start times, per thread (a checkout happens on the caller's thread)
+        self.local = threading.local()
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        POOL_CONNECTIONS.labels(address(event)).inc()
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        POOL_CONNECTIONS.labels(address(event)).dec()
+
+    def connection_check_out_started(self, event):
+        self.local.start = time.perf_counter()
+
+    def connection_check_out_failed(self, event):
+        self.observe_wait(event)
+        POOL_CHECKOUT_FAILURES.labels(address(event), event.reason).inc()
+
+    def connection_checked_out(self, event):
+        self.observe_wait(event)
+        POOL_CHECKED_OUT.labels(address(event)).inc()
+
+    def connection_checked_in(self, event):
+        POOL_CHECKED_OUT.labels(address(event)).dec()
+
+    def observe_wait(self, event):
+        start = getattr(self.local, "start", None)
+        if start is not None:
+            POOL_WAIT.labels(address(event)).observe(time.perf_counter() - start)
+            self.local.start = None
+
+
+def address(event):
+    host, port = event.address
+    return f"{host}:{port}"
+
+
+def mongo_listeners():
+    """Event listeners to pass to MongoClient(event_listeners=...)."""
+    return [CommandListener(), PoolListener()]
+
+
+def init_app(app):
+    """Record request metrics for a Flask app."""
+    from flask import g, request
+
+    app.before_request(lambda: start_request(g, request))
+    app.after_request(lambda response: finish_request(g, request, response))
+    app.teardown_request(lambda error=None: end_request(g))
+
+
+def init_async_app(app):
+    """Record request metrics for a Quart app."""
+    from quart import g, request
+
+    # Quart runs plain functions in a thread pool, so the hooks are coroutines
+    @app.before_request
+    async def before():
+        start_request(g, request)
+
+    @app.after_request
+    async def after(response):
+        return finish_request(g, request, response)
+
+    @app.teardown_request
+    async def teardown(error=None):
+        end_request(g)
+
+
+def render():
+    """Return (body, content type) of the metrics in the Prometheus text format."""
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        # Aggregate the values every worker process wrote to the directory
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
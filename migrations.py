@@ -0,0 +1,76 @@
+"""Backfill derived fields on existing student documents.
+
+Usage:
+    python migrations.py [--uri mongodb://localhost:27017] [--batch-size 1000]
+
+Every migration only touches documents that are missing its fields, so the
+script is safe to re-run and to interrupt.
+"""
+import argparse
+import os
+
+from pymongo import MongoClient, UpdateOne
+
+from student_fields import birth_fields, name_keys
+
+
+def backfill(collection, marker, projection, compute, batch_size=1000):
+    """Set compute(student) on every student without the `marker` field."""
+    updated = 0
+    pending = []
+    cursor = collection.find({marker: {"$exists": False}}, projection).batch_size(batch_size)
+    for student in cursor:
+        pending.append(UpdateOne({"_id": student["_id"]}, {"$set": compute(student)}))
+        if len(pending) >= batch_size:
+            updated += collection.bulk_write(pending, ordered=False).modified_count
+            pending = []
+    if pending:
+        updated += collection.bulk_write(pending, ordered=False).modified_count
+    return updated
+
+
+def backfill_name_keys(collection, batch_size=1000):
+    """Add the normalized name fields used by the name search indexes."""
+    return backfill(
+        collection, "first_name_lower", {"first_name": 1, "last_name": 1},
+        lambda student: name_keys(student.get("first_name", ""), student.get("last_name", "")),
+        batch_size
+    )
+
+
+def backfill_birth_fields(collection, batch_size=1000):
+    """Add dob_date, birth_month and birth_day used by the age and birthday queries.
+
+    Students whose dob isn't a date get nulls, so they aren't read again.
+    """
+    return backfill(
+        collection, "birth_month", {"dob": 1},
+        lambda student: birth_fields(student.get("dob", "")),
+        batch_size
+    )
+
+
+# Run in order; each entry is (name, function)
+MIGRATIONS = [
+    ("name_keys", backfill_name_keys),
+    ("birth_fields", backfill_birth_fields),
+]
+
+
+def run_migrations(collection, batch_size=1000):
+    for name, migration in MIGRATIONS:
+        updated = migration(collection, batch_size)
+        print(f"{name}: updated {updated} documents")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Backfill derived student fields")
+    parser.add_argument("--uri", default=os.environ.get("MONGO_URI", "mongodb://localhost:27017"))
+    parser.add_argument("--db", default="student_db")
+    parser.add_argument("--collection", default="students")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    client = MongoClient(args.uri)
+    run_migrations(client[args.db][args.collection], args.batch_size)
+    client.close()
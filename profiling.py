@@ -0,0 +1,195 @@
+"""Request profiling and the slow-query log.
+
+Profiling runs a request under cProfile and saves the profile to
+PROFILE_DIR, one .prof file per request (open it with `python -m pstats`
+or snakeviz). It is switched on for every request with PROFILE_REQUESTS=1,
+or for a single request by sending the `X-Profile` header with the value
+of PROFILE_TOKEN.
+
+The slow-query log is a pymongo command listener. Any command slower than
+SLOW_QUERY_MS is appended to SLOW_QUERY_LOG as one JSON line, with its
+filter or pipeline, its duration, the route that issued it and the
+`explain()` winning plan, so collection scans stand out. Explains run on a
+background thread and never delay the request that ran the slow command.
+"""
+import cProfile
+import hmac
+import json
+import os
+import queue
+import re
+import threading
+import time
+from datetime import datetime, timezone
+
+from flask import current_app, g, has_request_context, request
+from pymongo import monitoring
+
+# Commands that take a filter or pipeline and can be explained
+EXPLAINABLE = {"find", "aggregate", "count", "distinct", "delete", "update", "findAndModify"}
+
+# Command fields added by the driver, not part of the query
+DRIVER_FIELDS = {"lsid", "txnNumber", "autocommit", "startTransaction"}
+
+# Slow commands waiting to be explained; further ones are dropped when full
+QUEUE_SIZE = 100
+
+
+def wants_profile():
+    if current_app.config["PROFILE_REQUESTS"]:
+        return True
+    token = current_app.config["PROFILE_TOKEN"]
+    header = request.headers.get("X-Profile")
+    return bool(token and header and hmac.compare_digest(header, token))
+
+
+def start_profile():
+    if wants_profile():
+        g.profiler = cProfile.Profile()
+        g.profiler_start = time.perf_counter()
+        g.profiler.enable()
+
+
+def save_profile(response):
+    profiler = g.pop("profiler", None)
+    if profiler is None:
+        return response
+    profiler.disable()
+    elapsed_ms = (time.perf_counter() - g.profiler_start) * 1000
+    directory = current_app.config["PROFILE_DIR"]
+    os.makedirs(directory, exist_ok=True)
+    slug = re.sub(r"[^A-Za-z0-9]+", "_", request.path).strip("_") or "root"
+    name = (f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{request.method}-{slug}"
+            f"-{elapsed_ms:.0f}ms-{os.getpid()}-{threading.get_ident()}.prof")
+    profiler.dump_stats(os.path.join(directory, name))
+    response.headers["X-Profile"] = name
+    return response
+
+
+def stop_profile(error=None):
+    # The view raised before save_profile ran; don't leave the profiler on
+    profiler = g.pop("profiler", None)
+    if profiler is not None:
+        profiler.disable()
+
+
+class SlowQueryLog(monitoring.CommandListener):
+    """Logs commands slower than `threshold_ms`, with their explain() plan."""
+
+    def __init__(self, mongo, threshold_ms, path):
+        self.mongo = mongo
+        self.threshold = threshold_ms * 1000
+        self.path = path
+        # Commands in progress by request id, kept only for explainable commands
+        self.pending = {}
+        self.queue = queue.Queue(QUEUE_SIZE)
+        self.lock = threading.Lock()
+        self.worker = None
+
+    def started(self, event):
+        if event.command_name in EXPLAINABLE:
+            self.pending[event.request_id] = (event.command, route())
+
+    def succeeded(self, event):
+        self.finished(event)
+
+    def failed(self, event):
+        self.finished(event)
+
+    def finished(self, event):
+        started = self.pending.pop(event.request_id, None)
+        if event.duration_micros < self.threshold or event.command_name == "explain":
+            return
+        command, path = started or (None, route())
+        entry = {
+            "time": datetime.now(timezone.utc).isoformat(),
+            "command": event.command_name,
+            "database": event.database_name,
+            "duration_ms": round(event.duration_micros / 1000, 3),
+            "route": path,
+        }
+        try:
+            self.queue.put_nowait((entry, command))
+        except queue.Full:
+            return
+        self.start_worker()
+
+    def start_worker(self):
+        if self.worker is None or not self.worker.is_alive():
+            with self.lock:
+                if self.worker is None or not self.worker.is_alive():
+                    self.worker = threading.Thread(target=self.run, name="slow-query-log", daemon=True)
+                    self.worker.start()
+
+    def run(self):
+        while True:
+            entry, command = self.queue.get()
+            if command is not None:
+                entry.update(describe(command))
+                try:
+                    entry.update(self.explain(entry["database"], command))
+                except Exception as e:
+                    # Still log the slow command, and keep the thread alive
+                    entry["explain_error"] = str(e)
+            self.write(entry)
+
+    def explain(self, database, command):
+        query = {key: value for key, value in command.items()
+                 if key not in DRIVER_FIELDS and not key.startswith("$")}
+        result = self.mongo.client[database].command({"explain": query, "verbosity": "queryPlanner"})
+        plan = winning_plan(result)
+        return {"plan": plan, "collscan": "COLLSCAN" in stages(plan)}
+
+    def write(self, entry):
+        line = json.dumps(entry, default=str)
+        print(f"Slow query: {entry['command']} {entry.get('collection', '')} "
+              f"{entry['duration_ms']}ms{' (COLLSCAN)' if entry.get('collscan') else ''}")
+        with open(self.path, "a") as file:
+            file.write(line + "\n")
+
+
+def route():
+    return f"{request.method} {request.path}" if has_request_context() else None
+
+
+def describe(command):
+    """The collection and query parts of a command worth logging."""
+    name = next(iter(command))
+    described = {"collection": command[name]}
+    for key in ("filter", "query", "pipeline", "sort", "limit", "key"):
+        if key in command:
+            described[key] = command[key]
+    for key in ("deletes", "updates"):
+        if key in command:
+            described["filter"] = [statement.get("q") for statement in command[key]]
+    return described
+
+
+def winning_plan(result):
+    """Find the winning plan in explain output (find, or the $cursor stage of aggregate)."""
+    if "queryPlanner" in result:
+        return result["queryPlanner"].get("winningPlan")
+    for stage in result.get("stages", []):
+        if "$cursor" in stage:
+            return stage["$cursor"]["queryPlanner"].get("winningPlan")
+    return None
+
+
+def stages(plan):
+    """Stage names of a plan tree, e.g. ["LIMIT", "FETCH", "IXSCAN"]."""
+    if not isinstance(plan, dict):
+        return []
+    names = [plan["stage"]] if "stage" in plan else []
+    children = plan.get("inputStages", []) + [plan[key] for key in ("inputStage", "queryPlan") if key in plan]
+    for child in children:
+        names.extend(stages(child))
+    return names
+
+
+def init_app(app, mongo):
+    app.before_request(start_profile)
+    app.after_request(save_profile)
+    app.teardown_request(stop_profile)
+    if app.config["SLOW_QUERY_MS"] >= 0:
+        listener = SlowQueryLog(mongo, app.config["SLOW_QUERY_MS"], app.config["SLOW_QUERY_LOG"])
+        mongo.client_options.setdefault("event_listeners", []).append(listener)
@@ -0,0 +1,353 @@
+"""Storage backends for students, behind one repository interface.
+
+The apps keep their logic (validation, caching, the stats summary and
+version bookkeeping, pagination cursors) and call a repository for every
+read and write. STORAGE_BACKEND picks the repository:
+- mongo (default): MongoRepository, the students, student_stats and meta
+  collections in MongoDB;
+- memory: MemoryRepository (memory_store.py), an indexed engine in this
+  process, optionally snapshotted to disk. It needs no database, for
+  tests, demos and small single process deployments.
+
+Queries, projections and sorts use the MongoDB forms the rest of the code
+already builds (parse_filters, age_query, cursor_query, ...). The memory
+engine understands the subset these use: equality, $in, $gt/$gte/$lt/$lte,
+$and and $or.
+
+AsyncMongoRepository and AsyncMemoryRepository are the same interface for
+async_app.py, with coroutine methods, and find() returning an async
+iterable.
+"""
+import re
+from abc import ABC, abstractmethod
+from datetime import datetime, timezone
+
+from bson.errors import InvalidId
+from bson.objectid import ObjectId
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError
+
+from database import STUDENT_INDEXES
+from student_fields import DEFAULT_SORT
+from student_stats import REBUILD_PIPELINE, rebuilt_buckets, replace_operations, stats_updates
+
+
+def object_id(student_id):
+    """The ObjectId in a URL path, or None if it isn't one (so the lookup finds nothing)."""
+    try:
+        return ObjectId(student_id)
+    except InvalidId:
+        return None
+
+
+class StudentRepository(ABC):
+    """Interface of a student storage backend.
+
+    Documents are dicts with an ObjectId `_id`. `projection` is
+    {field: 1, ...} (None for every field); `_id` is always returned.
+    """
+
+    # Shown in logs, e.g. "MongoDB at mongodb://..."
+    name = "storage"
+
+    # Set once prepare() has succeeded; read by /readyz
+    bootstrapped = None
+    last_error = None
+
+    @abstractmethod
+    def ping(self):
+        """True if the storage can serve requests now."""
+
+    @abstractmethod
+    def prepare(self):
+        """Get ready to serve: create indexes, load saved data."""
+
+    @abstractmethod
+    def insert_one(self, document):
+        """Store a new student, setting document["_id"]; returns the id."""
+
+    @abstractmethod
+    def insert_many(self, documents):
+        """Store new students, in any order; returns {position: error message} for those rejected."""
+
+    @abstractmethod
+    def upsert_many(self, documents, key):
+        """Update the students matching each document on the `key` fields, or insert them.
+
+        created_date is only set on insert. Returns ({position: id} of the
+        inserted documents, {position: error message} of those rejected).
+        """
+
+    @abstractmethod
+    def find(self, query=None, projection=None, sort=DEFAULT_SORT, limit=None, batch_size=None):
+        """Iterate over the students matching `query` in `sort` order."""
+
+    @abstractmethod
+    def find_by_id(self, student_id, projection=None):
+        """The student with id `student_id` (as projected), or None (also for an invalid id)."""
+
+    @abstractmethod
+    def delete_by_id(self, student_id, projection=None):
+        """Delete a student; returns it (as projected), or None if there was none."""
+
+    @abstractmethod
+    def search_names(self, term, projection=None, limit=50):
+        """Students matching a normalized name `term`, best matches first.
+
+        One word matches first or last names exactly, then by prefix.
+        Several words match whole words in either name, ranked by how many
+        words match.
+        """
+
+    @abstractmethod
+    def update_stats(self, students, delta):
+        """Add `delta` to the summary buckets of each student."""
+
+    @abstractmethod
+    def rebuild_stats(self):
+        """Recount the summary from the stored students."""
+
+    @abstractmethod
+    def has_stats(self):
+        """False until the summary has been built once."""
+
+    @abstractmethod
+    def stats_buckets(self):
+        """The summary's bucket documents with a count (see student_stats.summarize)."""
+
+    @abstractmethod
+    def bump_version(self):
+        """Record a change to the students; returns the new meta document."""
+
+    @abstractmethod
+    def version_document(self):
+        """The meta document ({"version", "modified"}), or None before the first change."""
+
+
+class MongoRepository(StudentRepository):
+    """Students in MongoDB, through the process's Mongo connection."""
+
+    def __init__(self, mongo):
+        self.mongo = mongo
+
+    @property
+    def name(self):
+        return f"MongoDB at {self.mongo.uri}"
+
+    @property
+    def bootstrapped(self):
+        return self.mongo.bootstrapped
+
+    @property
+    def last_error(self):
+        return self.mongo.last_error
+
+    def ping(self):
+        return self.mongo.ping()
+
+    def prepare(self):
+        """Create the indexes the API queries rely on (no-op if they exist)."""
+        for keys, options in STUDENT_INDEXES:
+            self.mongo.students.create_index(keys, **options)
+
+    def insert_one(self, document):
+        return self.mongo.students.insert_one(document).inserted_id
+
+    def insert_many(self, documents):
+        try:
+            self.mongo.students.insert_many(documents, ordered=False)
+        except BulkWriteError as e:
+            return {error["index"]: error["errmsg"] for error in e.details["writeErrors"]}
+        return {}
+
+    def upsert_operations(self, documents, key):
+        operations = []
+        for document in documents:
+            fields = dict(document)
+            created_date = fields.pop("created_date")
+            operations.append(UpdateOne(
+                {field: document[field] for field in key},
+                {"$set": fields, "$setOnInsert": {"created_date": created_date}},
+                upsert=True
+            ))
+        return operations
+
+    def upsert_results(self, details):
+        upserted = {item["index"]: item["_id"] for item in details.get("upserted", [])}
+        failed = {error["index"]: error["errmsg"] for error in details.get("writeErrors", [])}
+        return upserted, failed
+
+    def upsert_many(self, documents, key):
+        try:
+            details = self.mongo.students.bulk_write(self.upsert_operations(documents, key),
+                                                     ordered=False).bulk_api_result
+        except BulkWriteError as e:
+            details = e.details
+        return self.upsert_results(details)
+
+    def find(self, query=None, projection=None, sort=DEFAULT_SORT, limit=None, batch_size=None):
+        cursor = self.mongo.students.find(query or {}, projection).sort(sort)
+        if limit:
+            cursor = cursor.limit(limit)
+        if batch_size:
+            cursor = cursor.batch_size(batch_size)
+        return cursor
+
+    def find_by_id(self, student_id, projection=None):
+        student_id = object_id(student_id)
+        if student_id is None:
+            return None
+        return self.mongo.students.find_one({"_id": student_id}, projection)
+
+    def delete_by_id(self, student_id, projection=None):
+        student_id = object_id(student_id)
+        if student_id is None:
+            return None
+        return self.mongo.students.find_one_and_delete({"_id": student_id}, projection=projection)
+
+    def text_query(self, term, projection):
+        """The $text query for several words, ranked by relevance."""
+        projection = dict(projection or {}, score={"$meta": "textScore"})
+        return {"$text": {"$search": term}}, projection, [("score", {"$meta": "textScore"})]
+
+    def exact_query(self, term):
+        return {"$or": [{"first_name_lower": term}, {"last_name_lower": term}]}
+
+    def prefix_query(self, term, seen):
+        """Names starting with `term`, except the students already `seen` (the exact matches)."""
+        prefix = {"$regex": "^" + re.escape(term)}
+        return {"$or": [{"first_name_lower": prefix}, {"last_name_lower": prefix}], "_id": {"$nin": seen}}
+
+    def search_names(self, term, projection=None, limit=50):
+        if " " in term:
+            query, projection, sort = self.text_query(term, projection)
+            return list(self.mongo.students.find(query, projection).sort(sort).limit(limit))
+        # Exact matches rank above prefix matches; both are served by the name indexes
+        students = list(self.mongo.students.find(self.exact_query(term), projection).limit(limit))
+        if len(students) < limit:
+            prefix = self.prefix_query(term, [student["_id"] for student in students])
+            students.extend(self.mongo.students.find(prefix, projection).limit(limit - len(students)))
+        return students
+
+    def update_stats(self, students, delta):
+        operations = stats_updates(students, delta)
+        if operations:
+            self.mongo.stats.bulk_write(operations, ordered=False)
+
+    def rebuild_stats(self):
+        """Recount with one aggregation, then replace the buckets one by one."""
+        buckets = rebuilt_buckets(next(self.mongo.students.aggregate(REBUILD_PIPELINE)))
+        self.mongo.stats.bulk_write(replace_operations(buckets), ordered=False)
+        self.mongo.stats.delete_many({"_id": {"$nin": list(buckets)}})
+
+    def has_stats(self):
+        return self.mongo.stats.find_one({"_id": "total:all"}) is not None
+
+    def stats_buckets(self):
+        return list(self.mongo.stats.find({"count": {"$gt": 0}}))
+
+    def version_update(self):
+        return {"$inc": {"version": 1}, "$set": {"modified": datetime.now(timezone.utc)}}
+
+    def bump_version(self):
+        return self.mongo.meta.find_one_and_update(
+            {"_id": "students"},
+            self.version_update(),
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+
+    def version_document(self):
+        return self.mongo.meta.find_one({"_id": "students"})
+
+
+class AsyncMongoRepository(MongoRepository):
+    """MongoRepository for the async app, on the Motor connection."""
+
+    async def ping(self):
+        return await self.mongo.ping()
+
+    async def prepare(self):
+        for keys, options in STUDENT_INDEXES:
+            await self.mongo.students.create_index(keys, **options)
+
+    async def insert_one(self, document):
+        return (await self.mongo.students.insert_one(document)).inserted_id
+
+    async def insert_many(self, documents):
+        try:
+            await self.mongo.students.insert_many(documents, ordered=False)
+        except BulkWriteError as e:
+            return {error["index"]: error["errmsg"] for error in e.details["writeErrors"]}
+        return {}
+
+    async def upsert_many(self, documents, key):
+        try:
+            result = await self.mongo.students.bulk_write(self.upsert_operations(documents, key), ordered=False)
+            details = result.bulk_api_result
+        except BulkWriteError as e:
+            details = e.details
+        return self.upsert_results(details)
+
+    async def find_by_id(self, student_id, projection=None):
+        student_id = object_id(student_id)
+        if student_id is None:
+            return None
+        return await self.mongo.students.find_one({"_id": student_id}, projection)
+
+    async def delete_by_id(self, student_id, projection=None):
+        student_id = object_id(student_id)
+        if student_id is None:
+            return None
+        return await self.mongo.students.find_one_and_delete({"_id": student_id}, projection=projection)
+
+    async def search_names(self, term, projection=None, limit=50):
+        if " " in term:
+            query, projection, sort = self.text_query(term, projection)
+            return await self.mongo.students.find(query, projection).sort(sort).limit(limit).to_list(None)
+        students = await self.mongo.students.find(self.exact_query(term), projection).limit(limit).to_list(None)
+        if len(students) < limit:
+            prefix = self.prefix_query(term, [student["_id"] for student in students])
+            cursor = self.mongo.students.find(prefix, projection).limit(limit - len(students))
+            students.extend(await cursor.to_list(None))
+        return students
+
+    async def update_stats(self, students, delta):
+        operations = stats_updates(students, delta)
+        if operations:
+            await self.mongo.stats.bulk_write(operations, ordered=False)
+
+    async def rebuild_stats(self):
+        groups = (await self.mongo.students.aggregate(REBUILD_PIPELINE).to_list(1))[0]
+        buckets = rebuilt_buckets(groups)
+        await self.mongo.stats.bulk_write(replace_operations(buckets), ordered=False)
+        await self.mongo.stats.delete_many({"_id": {"$nin": list(buckets)}})
+
+    async def has_stats(self):
+        return await self.mongo.stats.find_one({"_id": "total:all"}) is not None
+
+    async def stats_buckets(self):
+        return await self.mongo.stats.find({"count": {"$gt": 0}}).to_list(None)
+
+    async def bump_version(self):
+        return await self.mongo.meta.find_one_and_update(
+            {"_id": "students"},
+            self.version_update(),
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def version_document(self):
+        return await self.mongo.meta.find_one({"_id": "students"})
+
+
+def create_repository(config, mongo, asynchronous=False):
+    """The repository selected by STORAGE_BACKEND."""
+    backend = config["STORAGE_BACKEND"]
+    if backend == "mongo":
+        return AsyncMongoRepository(mongo) if asynchronous else MongoRepository(mongo)
+    if backend == "memory":
+        from memory_store import AsyncMemoryRepository, MemoryRepository
+        repository = AsyncMemoryRepository if asynchronous else MemoryRepository
+        return repository(config["MEMORY_SNAPSHOT"], config["MEMORY_SNAPSHOT_INTERVAL"])
+    raise ValueError(f"Unknown STORAGE_BACKEND {backend!r} (use mongo or memory)")
@@ -1,11 +1,38 @@
-import sys
-from app import app
+"""Run the student app.
+
+Usage:
+    python run_server.py [port]                    # single process (Waitress if installed)
+    python run_server.py 5000 --host 0.0.0.0 --workers 4 --threads 16
+
+Passing --workers (or --production) starts the multi-process mode: a master
+process binds the socket and forks the workers, which share it and each serve
+requests on a fixed-size thread pool. Each worker imports the app, and so
+opens its own MongoDB connections, after the fork. With STORAGE_BACKEND=memory
+the server always runs as a single process.
+
+Signals sent to the master (POSIX only):
+    SIGTERM / SIGINT  Stop accepting connections, let the workers finish the
+                      requests in flight, then exit.
+    SIGHUP            Graceful reload: start a new set of workers (which load
+                      the current code), then drain and stop the old ones.
+"""
+import argparse
+import os
+import signal
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+
+from config import config_from_env
+
 
 def run_server(host='127.0.0.1', port=5000):
     """Run the Flask server with customizable host and port."""
     try:
         # Check if port is available
-        import socket
         sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         result = sock.connect_ex((host, port))
         if result == 0:
@@ -13,7 +40,9 @@ def run_server(host='127.0.0.1', port=5000):
             sock.close()
             return False
         sock.close()
-        
+
+        from app import app
+
         # Try running with Waitress (more stable on Windows)
         try:
             from waitress import serve
@@ -27,7 +56,7 @@ def run_server(host='127.0.0.1', port=5000):
             print(f"Starting Flask server on {host}:{port}...")
             app.run(host=host, port=port, debug=True, use_reloader=False, threaded=False)
             return True
-    
+
     except OSError as e:
         print(f"Socket error occurred: {e}")
         print("Try these solutions:")
@@ -36,19 +65,215 @@ def run_server(host='127.0.0.1', port=5000):
         print("3. Try a different port: python run_server.py 5002")
         print("4. Install and use Waitress: pip install waitress")
         return False
-    
+
     except Exception as e:
         print(f"An error occurred: {e}")
         return False
 
-if __name__ == "__main__":
-    # Get port from command line arguments if provided
-    port = 5001  # Default port
-    if len(sys.argv) > 1:
+
+class QuietRequestHandler(WSGIRequestHandler):
+    """Request handler without per-request access logging."""
+
+    def log_request(self, code="-", size="-"):
+        pass
+
+
+class PooledWSGIServer(BaseWSGIServer):
+    """WSGI server that handles connections on a fixed-size thread pool."""
+
+    multithread = True
+
+    def __init__(self, host, port, app, threads, keepalive, fd, access_log=False):
+        # The handler's socket timeout closes idle keep-alive connections
+        base = WSGIRequestHandler if access_log else QuietRequestHandler
+        handler = type("PooledRequestHandler", (base,), {"timeout": keepalive})
+        super().__init__(host, port, app, handler=handler, fd=fd)
+        self.pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="request")
+
+    def process_request(self, request, client_address):
+        self.pool.submit(self.process_request_thread, request, client_address)
+
+    def process_request_thread(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+
+def worker_main(sock, options):
+    """Serve requests in a forked worker until told to stop, then drain."""
+    # The master coordinates shutdown; Ctrl-C reaches the whole process group
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+
+    # Imported after the fork so every worker has its own MongoClient
+    from app import app
+
+    host, port = sock.getsockname()[:2]
+    server = PooledWSGIServer(host, port, app, options.threads, options.keepalive,
+                              fd=sock.fileno(), access_log=options.access_log)
+
+    def stop(signum, frame):
+        # shutdown() waits for serve_forever() to return, so it can't run on
+        # the thread that is serving (which is where signal handlers run)
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    server.serve_forever()
+    # No new connections are accepted now; finish the ones in progress
+    server.pool.shutdown(wait=True)
+
+
+def spawn_worker(sock, options):
+    pid = os.fork()
+    if pid == 0:
+        status = 0
+        try:
+            worker_main(sock, options)
+        except BaseException as e:
+            print(f"Worker {os.getpid()} failed: {e}")
+            status = 1
+        finally:
+            os._exit(status)
+    return pid
+
+
+def reset_metrics_dir():
+    """Empty PROMETHEUS_MULTIPROC_DIR so /metrics starts from zero."""
+    path = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+    if path:
+        os.makedirs(path, exist_ok=True)
+        for name in os.listdir(path):
+            if name.endswith(".db"):
+                os.remove(os.path.join(path, name))
+
+
+def worker_exited(pid):
+    """Drop an exited worker's live gauges (in-flight requests, open connections)."""
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(pid)
+
+
+def stop_workers(pids, timeout):
+    """Ask workers to drain and exit; kill any still running after `timeout` seconds."""
+    for pid in pids:
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+    deadline = time.monotonic() + timeout
+    remaining = set(pids)
+    while remaining and time.monotonic() < deadline:
+        for pid in list(remaining):
+            try:
+                if os.waitpid(pid, os.WNOHANG)[0]:
+                    remaining.discard(pid)
+                    worker_exited(pid)
+            except ChildProcessError:
+                remaining.discard(pid)
+        time.sleep(0.1)
+    for pid in remaining:
+        print(f"Worker {pid} did not stop within {timeout}s, killing it")
         try:
-            port = int(sys.argv[1])
-        except ValueError:
-            print("Invalid port number. Using default port 5001.")
-    
-    run_server(port=port)
+            os.kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+        except (ProcessLookupError, ChildProcessError):
+            pass
+        worker_exited(pid)
+
+
+def run_production(options):
+    """Pre-fork `options.workers` processes sharing one listening socket."""
+    if not hasattr(os, "fork"):
+        print("Multi-process mode needs os.fork(); falling back to a single process.")
+        return run_server(options.host, options.port)
+    if config_from_env()["STORAGE_BACKEND"] == "memory":
+        # Each worker would hold its own store and overwrite the others' MEMORY_SNAPSHOT;
+        # a reload would also start the new workers before the old ones save
+        print("STORAGE_BACKEND=memory keeps students in one process; falling back to a single process.")
+        return run_server(options.host, options.port)
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    try:
+        sock.bind((options.host, options.port))
+    except OSError as e:
+        print(f"Socket error occurred: {e}")
+        return False
+    sock.listen(options.backlog)
+    sock.set_inheritable(True)
+
+    reset_metrics_dir()
+    events = []
+    for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+        signal.signal(signum, lambda signum, frame: events.append(signum))
+
+    workers = {spawn_worker(sock, options) for _ in range(options.workers)}
+    print(f"Master {os.getpid()} serving on {options.host}:{options.port} with "
+          f"{options.workers} workers x {options.threads} threads")
+
+    while True:
+        while events:
+            signum = events.pop(0)
+            if signum == signal.SIGHUP:
+                print("Reloading workers...")
+                old = workers
+                workers = {spawn_worker(sock, options) for _ in range(options.workers)}
+                stop_workers(old, options.graceful_timeout)
+            else:
+                print("Shutting down, draining in-flight requests...")
+                stop_workers(workers, options.graceful_timeout)
+                sock.close()
+                return True
+
+        # Replace workers that exited unexpectedly
+        for pid in list(workers):
+            try:
+                exited = os.waitpid(pid, os.WNOHANG)[0]
+            except ChildProcessError:
+                exited = pid
+            if exited:
+                print(f"Worker {pid} exited, starting a new one")
+                workers.discard(pid)
+                worker_exited(pid)
+                workers.add(spawn_worker(sock, options))
+                time.sleep(0.5)  # Don't spin if workers keep crashing
+        time.sleep(0.2)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Run the student app")
+    parser.add_argument("port", nargs="?", default=5001, help="Port to listen on (default 5001)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--production", action="store_true", help="Use the multi-process mode")
+    parser.add_argument("--workers", type=int, help="Worker processes (default: CPU count); implies --production")
+    parser.add_argument("--threads", type=int, default=8, help="Request threads per worker")
+    parser.add_argument("--backlog", type=int, default=2048, help="Listen queue size")
+    parser.add_argument("--keepalive", type=float, default=5, help="Seconds to keep idle connections open")
+    parser.add_argument("--graceful-timeout", type=float, default=30,
+                        help="Seconds workers get to finish in-flight requests when stopping")
+    parser.add_argument("--access-log", action="store_true", help="Log every request")
+    options = parser.parse_args(argv)
+
+    try:
+        options.port = int(options.port)
+    except ValueError:
+        print("Invalid port number. Using default port 5001.")
+        options.port = 5001
+    if options.workers is not None:
+        options.production = True
+    if options.workers is None:
+        options.workers = os.cpu_count() or 1
+    return options
+
+
+if __name__ == "__main__":
+    options = parse_args()
+    if options.production:
+        run_production(options)
+    else:
+        run_server(host=options.host, port=options.port)
     print("Server shutdown.")
@@ -1,72 +1,258 @@
+"""Generate synthetic student records.
+
+Usage:
+    python seed_data.py                                   # 50 students -> student_data.json
+    python seed_data.py --count 1000000 --format ndjson   # -> student_data.ndjson
+    python seed_data.py --count 1000000 --workers 8 --output students.ndjson --format ndjson
+    python seed_data.py --count 100000 --mongo-uri mongodb://localhost:27017
+    python seed_data.py --class-weights "9:3,10:3,11:2,12:1" --session-weights "2024-2025:4,2023-2024:1"
+
+Output only depends on --count, --seed, --as-of and the weights, never on
+--workers or the current date, so runs can be reproduced. Records are
+generated and written in chunks, so memory use doesn't grow with --count.
+"""
+import argparse
 import json
-from datetime import datetime, timedelta
 import random
-import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
 
-# Generate random dates within a range
-def random_date(start_date, end_date):
-    time_between_dates = end_date - start_date
-    days_between_dates = time_between_dates.days
-    random_days = random.randrange(days_between_dates)
-    return start_date + timedelta(days=random_days)
+from student_fields import derived_fields
 
 # Sample student data
-first_names = ["James", "Mary", "John", "Patricia", "Robert", "Jennifer", "Michael", "Linda", "William", 
-              "Elizabeth", "David", "Susan", "Richard", "Jessica", "Joseph", "Sarah", "Thomas", "Karen", 
+first_names = ["James", "Mary", "John", "Patricia", "Robert", "Jennifer", "Michael", "Linda", "William",
+              "Elizabeth", "David", "Susan", "Richard", "Jessica", "Joseph", "Sarah", "Thomas", "Karen",
               "Charles", "Nancy", "Aisha", "Mohammed", "Raj", "Priya", "Chen", "Yuki", "Sofia", "Diego"]
 
-last_names = ["Smith", "Johnson", "Williams", "Brown", "Jones", "Garcia", "Miller", "Davis", "Rodriguez", 
-             "Martinez", "Hernandez", "Lopez", "Gonzalez", "Wilson", "Anderson", "Thomas", "Taylor", 
+last_names = ["Smith", "Johnson", "Williams", "Brown", "Jones", "Garcia", "Miller", "Davis", "Rodriguez",
+             "Martinez", "Hernandez", "Lopez", "Gonzalez", "Wilson", "Anderson", "Thomas", "Taylor",
              "Moore", "Jackson", "Martin", "Lee", "Patel", "Kim", "Nguyen", "Chen", "Wang", "Singh", "Gupta"]
 
 # Academic sessions
 sessions = ["2022-2023", "2023-2024", "2024-2025"]
 
-# Create sample students
-sample_students = []
-today = datetime.now()
-
-for i in range(50):  # Create 50 sample students
-    dob = random_date(datetime(2000, 1, 1), datetime(2010, 12, 31))
-    created = random_date(datetime(2022, 1, 1), today)
-    
-    first_name = random.choice(first_names)
-    last_name = random.choice(last_names)
-    
-    student = {
+# Classes 1 through 12
+classes = [str(i) for i in range(1, 13)]
+
+DEFAULT_SEED = 42
+# Latest registration date; fixed instead of today so output is reproducible
+DEFAULT_AS_OF = "2025-06-30"
+# Records generated per task; each chunk has its own derived random seed
+CHUNK_SIZE = 10000
+
+
+# Generate random dates within a range
+def random_date(rng, start_date, end_date):
+    time_between_dates = end_date - start_date
+    days_between_dates = time_between_dates.days
+    random_days = rng.randrange(days_between_dates)
+    return start_date + timedelta(days=random_days)
+
+
+def parse_weights(value, allowed):
+    """Parse "key:weight,key:weight" into a {key: weight} dict."""
+    weights = {}
+    for item in value.split(","):
+        key, _, weight = item.partition(":")
+        key = key.strip()
+        if key not in allowed:
+            raise argparse.ArgumentTypeError(f"Unknown value {key!r}, expected one of {', '.join(allowed)}")
+        try:
+            weights[key] = float(weight)
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"Invalid weight for {key!r}: {weight!r}")
+    return weights
+
+
+def make_student(rng, as_of, class_weights=None, session_weights=None):
+    """Return one random student record."""
+    dob = random_date(rng, datetime(2000, 1, 1), datetime(2010, 12, 31))
+    created = random_date(rng, datetime(2022, 1, 1), as_of)
+
+    first_name = rng.choice(first_names)
+    last_name = rng.choice(last_names)
+
+    if class_weights:
+        student_class = rng.choices(list(class_weights), weights=list(class_weights.values()))[0]
+    else:
+        student_class = rng.choice(classes)
+    if session_weights:
+        session = rng.choices(list(session_weights), weights=list(session_weights.values()))[0]
+    else:
+        session = rng.choice(sessions)
+
+    return {
         "first_name": first_name,
         "last_name": last_name,
         "name": f"{first_name} {last_name}",  # Adding full name for display
         "dob": dob.strftime("%Y-%m-%d"),
-        "class": str(random.randint(1, 12)),  # Classes 1 through 12
-        "session": random.choice(sessions),
+        "class": student_class,
+        "session": session,
         "created_date": created.strftime("%Y-%m-%d")
     }
-    sample_students.append(student)
-
-# Write data to JSON file
-output_file = "student_data.json"
-with open(output_file, 'w') as file:
-    json.dump(sample_students, file, indent=4)
-
-print(f"Successfully generated {len(sample_students)} student records and saved to {output_file}")
-print("\n" + "="*80)
-print(f"{'Name':<25} {'Date of Birth':<15} {'Class':<8} {'Academic Session':<15} {'Registration Date':<15}")
-print("="*80)
-for i, student in enumerate(sample_students[:10], 1):  # Show 10 examples
-    print(f"{student['name']:<25} {student['dob']:<15} {student['class']:<8} {student['session']:<15} {student['created_date']:<15}")
-print("="*80)
-print("...")
-
-# Display total count
-print(f"\nTotal students in JSON file: {len(sample_students)}")
-print("\nFields for each student record:")
-print("- Name")
-print("- Date of Birth (DOB)")
-print("- Class")
-print("- Academic Session")
-print("- Registration Date")
-
-# Provide information about MongoDB insertion
-print("\nIf you need to import this data into MongoDB, run:")
-print(f"mongoimport --db student_db --collection students --file {output_file} --jsonArray")
+
+
+def generate_chunk(task):
+    """Generate one chunk of records, serialized for `output_format`.
+
+    Runs in worker processes, so it only takes and returns picklable values.
+    """
+    chunk_index, count, seed, as_of, class_weights, session_weights, output_format = task
+    rng = random.Random(f"{seed}-{chunk_index}")
+    as_of = datetime.strptime(as_of, "%Y-%m-%d")
+    students = [make_student(rng, as_of, class_weights, session_weights) for _ in range(count)]
+    if output_format == "mongo":
+        for student in students:
+            student.update(derived_fields(student))
+        return students
+    return [json.dumps(student) for student in students]
+
+
+def generate_chunks(count, seed=DEFAULT_SEED, as_of=DEFAULT_AS_OF, class_weights=None,
+                    session_weights=None, output_format="ndjson", workers=1):
+    """Yield chunks of generated records in order.
+
+    With several workers at most two chunks per worker are in flight, so
+    memory stays bounded however many records are requested.
+    """
+    tasks = (
+        (index, min(CHUNK_SIZE, count - start), seed, as_of, class_weights, session_weights, output_format)
+        for index, start in enumerate(range(0, count, CHUNK_SIZE))
+    )
+    if workers <= 1:
+        for task in tasks:
+            yield generate_chunk(task)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = []
+        for task in tasks:
+            pending.append(pool.submit(generate_chunk, task))
+            if len(pending) >= workers * 2:
+                yield pending.pop(0).result()
+        for future in pending:
+            yield future.result()
+
+
+def generate_students(count, seed=DEFAULT_SEED, **options):
+    """Yield `count` student records one at a time."""
+    for chunk in generate_chunks(count, seed, output_format="mongo", **options):
+        yield from chunk
+
+
+def write_file(chunks, file, output_format):
+    """Write serialized chunks as NDJSON or as one JSON array; returns the record count."""
+    written = 0
+    if output_format == "json":
+        file.write("[\n")
+    for chunk in chunks:
+        if output_format == "json":
+            file.write((",\n" if written else "") + ",\n".join(chunk))
+        else:
+            file.write("\n".join(chunk) + "\n")
+        written += len(chunk)
+    if output_format == "json":
+        file.write("\n]\n")
+    return written
+
+
+def write_mongo(chunks, collection, batch_size):
+    """Insert generated records in batches; returns the record count."""
+    written = 0
+    batch = []
+    for chunk in chunks:
+        for student in chunk:
+            batch.append(student)
+            if len(batch) >= batch_size:
+                collection.insert_many(batch, ordered=False)
+                written += len(batch)
+                batch = []
+    if batch:
+        collection.insert_many(batch, ordered=False)
+        written += len(batch)
+    return written
+
+
+def print_summary(examples, total, destination):
+    print(f"Successfully generated {total} student records and saved to {destination}")
+    print("\n" + "="*80)
+    print(f"{'Name':<25} {'Date of Birth':<15} {'Class':<8} {'Academic Session':<15} {'Registration Date':<15}")
+    print("="*80)
+    for student in examples:  # Show 10 examples
+        print(f"{student['name']:<25} {student['dob']:<15} {student['class']:<8} {student['session']:<15} {student['created_date']:<15}")
+    print("="*80)
+    print("...")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate synthetic student records")
+    parser.add_argument("--count", type=int, default=50, help="Number of students to generate")
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED, help="Random seed")
+    parser.add_argument("--as-of", default=DEFAULT_AS_OF, help="Latest registration date (YYYY-MM-DD)")
+    parser.add_argument("--format", choices=["json", "ndjson"], default="json",
+                        help="JSON array or newline delimited JSON (import_students.py reads both)")
+    parser.add_argument("--output", help="Output file, '-' for stdout (default: student_data.json/.ndjson)")
+    parser.add_argument("--workers", type=int, default=1, help="Generate chunks in this many processes")
+    parser.add_argument("--mongo-uri", help="Insert into MongoDB instead of writing a file")
+    parser.add_argument("--db", default="student_db")
+    parser.add_argument("--collection", default="students")
+    parser.add_argument("--batch-size", type=int, default=1000, help="Documents per insert_many")
+    parser.add_argument("--class-weights", type=lambda value: parse_weights(value, classes),
+                        help='Relative class frequencies, e.g. "9:3,10:3,11:2,12:1"')
+    parser.add_argument("--session-weights", type=lambda value: parse_weights(value, sessions),
+                        help='Relative session frequencies, e.g. "2024-2025:4,2023-2024:1"')
+    args = parser.parse_args(argv)
+
+    options = dict(seed=args.seed, as_of=args.as_of, class_weights=args.class_weights,
+                   session_weights=args.session_weights, workers=args.workers)
+    # Keep the first records for the summary printed at the end
+    examples = []
+
+    def keep_examples(chunks):
+        for chunk in chunks:
+            if len(examples) < 10:
+                examples.extend(chunk[:10 - len(examples)])
+            yield chunk
+
+    if args.mongo_uri:
+        from pymongo import MongoClient
+        client = MongoClient(args.mongo_uri)
+        chunks = keep_examples(generate_chunks(args.count, output_format="mongo", **options))
+        total = write_mongo(chunks, client[args.db][args.collection], args.batch_size)
+        # Running instances must recount their summary and stop answering 304 for the old data
+        from import_students import bump_version, rebuild_stats
+        rebuild_stats(client[args.db], client[args.db][args.collection])
+        bump_version(client[args.db])
+        client.close()
+        destination = f"{args.db}.{args.collection}"
+    else:
+        output_file = args.output or ("student_data.ndjson" if args.format == "ndjson" else "student_data.json")
+        chunks = keep_examples(generate_chunks(args.count, output_format=args.format, **options))
+        if output_file == "-":
+            total = write_file(chunks, sys.stdout, args.format)
+            return
+        with open(output_file, "w") as file:
+            total = write_file(chunks, file, args.format)
+        destination = output_file
+        examples = [json.loads(student) for student in examples]
+
+    print_summary(examples, total, destination)
+
+    # Display total count
+    print(f"\nTotal students written: {total}")
+    print("\nFields for each student record:")
+    print("- Name")
+    print("- Date of Birth (DOB)")
+    print("- Class")
+    print("- Academic Session")
+    print("- Registration Date")
+
+    if not args.mongo_uri:
+        # import_students.py also refreshes the API's headcount summary and data version
+        print("\nIf you need to import this data into MongoDB, run:")
+        print(f"python import_students.py {destination}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""Converting student documents to API responses.
+
+Every route formats students with format_student() and reads them with
+projection(), so MongoDB only sends (and the driver only decodes) the
+fields a response contains. The CSV export turns the same formatted
+students into rows with csv_row().
+
+OrjsonProvider replaces the stdlib json behind jsonify() (Flask and Quart)
+with orjson, which encodes responses several times faster; `python benchmark.py --serializers`
+measures the per-record cost of each step. If orjson isn't installed the
+app keeps Flask's default provider.
+"""
+import csv
+import io
+import json
+
+from student_fields import STUDENT_FIELDS
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def projection(fields=None):
+    """MongoDB projection returning only `fields` (default: every API field) and _id."""
+    return {field: 1 for field in fields or STUDENT_FIELDS}
+
+
+def format_student(student, fields=None):
+    """Convert a student document into its API representation."""
+    formatted = {"id": str(student["_id"])}
+    for field in fields or STUDENT_FIELDS:
+        formatted[field] = student.get(field, "")
+    return formatted
+
+
+# Spreadsheets run cells starting with these characters as formulas
+FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")
+
+
+def csv_header(fields=None):
+    return ["id", *(fields or STUDENT_FIELDS)]
+
+
+def csv_row(student, fields=None):
+    """A formatted student as a CSV row, in csv_header() order."""
+    row = []
+    for field in csv_header(fields):
+        value = str(student.get(field, ""))
+        if value.startswith(FORMULA_PREFIXES):
+            value = "'" + value
+        row.append(value)
+    return row
+
+
+def csv_text(rows):
+    """Render rows as CSV text (RFC 4180: quoted as needed, CRLF line ends)."""
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    return buffer.getvalue()
+
+
+def loads(data):
+    """Parse JSON text or bytes, with orjson when available."""
+    return orjson.loads(data) if orjson else json.loads(data)
+
+
+class OrjsonProvider:
+    """JSON provider methods using orjson, with the same output as the default.
+
+    Mixed into Flask's or Quart's DefaultJSONProvider by init_app() and
+    init_async_app(). Keys are sorted and values orjson can't encode natively
+    (dates are passed through on purpose) go through the framework's default
+    conversion, so responses only differ in whitespace and in not escaping
+    non-ASCII characters.
+    """
+
+    option = (orjson.OPT_SORT_KEYS | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+              if orjson else 0)
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default, option=self.option).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        option = self.option
+        if (self.compact is None and self._app.debug) or self.compact is False:
+            option |= orjson.OPT_INDENT_2
+        body = orjson.dumps(obj, default=self.default, option=option) + b"\n"
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+
+def init_app(app):
+    """Serialize a Flask app's JSON with orjson, if installed."""
+    if orjson:
+        from flask.json.provider import DefaultJSONProvider
+        app.json = type("FlaskOrjsonProvider", (OrjsonProvider, DefaultJSONProvider), {})(app)
+
+
+def init_async_app(app):
+    """Serialize a Quart app's JSON with orjson, if installed."""
+    if orjson:
+        from quart.json.provider import DefaultJSONProvider
+        app.json = type("QuartOrjsonProvider", (OrjsonProvider, DefaultJSONProvider), {})(app)
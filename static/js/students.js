@@ -1,127 +1,233 @@
-// JavaScript for handling student data on the frontend
+// Students page: loads the list one page at a time as the user scrolls,
+// searches on the server as the user types and removes deleted rows locally.
+
+const PAGE_SIZE = 50;
+const SEARCH_LIMIT = 100;
+const SEARCH_DELAY_MS = 300;
+
+const state = {
+    nextCursor: null,   // Cursor of the next page, null once the list is complete
+    loading: false,
+    searching: false,   // Showing search results instead of the paged list
+    count: 0,
+    controller: null,   // Aborts the request in flight when the view changes
+    deleteId: null
+};
+
+let deleteModal;
+let searchTimer;
 
 document.addEventListener('DOMContentLoaded', function() {
-    // Load students when the page loads
-    loadStudents();
-    
-    // Add event listener for the refresh button if it exists
-    const refreshButton = document.getElementById('refresh-students');
-    if (refreshButton) {
-        refreshButton.addEventListener('click', loadStudents);
-    }
-    
-    // Add event listener for the add student form if it exists
-    const addStudentForm = document.getElementById('add-student-form');
-    if (addStudentForm) {
-        addStudentForm.addEventListener('submit', addStudent);
+    deleteModal = new bootstrap.Modal(document.getElementById('deleteModal'));
+
+    document.getElementById('search-input').addEventListener('input', function() {
+        clearTimeout(searchTimer);
+        searchTimer = setTimeout(search, SEARCH_DELAY_MS);
+    });
+    document.getElementById('search-button').addEventListener('click', search);
+    document.getElementById('reset-button').addEventListener('click', function() {
+        document.getElementById('search-input').value = '';
+        resetList();
+    });
+    document.getElementById('load-more').addEventListener('click', loadNextPage);
+    document.getElementById('confirm-delete').addEventListener('click', confirmDelete);
+
+    // One listener for every delete button, including rows added later
+    document.getElementById('students-list').addEventListener('click', function(event) {
+        const button = event.target.closest('.delete-btn');
+        if (button) {
+            state.deleteId = button.dataset.id;
+            deleteModal.show();
+        }
+    });
+
+    // Load the next page when the end of the table scrolls into view
+    if ('IntersectionObserver' in window) {
+        const observer = new IntersectionObserver(entries => {
+            if (entries[0].isIntersecting) {
+                loadNextPage();
+            }
+        }, { rootMargin: '400px' });
+        observer.observe(document.getElementById('list-end'));
     }
+
+    resetList();
 });
 
 /**
- * Load students from API and display them
+ * Start a new view: cancel the request in flight and clear the table
  */
-function loadStudents() {
-    const studentsList = document.getElementById('students-list');
-    if (!studentsList) return;
-    
-    // Show loading state
-    studentsList.innerHTML = '<p>Loading students...</p>';
-    
-    fetch('/api/students')
-        .then(response => {
-            if (!response.ok) {
-                throw new Error(`HTTP error! Status: ${response.status}`);
+function startView(searching) {
+    if (state.controller) {
+        state.controller.abort();
+    }
+    state.controller = new AbortController();
+    state.nextCursor = null;
+    state.loading = false;
+    state.searching = searching;
+    state.count = 0;
+    document.getElementById('students-list').replaceChildren();
+    updateStatus();
+    return state.controller.signal;
+}
+
+/**
+ * Show the first page of all students
+ */
+function resetList() {
+    startView(false);
+    fetchPage(null);
+}
+
+/**
+ * Append the next page, if there is one and none is loading
+ */
+function loadNextPage() {
+    if (!state.searching && state.nextCursor && !state.loading) {
+        fetchPage(state.nextCursor);
+    }
+}
+
+function fetchPage(cursor) {
+    const params = new URLSearchParams({ limit: PAGE_SIZE });
+    if (cursor) {
+        params.set('after', cursor);
+    }
+    state.loading = true;
+    updateStatus();
+    const signal = state.controller.signal;
+    fetch(`/api/students?${params}`, { signal })
+        .then(response => response.json())
+        .then(page => {
+            if (signal.aborted) return;
+            appendStudents(page.students);
+            state.nextCursor = page.next_cursor;
+            state.loading = false;
+            updateStatus();
+            // The observer only fires on changes: keep going while the end is still in view
+            if (endInView()) {
+                loadNextPage();
             }
-            return response.json();
         })
-        .then(students => {
-            displayStudents(students);
-        })
-        .catch(error => console.error('Error loading students:', error));
+        .catch(error => {
+            if (error.name !== 'AbortError') {
+                state.loading = false;
+                updateStatus();
+                handleApiError(error);
+            }
+        });
+}
+
+function endInView() {
+    const rect = document.getElementById('list-end').getBoundingClientRect();
+    return rect.top < window.innerHeight + 400;
 }
 
 /**
- * Display students in the DOM
+ * Search students by name on the server
  */
-function displayStudents(students) {
-    const studentsList = document.getElementById('students-list');
-    if (!studentsList) return;
-    
-    if (students.length === 0) {
-        studentsList.innerHTML = '<p>No students found.</p>';
+function search() {
+    clearTimeout(searchTimer);
+    const term = document.getElementById('search-input').value.trim();
+    if (term === '') {
+        resetList();
         return;
     }
-    
-    let html = '<table class="table"><thead><tr>' +
-        '<th>ID</th>' +
-        '<th>First Name</th>' +
-        '<th>Last Name</th>' +
-        '<th>Date of Birth</th>' +
-        '<th>Class</th>' +
-        '<th>Session</th>' +
-        '<th>Actions</th>' +
-        '</tr></thead><tbody>';
-        
-    students.forEach(student => {
-        html += `<tr>
-            <td>${student.id}</td>
-            <td>${student.first_name}</td>
-            <td>${student.last_name}</td>
-            <td>${student.dob}</td>
-            <td>${student.class}</td>
-            <td>${student.session}</td>
-            <td>
-                <button onclick="viewStudent('${student.id}')" class="btn btn-info btn-sm">View</button>
-                <button onclick="deleteStudent('${student.id}')" class="btn btn-danger btn-sm">Delete</button>
-            </td>
-        </tr>`;
+
+    const signal = startView(true);
+    state.loading = true;
+    updateStatus();
+    fetch(`/api/students/name/${encodeURIComponent(term)}?limit=${SEARCH_LIMIT}`, { signal })
+        .then(response => response.json())
+        .then(data => {
+            if (signal.aborted) return;
+            // No match is a 404 with an error message
+            appendStudents(data.error ? [] : data);
+            state.loading = false;
+            updateStatus();
+        })
+        .catch(error => {
+            if (error.name !== 'AbortError') {
+                state.loading = false;
+                updateStatus();
+                handleApiError(error);
+            }
+        });
+}
+
+/**
+ * Add rows for `students` to the end of the table in one DOM update
+ */
+function appendStudents(students) {
+    const fragment = document.createDocumentFragment();
+    students.forEach(student => fragment.appendChild(studentRow(student)));
+    document.getElementById('students-list').appendChild(fragment);
+    state.count += students.length;
+}
+
+function studentRow(student) {
+    const row = document.createElement('tr');
+    row.dataset.id = student.id;
+    const values = [student.id, student.first_name, student.last_name, student.dob,
+                    student.class, student.session, student.created_date];
+    values.forEach(value => {
+        const cell = document.createElement('td');
+        // textContent, so names are never parsed as HTML
+        cell.textContent = value || 'N/A';
+        row.appendChild(cell);
     });
-    
-    html += '</tbody></table>';
-    studentsList.innerHTML = html;
+
+    const actions = document.createElement('td');
+    const button = document.createElement('button');
+    button.className = 'btn btn-sm btn-danger delete-btn';
+    button.dataset.id = student.id;
+    button.textContent = 'Delete';
+    actions.appendChild(button);
+    row.appendChild(actions);
+    return row;
 }
 
 /**
- * Delete a student
+ * Show the number of students loaded, the loading state and the pager
  */
-function deleteStudent(id) {
-    if (confirm('Are you sure you want to delete this student?')) {
-        fetch(`/api/students/${id}`, {
-            method: 'DELETE'
-        })
-        .then(response => {
-            if (!response.ok) {
-                throw new Error(`HTTP error! Status: ${response.status}`);
-            }
-            return response.json();
-        })
-        .then(data => {
-            alert('Student deleted successfully');
-            loadStudents(); // Reload the list
-        })
-        .catch(error => console.error('Error deleting student:', error));
+function updateStatus() {
+    const status = document.getElementById('list-status');
+    const more = !state.searching && state.nextCursor !== null;
+    if (state.loading) {
+        status.textContent = 'Loading students...';
+    } else if (state.searching) {
+        status.textContent = state.count >= SEARCH_LIMIT
+            ? `Showing the first ${state.count} matches`
+            : `${state.count} matching student${state.count === 1 ? '' : 's'}`;
+    } else {
+        status.textContent = `Showing ${state.count} student${state.count === 1 ? '' : 's'}${more ? '' : ' (all loaded)'}`;
     }
+    document.getElementById('load-more').style.display = more && !state.loading ? 'inline-block' : 'none';
+    document.getElementById('no-students').style.display = !state.loading && state.count === 0 ? 'block' : 'none';
 }
 
 /**
- * View student details
+ * Delete a student and remove its row, without reloading the list
  */
-function viewStudent(id) {
-    fetch(`/api/students/${id}`)
-        .then(response => {
-            if (!response.ok) {
-                throw new Error(`HTTP error! Status: ${response.status}`);
+function confirmDelete() {
+    const id = state.deleteId;
+    if (!id) return;
+
+    fetch(`/api/students/${id}`, { method: 'DELETE' })
+        .then(response => response.json())
+        .then(data => {
+            deleteModal.hide();
+            state.deleteId = null;
+            if (data.error) {
+                handleApiError(data.error);
+            }
+            // Gone either way: deleted now, or by someone else earlier
+            const row = document.querySelector(`#students-list tr[data-id="${CSS.escape(id)}"]`);
+            if (row) {
+                row.remove();
+                state.count -= 1;
+                updateStatus();
             }
-            return response.json();
-        })
-        .then(student => {
-            // Show student details (could be in a modal)
-            alert(`Student Details:\n
-                ID: ${student.id}\n
-                Name: ${student.first_name} ${student.last_name}\n
-                DOB: ${student.dob}\n
-                Class: ${student.class}\n
-                Session: ${student.session}`);
         })
-        .catch(error => console.error('Error loading student details:', error));
+        .catch(error => handleApiError(error));
 }
@@ -0,0 +1,322 @@
+"""Student record fields shared by the API and the data tools.
+
+The record helpers (validation and building) are used by both the Flask
+app and the async app, so the two store the same documents; serializers.py
+formats them for responses.
+
+Derived fields are stored alongside the user supplied fields so queries
+can be served from indexes. They are computed on write by the API, the
+import tools and the backfill migrations, so they all go through this
+module.
+"""
+import base64
+import json
+import re
+from datetime import date, datetime, timedelta
+
+from bson.objectid import ObjectId
+
+# Fields a client must supply when adding a student
+REQUIRED_FIELDS = ["first_name", "last_name", "dob", "class", "session"]
+
+# Fields returned for every student, in response order
+STUDENT_FIELDS = ["first_name", "last_name", "dob", "class", "session", "created_date"]
+
+# Fields identifying the same student across re-imports (bulk upsert mode)
+NATURAL_KEY = ["first_name", "last_name", "dob"]
+
+# Filters accepted by GET /api/students (`?class=10`, `?dob[gte]=2005-01-01`)
+# and the operators allowed on each field
+FILTER_OPERATORS = {
+    "class": ["eq", "in"],
+    "session": ["eq", "in"],
+    "dob": ["eq", "gt", "gte", "lt", "lte"],
+    "created_date": ["eq", "gt", "gte", "lt", "lte"],
+}
+DATE_FIELDS = ["dob", "created_date"]
+
+# Fields GET /api/students can sort on (`?sort=dob`, `?sort=-created_date`);
+# _id breaks ties so the order, and the page cursors, are stable
+SORT_FIELDS = ["dob", "created_date"]
+DEFAULT_SORT = [("_id", 1)]
+
+
+def normalize_name(name):
+    """Lowercase a name and collapse whitespace so it can be matched exactly."""
+    return " ".join(str(name).split()).lower()
+
+
+def name_keys(first_name, last_name):
+    """Return the normalized name fields used by the name search indexes."""
+    return {
+        "first_name_lower": normalize_name(first_name),
+        "last_name_lower": normalize_name(last_name),
+    }
+
+
+def parse_date(value):
+    """Parse a YYYY-MM-DD string into a date, or None if it isn't one."""
+    try:
+        return datetime.strptime(str(value), "%Y-%m-%d").date()
+    except ValueError:
+        return None
+
+
+def birth_fields(dob):
+    """Return the date fields derived from a dob string (None when it isn't a date).
+
+    dob_date is a BSON date for age ranges; birth_month and birth_day
+    back the upcoming birthday queries.
+    """
+    day = parse_date(dob)
+    if day is None:
+        return {"dob_date": None, "birth_month": None, "birth_day": None}
+    return {
+        "dob_date": datetime(day.year, day.month, day.day),
+        "birth_month": day.month,
+        "birth_day": day.day,
+    }
+
+
+def derived_fields(student):
+    """Return every derived field for a student record."""
+    fields = name_keys(student.get("first_name", ""), student.get("last_name", ""))
+    fields.update(birth_fields(student.get("dob", "")))
+    return fields
+
+
+# Fields managed by the application, never returned by the API
+DERIVED_FIELDS = ["first_name_lower", "last_name_lower", "dob_date", "birth_month", "birth_day"]
+
+# Order of age range results, oldest first; _id breaks ties
+AGE_SORT = [("dob_date", 1), ("_id", 1)]
+
+# Longest upcoming birthday window; longer ones would see a date twice
+MAX_BIRTHDAY_DAYS = 365
+
+
+# Order of each month's upcoming birthdays
+BIRTHDAY_SORT = [("birth_day", 1), ("_id", 1)]
+
+# Oldest age accepted by the age range queries
+MAX_AGE = 150
+
+
+def years_before(day, years):
+    """The same day `years` earlier; 29 February becomes the 28th in common years."""
+    try:
+        return day.replace(year=day.year - years)
+    except ValueError:
+        return day.replace(year=day.year - years, day=28)
+
+
+def age_query(min_age=0, max_age=None, today=None):
+    """Query on dob_date for students aged `min_age` to `max_age` (inclusive) on `today`."""
+    today = today or date.today()
+    # Old enough: born on or before today, `min_age` years ago
+    latest = years_before(today, min_age)
+    conditions = {"$lte": datetime(latest.year, latest.month, latest.day)}
+    if max_age is not None:
+        # Not too old: born after today, `max_age + 1` years ago
+        earliest = years_before(today, max_age + 1)
+        conditions["$gt"] = datetime(earliest.year, earliest.month, earliest.day)
+    return {"dob_date": conditions}
+
+
+def is_leap(year):
+    return year % 4 == 0 and (year % 100 != 0 or year % 400 == 0)
+
+
+def birthday_ranges(start, days):
+    """Queries for birthdays from `start` through the following `days - 1` days, one per month in date order.
+
+    Each query is a range on (birth_month, birth_day), so it is answered
+    from that index. Birthdays on 29 February count as the 28th in common
+    years.
+    """
+    end = start + timedelta(days=days - 1)
+    ranges = []
+    day = start
+    while day <= end:
+        next_month = (day.replace(day=1) + timedelta(days=32)).replace(day=1)
+        last = min(end, next_month - timedelta(days=1))
+        last_day = last.day
+        if last.month == 2 and last_day == 28 and not is_leap(last.year):
+            last_day = 29
+        ranges.append({"birth_month": day.month, "birth_day": {"$gte": day.day, "$lte": last_day}})
+        day = last + timedelta(days=1)
+    return ranges
+
+
+def next_birthday(document, today):
+    """(date of the next birthday on or after `today`, age turned that day) for a stored student."""
+    year = today.year
+    if (document["birth_month"], document["birth_day"]) < (today.month, today.day):
+        year += 1
+    try:
+        birthday = date(year, document["birth_month"], document["birth_day"])
+    except ValueError:
+        birthday = date(year, 2, 28)
+    return birthday, year - document["dob_date"].year
+
+
+def validate_student(data):
+    """Return an error message if `data` can't be stored as a student, else None."""
+    if not isinstance(data, dict):
+        return "Record must be a JSON object"
+    missing = [field for field in REQUIRED_FIELDS if field not in data]
+    if missing:
+        return f"Missing required fields: {', '.join(missing)}"
+    return None
+
+
+def build_student(data, created_date=None):
+    """Build the public fields of a new student from request data."""
+    return {
+        "first_name": data["first_name"],
+        "last_name": data["last_name"],
+        "dob": data["dob"],
+        "class": data["class"],
+        "session": data["session"],
+        "created_date": created_date or datetime.now().strftime("%Y-%m-%d")
+    }
+
+
+def student_document(student):
+    """Return the stored document for a student, including derived fields."""
+    return dict(student, **derived_fields(student))
+
+
+def parse_fields(value):
+    """Parse a comma separated `fields=` parameter, or None if not given."""
+    if not value:
+        return None
+    fields = [field.strip() for field in value.split(",") if field.strip()]
+    unknown = [field for field in fields if field not in STUDENT_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    return fields
+
+
+def parse_filters(args):
+    """Translate filter parameters into a MongoDB query.
+
+    `args` maps parameter names to lists of values (e.g. request.args.lists()).
+    Parameters that aren't student fields are ignored; filtering on a field
+    or with an operator that isn't allowed raises ValueError.
+    """
+    query = {}
+    for name, values in args:
+        match = re.fullmatch(r"(\w+)(?:\[(\w+)\])?", name)
+        if not match or match.group(1) not in STUDENT_FIELDS:
+            continue
+        field, operator = match.group(1), match.group(2) or "eq"
+        if field not in FILTER_OPERATORS:
+            raise ValueError(f"Can't filter on {field}")
+        if operator not in FILTER_OPERATORS[field]:
+            raise ValueError(f"Operator {operator} isn't allowed on {field} "
+                             f"(use {', '.join(FILTER_OPERATORS[field])})")
+        value = values[-1]
+        items = [item.strip() for item in value.split(",") if item.strip()] if operator == "in" else [value]
+        if field in DATE_FIELDS:
+            for item in items:
+                try:
+                    datetime.strptime(item, "%Y-%m-%d")
+                except ValueError:
+                    raise ValueError(f"{field} must be a date (YYYY-MM-DD)")
+        query.setdefault(field, {})[f"${operator}"] = items if operator == "in" else value
+    # Plain equality is the simplest form for the query planner
+    for field, conditions in query.items():
+        if list(conditions) == ["$eq"]:
+            query[field] = conditions["$eq"]
+    return query
+
+
+def parse_as_of(value):
+    """Parse `?as_of=YYYY-MM-DD`, the day ages and birthdays are counted from (default: today)."""
+    if not value:
+        return date.today()
+    day = parse_date(value)
+    if day is None:
+        raise ValueError("as_of must be a date (YYYY-MM-DD)")
+    return day
+
+
+def parse_age_range(args):
+    """Parse `?min=` and `?max=` (ages in years, inclusive) into (min_age, max_age or None)."""
+    try:
+        min_age = int(args.get("min") or 0)
+        max_age = int(args["max"]) if args.get("max") else None
+    except ValueError:
+        raise ValueError("min and max must be integers")
+    if min_age < 0 or (max_age is not None and max_age < min_age):
+        raise ValueError("Ages must satisfy 0 <= min <= max")
+    if max(min_age, max_age or 0) > MAX_AGE:
+        raise ValueError(f"Ages can't exceed {MAX_AGE}")
+    return min_age, max_age
+
+
+def parse_birthday_days(value, default=7):
+    """Parse `?days=`, the length of the upcoming birthday window including today."""
+    try:
+        days = int(value) if value else default
+    except ValueError:
+        raise ValueError("days must be an integer")
+    if not 1 <= days <= MAX_BIRTHDAY_DAYS:
+        raise ValueError(f"days must be between 1 and {MAX_BIRTHDAY_DAYS}")
+    return days
+
+
+def parse_sort(value):
+    """Parse `?sort=field` or `?sort=-field` into a MongoDB sort specification."""
+    if not value:
+        return DEFAULT_SORT
+    direction = -1 if value.startswith("-") else 1
+    field = value.lstrip("-+")
+    if field not in SORT_FIELDS:
+        raise ValueError(f"Can't sort on {field} (use {', '.join(SORT_FIELDS)})")
+    return [(field, direction), ("_id", direction)]
+
+
+def encode_cursor(document, sort):
+    """Cursor pointing after `document` in `sort` order.
+
+    The default order's cursor is the student id; sorted pages use an
+    opaque token holding the sort value and the id.
+    """
+    field = sort[0][0]
+    if field == "_id":
+        return str(document["_id"])
+    value = document.get(field)
+    if isinstance(value, datetime):
+        # Derived date fields (dob_date) travel as their ISO form
+        value = value.isoformat()
+    token = json.dumps([field, value, str(document["_id"])])
+    return base64.urlsafe_b64encode(token.encode()).decode().rstrip("=")
+
+
+def cursor_query(cursor, sort):
+    """Query matching the documents after `cursor` in `sort` order; ValueError if invalid."""
+    field, direction = sort[0]
+    operator = "$gt" if direction == 1 else "$lt"
+    if field == "_id":
+        if not ObjectId.is_valid(cursor):
+            raise ValueError("Invalid cursor")
+        return {"_id": {operator: ObjectId(cursor)}}
+    try:
+        token = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        cursor_field, value, student_id = json.loads(token)
+        student_id = ObjectId(student_id)
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if cursor_field != field:
+        raise ValueError("Cursor belongs to a different sort order")
+    if field == "dob_date" and value is not None:
+        try:
+            value = datetime.fromisoformat(value)
+        except (TypeError, ValueError):
+            raise ValueError("Invalid cursor")
+    return {"$or": [
+        {field: {operator: value}},
+        {field: value, "_id": {operator: student_id}}
+    ]}
@@ -0,0 +1,90 @@
+"""Materialized headcount summary shared by the Flask and async apps.
+
+The summary lives in the student_stats collection as one document per
+bucket, `{"_id": "class:10", "dimension": "class", "value": "10", "count": 42}`.
+Writes adjust the buckets with $inc; a rebuild recounts them from the
+students collection. These helpers build the operations and read the
+results; running them is up to the caller's driver.
+"""
+from collections import Counter
+
+from pymongo import UpdateOne
+
+# Dimensions of the summary and their response keys
+STATS_DIMENSIONS = {"class": "by_class", "session": "by_session", "month": "by_month"}
+
+# Counts every dimension in one pass over the students collection
+REBUILD_PIPELINE = [{"$facet": {
+    "class": [{"$group": {"_id": "$class", "count": {"$sum": 1}}}],
+    "session": [{"$group": {"_id": "$session", "count": {"$sum": 1}}}],
+    "month": [{"$group": {
+        "_id": {"$substrCP": [{"$ifNull": ["$created_date", ""]}, 0, 7]},
+        "count": {"$sum": 1}
+    }}]
+}}]
+
+
+def stats_buckets(student):
+    """Return the (dimension, value) summary buckets a student is counted in."""
+    month = (student.get("created_date") or "")[:7] or "unknown"
+    return [
+        ("total", "all"),
+        ("class", str(student.get("class", ""))),
+        ("session", str(student.get("session", ""))),
+        ("month", month)
+    ]
+
+
+def stats_updates(students, delta):
+    """Return the bulk_write operations adding `delta` to each student's buckets."""
+    counts = Counter()
+    for student in students:
+        counts.update(stats_buckets(student))
+    return [
+        UpdateOne(
+            {"_id": f"{dimension}:{value}"},
+            {"$inc": {"count": count * delta}, "$setOnInsert": {"dimension": dimension, "value": value}},
+            upsert=True
+        )
+        for (dimension, value), count in counts.items()
+    ]
+
+
+def rebuilt_buckets(groups):
+    """Turn the REBUILD_PIPELINE result into {bucket id: (dimension, value, count)}."""
+    buckets = {"total:all": ("total", "all", sum(group["count"] for group in groups["class"]))}
+    for dimension in STATS_DIMENSIONS:
+        for group in groups[dimension]:
+            value = str(group["_id"] if group["_id"] is not None else "")
+            if dimension == "month" and not value:
+                value = "unknown"
+            key = f"{dimension}:{value}"
+            previous = buckets.get(key, (dimension, value, 0))[2]
+            buckets[key] = (dimension, value, previous + group["count"])
+    return buckets
+
+
+def replace_operations(buckets):
+    """Return the bulk_write operations storing rebuilt buckets."""
+    # Replace bucket by bucket so readers never see an empty summary
+    return [
+        UpdateOne(
+            {"_id": key},
+            {"$set": {"dimension": dimension, "value": value, "count": count}},
+            upsert=True
+        )
+        for key, (dimension, value, count) in buckets.items()
+    ]
+
+
+def summarize(buckets):
+    """Build the API response from stored bucket documents."""
+    summary = {"total": 0}
+    for key in STATS_DIMENSIONS.values():
+        summary[key] = {}
+    for bucket in buckets:
+        if bucket["dimension"] == "total":
+            summary["total"] = bucket["count"]
+        else:
+            summary[STATS_DIMENSIONS[bucket["dimension"]]][bucket["value"]] = bucket["count"]
+    return summary
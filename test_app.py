@@ -1,10 +1,35 @@
+import os
+import io
+import csv
+import json
 import requests
 import pytest
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
-# Base URL for the live server
-BASE_URL = "http://localhost:5000"
+# Base URL for the live server. The same suite checks both implementations:
+# BASE_URL=http://localhost:8000 pytest test_app.py runs it against async_app
+BASE_URL = os.environ.get("BASE_URL", "http://localhost:5000")
+
+def test_health_endpoints_live():
+    """Test the liveness and readiness endpoints"""
+    response = requests.get(f"{BASE_URL}/healthz")
+    assert response.status_code == 200
+    assert response.json()["status"] == "ok"
+
+    response = requests.get(f"{BASE_URL}/readyz")
+    assert response.status_code == 200
+    assert response.json()["status"] == "ready"
+
+def test_metrics_live():
+    """Test that /metrics reports request counts per route"""
+    requests.get(f"{BASE_URL}/api/students/stats")
+    response = requests.get(f"{BASE_URL}/metrics")
+    assert response.status_code == 200
+    assert response.headers["Content-Type"].startswith("text/plain")
+    assert 'http_requests_total{method="GET",route="/api/students/stats",status="200"}' in response.text
+    assert "http_request_duration_seconds_bucket" in response.text
 
 def test_get_all_students_live():
     """Test retrieving all students from live server"""
@@ -12,6 +37,152 @@ def test_get_all_students_live():
     assert response.status_code == 200
     assert isinstance(response.json(), list)
 
+def test_get_students_paginated_live():
+    """Test cursor pagination and field projection on the students list"""
+    response = requests.get(f"{BASE_URL}/api/students", params={"limit": 2, "fields": "first_name,class"})
+    assert response.status_code == 200
+    page = response.json()
+    assert len(page["students"]) <= 2
+    for student in page["students"]:
+        assert set(student.keys()) == {"id", "first_name", "class"}
+
+    # Follow the cursor and make sure pages don't overlap
+    if page["next_cursor"]:
+        next_page = requests.get(f"{BASE_URL}/api/students", params={"limit": 2, "after": page["next_cursor"]}).json()
+        first_ids = {student["id"] for student in page["students"]}
+        assert not first_ids & {student["id"] for student in next_page["students"]}
+
+def test_get_students_invalid_params_live():
+    """Test that bad pagination parameters are rejected"""
+    assert requests.get(f"{BASE_URL}/api/students", params={"limit": 0}).status_code == 400
+    assert requests.get(f"{BASE_URL}/api/students", params={"after": "not-an-id"}).status_code == 400
+    assert requests.get(f"{BASE_URL}/api/students", params={"fields": "password"}).status_code == 400
+
+def test_filter_and_sort_students_live():
+    """Test server-side filters, sorting and sorted pagination"""
+    params = {"class": "10", "dob[gte]": "2000-01-01", "dob[lt]": "2011-01-01", "sort": "-dob"}
+    response = requests.get(f"{BASE_URL}/api/students", params=params)
+    assert response.status_code == 200
+    students = response.json()
+    assert all(student["class"] == "10" for student in students)
+    assert [student["dob"] for student in students] == sorted((student["dob"] for student in students), reverse=True)
+
+    # Paging through the sorted list returns the same students in the same order
+    paged = []
+    after = None
+    while True:
+        page = requests.get(f"{BASE_URL}/api/students", params=dict(params, limit=3, **({"after": after} if after else {}))).json()
+        paged.extend(page["students"])
+        after = page["next_cursor"]
+        if not after:
+            break
+    assert [student["id"] for student in paged] == [student["id"] for student in students]
+
+    assert requests.get(f"{BASE_URL}/api/students", params={"first_name": "John"}).status_code == 400
+    assert requests.get(f"{BASE_URL}/api/students", params={"class[gt]": "5"}).status_code == 400
+    assert requests.get(f"{BASE_URL}/api/students", params={"sort": "last_name"}).status_code == 400
+
+def test_stream_students_live():
+    """Test streaming all students as NDJSON"""
+    response = requests.get(f"{BASE_URL}/api/students", params={"stream": 1}, stream=True)
+    assert response.status_code == 200
+    assert response.headers["Content-Type"].startswith("application/x-ndjson")
+    for line in response.iter_lines():
+        if line:
+            assert "id" in json.loads(line)
+
+    # The Accept header selects the same mode
+    response = requests.get(f"{BASE_URL}/api/students", headers={"Accept": "application/x-ndjson"})
+    assert response.headers["Content-Type"].startswith("application/x-ndjson")
+
+def test_compression_live():
+    """Test that large and streamed responses are compressed and static files are cached"""
+    unique_name = f"Zip{int(time.time())}"
+    students = [{"first_name": unique_name, "last_name": f"N{i}", "dob": "2001-01-01", "class": "5",
+                 "session": "2023-2024"} for i in range(30)]
+    ids = [r["id"] for r in requests.post(f"{BASE_URL}/api/students/bulk", json=students).json()["results"]]
+
+    # requests sends Accept-Encoding: gzip, deflate and decompresses the body
+    response = requests.get(f"{BASE_URL}/api/students")
+    assert response.headers["Content-Encoding"] in ("gzip", "br")
+    assert "Accept-Encoding" in response.headers["Vary"]
+    assert len(response.json()) >= 30
+
+    response = requests.get(f"{BASE_URL}/api/students", params={"stream": 1})
+    assert response.headers["Content-Encoding"] in ("gzip", "br")
+    assert all("id" in json.loads(line) for line in response.iter_lines() if line)
+
+    response = requests.get(f"{BASE_URL}/api/students", headers={"Accept-Encoding": "identity"})
+    assert "Content-Encoding" not in response.headers
+
+    # Pages link to versioned static files, which can be cached for a long time
+    page = requests.get(f"{BASE_URL}/").text
+    assert "/static/css/style.css?v=" in page
+    path = page[page.index("/static/css/style.css?v="):].split('"')[0]
+    response = requests.get(f"{BASE_URL}{path}")
+    assert response.status_code == 200
+    assert response.headers["Content-Encoding"] in ("gzip", "br")
+    assert "immutable" in response.headers["Cache-Control"]
+    assert "background-color" in response.text
+
+    for student_id in ids:
+        requests.delete(f"{BASE_URL}/api/students/{student_id}")
+
+def test_export_csv_live():
+    """Test exporting filtered students as a CSV download"""
+    unique_name = f"Csv{int(time.time())}"
+    students = [
+        {"first_name": unique_name, "last_name": "One, Jr", "dob": "2001-01-01", "class": "7", "session": "2023-2024"},
+        {"first_name": unique_name, "last_name": "=SUM(A1)", "dob": "2001-01-02", "class": "7", "session": "2023-2024"}
+    ]
+    ids = [r["id"] for r in requests.post(f"{BASE_URL}/api/students/bulk", json=students).json()["results"]]
+
+    response = requests.get(f"{BASE_URL}/api/students/export.csv", params={"class": "7", "sort": "dob"})
+    assert response.status_code == 200
+    assert response.headers["Content-Type"].startswith("text/csv")
+    assert response.headers["Content-Disposition"].startswith("attachment; filename=")
+    rows = list(csv.reader(io.StringIO(response.content.decode("utf-8-sig"))))
+    assert rows[0] == ["id", "first_name", "last_name", "dob", "class", "session", "created_date"]
+    exported = [row for row in rows[1:] if row[0] in ids]
+    assert [row[2] for row in exported] == ["One, Jr", "'=SUM(A1)"]
+
+    response = requests.get(f"{BASE_URL}/api/students/export.csv", params={"first_name": unique_name})
+    assert response.status_code == 400
+
+    for student_id in ids:
+        requests.delete(f"{BASE_URL}/api/students/{student_id}")
+
+def test_conditional_get_live():
+    """Test that unchanged lists are answered with 304 Not Modified"""
+    response = requests.get(f"{BASE_URL}/api/students")
+    etag = response.headers["ETag"]
+
+    response = requests.get(f"{BASE_URL}/api/students", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+
+    # Any write changes the ETag
+    student_data = {"first_name": "Etag", "last_name": "Test", "dob": "2001-01-01", "class": "3", "session": "2023-2024"}
+    student_id = requests.post(f"{BASE_URL}/api/students", json=student_data).json().get("_id")
+    response = requests.get(f"{BASE_URL}/api/students", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+
+    requests.delete(f"{BASE_URL}/api/students/{student_id}")
+
+def test_student_stats_live():
+    """Test that the headcount summary follows adds and deletes"""
+    before = requests.get(f"{BASE_URL}/api/students/stats").json()
+    student_data = {"first_name": "Stats", "last_name": "Test", "dob": "2001-01-01", "class": "11", "session": "2023-2024"}
+    student_id = requests.post(f"{BASE_URL}/api/students", json=student_data).json().get("_id")
+
+    after = requests.get(f"{BASE_URL}/api/students/stats").json()
+    assert after["total"] == before["total"] + 1
+    assert after["by_class"]["11"] == before["by_class"].get("11", 0) + 1
+
+    requests.delete(f"{BASE_URL}/api/students/{student_id}")
+    rebuilt = requests.get(f"{BASE_URL}/api/students/stats", params={"rebuild": 1}).json()
+    assert rebuilt["total"] == before["total"]
+
 def test_add_student_live():
     """Test adding a new student to live server"""
     student_data = {
@@ -31,6 +202,119 @@ def test_add_student_live():
     if student_id:
         requests.delete(f"{BASE_URL}/api/students/{student_id}")
 
+def test_concurrent_adds_live():
+    """Test that simultaneous adds (group committed with INSERT_BATCHING=1) each get their own id"""
+    unique_name = f"Rush{int(time.time())}"
+
+    def add(i):
+        student = {"first_name": unique_name, "last_name": f"N{i}", "dob": "2001-05-15", "class": "9",
+                   "session": "2023-2024"}
+        response = requests.post(f"{BASE_URL}/api/students", json=student)
+        assert response.status_code == 201
+        return response.json()
+
+    with ThreadPoolExecutor(max_workers=20) as pool:
+        created = list(pool.map(add, range(40)))
+    ids = [student["_id"] for student in created]
+    assert len(set(ids)) == 40
+
+    for student in created:
+        response = requests.get(f"{BASE_URL}/api/students/{student['_id']}")
+        assert response.json()["last_name"] == student["last_name"]
+        requests.delete(f"{BASE_URL}/api/students/{student['_id']}")
+
+def test_admission_control_live():
+    """Test that a burst of list calls never blocks lookups by id, and shed requests say when to retry"""
+    student_data = {"first_name": "Admitted", "last_name": "Student", "dob": "2002-02-02", "class": "5", "session": "2023-2024"}
+    student_id = requests.post(f"{BASE_URL}/api/students", json=student_data).json().get("_id")
+
+    def call(url):
+        response = requests.get(url)
+        assert response.status_code in (200, 503)
+        if response.status_code == 503:
+            assert response.headers["Retry-After"] == "1"
+        return response.status_code
+
+    with ThreadPoolExecutor(max_workers=20) as pool:
+        heavy = [pool.submit(call, f"{BASE_URL}/api/students?limit=1000") for _ in range(40)]
+        lookups = [pool.submit(call, f"{BASE_URL}/api/students/{student_id}") for _ in range(10)]
+        assert all(future.result() == 200 for future in lookups)
+        assert 200 in [future.result() for future in heavy]
+
+    assert "admission_concurrency_limit" in requests.get(f"{BASE_URL}/metrics").text
+    requests.delete(f"{BASE_URL}/api/students/{student_id}")
+
+def test_bulk_add_students_live():
+    """Test adding several students in one request"""
+    unique_name = f"Bulk{int(time.time())}"
+    students = [
+        {"first_name": unique_name, "last_name": "One", "dob": "2001-01-01", "class": "5", "session": "2023-2024"},
+        {"first_name": unique_name},  # Missing required fields
+        {"first_name": unique_name, "last_name": "Two", "dob": "2001-01-02", "class": "5", "session": "2023-2024"}
+    ]
+    response = requests.post(f"{BASE_URL}/api/students/bulk", json=students)
+    assert response.status_code == 200
+    result = response.json()
+    assert result["inserted"] == 2
+    assert result["rejected"] == 1
+    assert [r["status"] for r in result["results"]] == ["inserted", "rejected", "inserted"]
+
+    # Re-importing in upsert mode updates the existing records
+    response = requests.post(f"{BASE_URL}/api/students/bulk", params={"upsert": 1}, json=[students[0]])
+    assert response.json()["updated"] == 1
+
+    for r in result["results"]:
+        if "id" in r:
+            requests.delete(f"{BASE_URL}/api/students/{r['id']}")
+
+def test_upsert_moves_student_between_filters_live():
+    """Test that an upserted student is found by its new fields only, on either storage backend"""
+    unique_name = f"Moved{int(time.time())}"
+    student = {"first_name": unique_name, "last_name": "Upsert", "dob": "2003-07-07", "class": "3", "session": "2023-2024"}
+    student_id = requests.post(f"{BASE_URL}/api/students/bulk", json=[student]).json()["results"][0]["id"]
+    created = requests.get(f"{BASE_URL}/api/students/{student_id}").json()
+    by_class = requests.get(f"{BASE_URL}/api/students/stats").json()["by_class"]
+
+    response = requests.post(f"{BASE_URL}/api/students/bulk", params={"upsert": 1}, json=[dict(student, **{"class": "4"})])
+    assert response.json()["updated"] == 1
+
+    def listed(class_name):
+        students = requests.get(f"{BASE_URL}/api/students", params={"class": class_name, "sort": "dob"}).json()
+        return [s for s in students if s["id"] == student_id]
+
+    assert not listed("3")
+    moved = listed("4")
+    assert moved and moved[0]["created_date"] == created["created_date"]
+    stats = requests.get(f"{BASE_URL}/api/students/stats").json()["by_class"]
+    assert stats.get("3", 0) == by_class.get("3", 0) - 1 and stats["4"] == by_class.get("4", 0) + 1
+    found = requests.get(f"{BASE_URL}/api/students/name/{unique_name} upsert").json()
+    assert found and found[0]["id"] == student_id
+
+    requests.delete(f"{BASE_URL}/api/students/{student_id}")
+
+def test_age_and_birthday_queries_live():
+    """Test the indexed age range and upcoming birthday endpoints"""
+    student_data = {"first_name": "Century", "last_name": "Student", "dob": "1901-03-15", "class": "12", "session": "2023-2024"}
+    student_id = requests.post(f"{BASE_URL}/api/students", json=student_data).json().get("_id")
+
+    def aged(as_of):
+        response = requests.get(f"{BASE_URL}/api/students/age", params={"min": 100, "max": 100, "as_of": as_of, "limit": 1000})
+        assert response.status_code == 200
+        return [student["id"] for student in response.json()["students"]]
+
+    assert student_id in aged("2001-03-15")
+    assert student_id not in aged("2001-03-14")
+
+    response = requests.get(f"{BASE_URL}/api/students/birthdays", params={"as_of": "2001-03-13", "days": 3, "limit": 1000})
+    assert response.status_code == 200
+    matches = [student for student in response.json()["students"] if student["id"] == student_id]
+    assert matches and matches[0]["next_birthday"] == "2001-03-15" and matches[0]["turning"] == 100
+    assert "dob_date" not in matches[0]
+
+    assert requests.get(f"{BASE_URL}/api/students/age", params={"min": 5, "max": 2}).status_code == 400
+    assert requests.get(f"{BASE_URL}/api/students/birthdays", params={"days": 400}).status_code == 400
+    requests.delete(f"{BASE_URL}/api/students/{student_id}")
+
 def test_get_student_by_id_live():
     """Test retrieving a specific student by ID"""
     # First create a student to retrieve
@@ -55,6 +339,69 @@ def test_get_student_by_id_live():
     # Clean up
     requests.delete(f"{BASE_URL}/api/students/{student_id}")
 
+def test_student_representation_consistent_live():
+    """Test that lookups by id, listing and name search return the same student JSON"""
+    student_data = {
+        "first_name": "Zoë",
+        "last_name": "Ångström",
+        "dob": "2004-02-29",
+        "class": "11",
+        "session": "2023-2024"
+    }
+    create_response = requests.post(f"{BASE_URL}/api/students", json=student_data)
+    assert create_response.status_code in [200, 201]
+    student_id = create_response.json().get("_id")
+
+    by_id = requests.get(f"{BASE_URL}/api/students/{student_id}").json()
+    assert by_id["first_name"] == "Zoë" and by_id["last_name"] == "Ångström"
+    assert set(by_id) == {"id", "first_name", "last_name", "dob", "class", "session", "created_date"}
+
+    listed = requests.get(f"{BASE_URL}/api/students", params={"class": "11", "session": "2023-2024"}).json()
+    assert [student for student in listed if student["id"] == student_id] == [by_id]
+
+    found = requests.get(f"{BASE_URL}/api/students/name/Ångström").json()
+    assert [student for student in found if student["id"] == student_id] == [by_id]
+
+    # Clean up
+    requests.delete(f"{BASE_URL}/api/students/{student_id}")
+
+def test_student_cache_live():
+    """Test that repeated lookups are served from the cache and deletes invalidate it"""
+    student_data = {
+        "first_name": "Cached",
+        "last_name": "Student",
+        "dob": "2003-03-03",
+        "class": "6",
+        "session": "2023-2024"
+    }
+    student_id = requests.post(f"{BASE_URL}/api/students", json=student_data).json().get("_id")
+
+    hits_before = requests.get(f"{BASE_URL}/api/cache/stats").json()["hits"]
+    assert requests.get(f"{BASE_URL}/api/students/{student_id}").status_code == 200
+    assert requests.get(f"{BASE_URL}/api/students/{student_id}").status_code == 200
+    assert requests.get(f"{BASE_URL}/api/cache/stats").json()["hits"] >= hits_before + 2
+
+    requests.delete(f"{BASE_URL}/api/students/{student_id}")
+    assert requests.get(f"{BASE_URL}/api/students/{student_id}").status_code == 404
+
+def test_change_stream_status_live():
+    """Test that writes are visible at once, whether or not the change stream runs"""
+    status = requests.get(f"{BASE_URL}/api/cache/stats").json()["change_stream"]
+    assert set(status) >= {"enabled", "watching", "changes", "reconnects"}
+
+    etag = requests.get(f"{BASE_URL}/api/students").headers["ETag"]
+    total = requests.get(f"{BASE_URL}/api/students/stats").json()["total"]
+    student_data = {"first_name": "Watched", "last_name": "Student", "dob": "2002-02-02", "class": "4", "session": "2023-2024"}
+    student_id = requests.post(f"{BASE_URL}/api/students", json=student_data).json().get("_id")
+
+    # Read twice: the first read may reload the mirrored summary, the second uses it
+    for _ in range(2):
+        assert requests.get(f"{BASE_URL}/api/students/stats").json()["total"] == total + 1
+        assert requests.get(f"{BASE_URL}/api/students").headers["ETag"] != etag
+
+    requests.delete(f"{BASE_URL}/api/students/{student_id}")
+    assert requests.get(f"{BASE_URL}/api/students/stats").json()["total"] == total
+
 def test_get_student_by_name_live():
     """Test retrieving students by name"""
     # Create a student with a unique name for testing
@@ -102,6 +449,29 @@ def test_get_student_by_name_live():
     # Clean up
     requests.delete(f"{BASE_URL}/api/students/{student_id}")
 
+def test_search_by_name_prefix_live():
+    """Test that name search is case insensitive, prefix based and escapes user input"""
+    unique_name = f"Prefixname{int(time.time())}"
+    student_data = {
+        "first_name": unique_name,
+        "last_name": "Search",
+        "dob": "2000-01-01",
+        "class": "10",
+        "session": "2023-2024"
+    }
+    create_response = requests.post(f"{BASE_URL}/api/students", json=student_data)
+    student_id = create_response.json().get("_id")
+
+    response = requests.get(f"{BASE_URL}/api/students/name/{unique_name[:-3].upper()}")
+    assert response.status_code == 200
+    assert any(student["id"] == student_id for student in response.json())
+
+    # Regex metacharacters are matched literally instead of causing an error
+    response = requests.get(f"{BASE_URL}/api/students/name/(unclosed")
+    assert response.status_code == 404
+
+    requests.delete(f"{BASE_URL}/api/students/{student_id}")
+
 def test_update_student_live():
     """Test updating student information"""
     # First create a student to update
@@ -212,15 +582,35 @@ def test_get_nonexistent_student_live():
     response = requests.get(f"{BASE_URL}/api/students/507f1f77bcf86cd799439011")
     assert response.status_code == 404
 
+def test_invalid_student_id_live():
+    """Test that ids that aren't ObjectIds are answered like unknown students"""
+    response = requests.get(f"{BASE_URL}/api/students/not-an-id")
+    assert response.status_code == 404
+
+    response = requests.delete(f"{BASE_URL}/api/students/not-an-id")
+    assert response.status_code == 404
+
+def test_unknown_route_and_wrong_method_live():
+    """Test that routing errors keep their status codes"""
+    response = requests.get(f"{BASE_URL}/api/no-such-route")
+    assert response.status_code == 404
+
+    response = requests.put(f"{BASE_URL}/api/students")
+    assert response.status_code == 405
+
+    response = requests.post(f"{BASE_URL}/api/students/stats", json={})
+    assert response.status_code == 405
+
 def test_web_pages_live():
     """Test that web pages load correctly"""
     # Test the home page
     response = requests.get(f"{BASE_URL}/")
     assert response.status_code == 200
     
-    # Test the students view page
+    # Test the students view page, which loads the list page by page
     response = requests.get(f"{BASE_URL}/web/students")
     assert response.status_code == 200
+    assert "js/students.js" in response.text
     
     # Test the add student page
     response = requests.get(f"{BASE_URL}/web/add_student")